@@ -0,0 +1,107 @@
+"""ローカルサーバーの合成ページで、シャードに分けた複数プロセスの取得とlakeへのまとめを計測する
+
+    python -m benchmark.bench_backfill --days 8 --games 3 --workers 1 4
+
+プロセス数ごとに空のlakeへ取得し、かかった時間、lakeの行数、game_idの重複の有無を表示する。
+最後に同じ期間をもう一度実行し、まとめ直しても行が増えないことを確認する。
+"""
+import argparse
+import contextlib
+import io
+import re
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+from omegaconf import OmegaConf
+
+from src.backfill import Backfill
+from src.lake import LakeReader
+from src.scraping import ScrapingSponavi
+from tests.pages import game_page, schedule_page, score_indexes, score_page
+from tests.utils import load_config
+
+from .stub_server import FaultyHandler, StubServer
+
+START_DATE = "2021-04-01"
+
+
+class BackfillSiteHandler(FaultyHandler):
+    """日付ごとにgames試合の終了した試合を返すハンドラ。試合番号は日付と連番"""
+    games = 3
+    indexes = score_indexes(n_batters=2)
+
+    def get_page(self, path):
+        m = re.search(r"/schedule/\?date=(\d{4})-(\d{2})-(\d{2})", path)
+        if m is not None:
+            return schedule_page([f"{''.join(m.groups())}{i:02d}" for i in range(1, self.games + 1)])
+        m = re.search(r"/game/(\d{4})(\d{2})(\d{2})\d{2}/top", path)
+        if m is not None:
+            return game_page("-".join(m.groups()), "finish")
+        m = re.search(r"/score\?index=(\d+)", path)
+        if m is not None and m.group(1) in self.indexes:
+            return score_page(self.indexes, m.group(1))
+
+        return None
+
+
+def make_scraper(url, work_dir, end_date, workers):
+    config = load_config()
+    config.merge_with(OmegaConf.load("config/config_fetch.yaml"))
+    config.merge_with(OmegaConf.load("config/config_backfill.yaml"))
+    config.url_domain = url + "/"
+    config.exec_output = True
+    config.exec_lake_format = "parquet"
+    config.cache = {"enable": False}
+    config.score_crawl.parallel = False
+    config.fetch.rate_per_host = 0
+    config.backfill.workers = workers
+    config.backfill.shards_per_sports = workers * 2
+    config.path_output_lake_parquet = work_dir + "/lake"
+    config.path_output_game_html = work_dir
+    config.path_state_db = work_dir + "/state.sqlite"
+    config.path_backfill = work_dir + "/backfill"
+
+    return ScrapingSponavi(config, START_DATE, end_date), config
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=8)
+    parser.add_argument("--games", type=int, default=3)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    end_date = (pd.Timestamp(START_DATE) + pd.Timedelta(days=args.days - 1)).strftime("%Y-%m-%d")
+    n_games = args.days * args.games
+    n_scores = n_games * (len(BackfillSiteHandler.indexes) - 1)
+    with StubServer(latency=args.latency, handler=BackfillSiteHandler, games=args.games) as server:
+        print(f"{START_DATE} - {end_date}, {n_games} games, {n_scores} score rows")
+        print(f"{'workers':>8s}{'sec':>8s}{'games':>8s}{'scores':>8s}{'dup ids':>9s}{'rerun rows':>12s}")
+        for workers in args.workers:
+            work_dir = tempfile.mkdtemp()
+            try:
+                scraper, config = make_scraper(server.url, work_dir, end_date, workers)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    Backfill.from_config(scraper, config).run(START_DATE, end_date)
+                seconds = time.perf_counter() - start
+
+                # 同じ期間をもう一度取得してまとめても行が増えないか
+                scraper, config = make_scraper(server.url, work_dir, end_date, workers)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    counts = Backfill.from_config(scraper, config).run(START_DATE, end_date)
+
+                reader = LakeReader(work_dir + "/lake")
+                df_game = reader.read("lake_game", columns=["game_id"])
+                df_score = reader.read("lake_score", columns=["game_id", "index"])
+                n_dup = df_game["game_id"].duplicated().sum() + df_score.duplicated().sum()
+                print(f"{workers:8d}{seconds:8.1f}{len(df_game):8d}{len(df_score):8d}{n_dup:9d}{sum(counts.values()):12d}")
+            finally:
+                shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""合成した複数シーズンのlakeで、datamartの全件集計と1日分の差分集計の時間を比較する
+
+    python -m benchmark.bench_datamart --seasons 5 --games 858 --events 300
+
+差分を日ごとに足し込んだ結果が全件集計と一致するかも確認する。
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from omegaconf import OmegaConf
+
+from src.datamart import TABLE_KEYS, Datamart
+from src.season_calendar import SeasonCalendar
+
+TEAM_IDS = ["npb1", "npb2", "npb3", "npb4", "npb5", "npb6", "npb7", "npb8", "npb9", "npb11", "npb12", "npb376"]
+RESULTS = np.array(["空振り三振", "見逃し三振", "レフト前ヒット", "ショートゴロ", "センターフライ", "四球", "ライトへホームラン", None], dtype=object)
+
+
+def make_lake(n_seasons, n_games, n_events, games_per_day=6, seed=0):
+    """シーズンごとにn_games試合、1試合n_events行のlake_gameとlake_scoreを作る"""
+    rng = np.random.default_rng(seed)
+    n_total = n_seasons * n_games
+    season = np.repeat(np.arange(2021 - n_seasons + 1, 2022), n_games)
+    day = np.tile(np.arange(n_games) // games_per_day, n_seasons)
+    game_date = pd.to_datetime(season.astype(str) + "-03-26") + pd.to_timedelta(day, unit="D")
+    teams = rng.permuted(np.tile(np.arange(len(TEAM_IDS)), (n_total, 1)), axis=1)[:, :2]
+    df_game = pd.DataFrame({
+        "game_id": [f"npb{s}{i:06d}" for s, i in zip(season, np.tile(np.arange(n_games), n_seasons))],
+        "game_date": game_date.strftime("%Y-%m-%d"),
+        "game_status": "finish",
+        "game_series": None,
+        "team_top_id": np.array(TEAM_IDS)[teams[:, 0]],
+        "team_bottom_id": np.array(TEAM_IDS)[teams[:, 1]],
+        "score_top": rng.integers(0, 10, n_total),
+        "score_bottom": rng.integers(0, 10, n_total),
+    })
+
+    n_rows = n_total * n_events
+    players = np.array([f"npb{1000000 + i}" for i in range(1000)], dtype=object)
+    sides = np.array(["右", "左"], dtype=object)
+    base = np.array(["/npb/player/1000001/top", None], dtype=object)
+    df_score = pd.DataFrame({
+        "game_id": np.repeat(df_game["game_id"].to_numpy(), n_events),
+        "index": np.tile(np.array([f"{i:07d}" for i in range(n_events)], dtype=object), n_total),
+        "result_main": RESULTS[rng.integers(0, len(RESULTS), n_rows)],
+        "batter_id": players[rng.integers(0, len(players), n_rows)],
+        "batter_side": sides[rng.integers(0, 2, n_rows)],
+        "pitcher_id": players[rng.integers(0, len(players), n_rows)],
+        "pitcher_side": sides[rng.integers(0, 2, n_rows)],
+        "base_1": base[rng.integers(0, 2, n_rows)],
+        "base_2": base[rng.integers(0, 2, n_rows)],
+        "base_3": base[rng.integers(0, 2, n_rows)],
+    })
+
+    return df_game, df_score
+
+
+def same_tables(a, b):
+    for name, keys in TABLE_KEYS.items():
+        x = a.tables[name].sort_values(keys, ignore_index=True)
+        y = b.tables[name].sort_values(keys, ignore_index=True)
+        if not x.astype(str).equals(y.astype(str)):
+            return False
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--games", type=int, default=858)
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--check-days", type=int, default=20, help="差分の一致を確認する日数")
+    args = parser.parse_args()
+
+    calendar = SeasonCalendar(OmegaConf.load("config/config_schedule.yaml").schedule)
+    df_game, df_score = make_lake(args.seasons, args.games, args.events)
+    print(f"{len(df_game)} games, {len(df_score)} score rows")
+
+    # 全件集計
+    start = time.perf_counter()
+    full = Datamart(calendar=calendar)
+    full.update(df_game, df_score)
+    full_seconds = time.perf_counter() - start
+
+    # 最終日以外を集計済みにしてから最終日だけ足し込む
+    last_date = df_game["game_date"].max()
+    datamart = Datamart(calendar=calendar)
+    datamart.update(df_game[df_game["game_date"] < last_date], df_score)
+    start = time.perf_counter()
+    n_games = datamart.update(df_game, df_score[df_score["game_id"].isin(df_game.loc[df_game["game_date"] == last_date, "game_id"])])
+    incremental_seconds = time.perf_counter() - start
+
+    print(f"full rebuild          {full_seconds:8.3f} sec")
+    print(f"incremental ({n_games} games) {incremental_seconds:8.3f} sec  x{full_seconds / incremental_seconds:.0f}")
+    print("incremental == full:", same_tables(datamart, full))
+
+    # 先頭のシーズンを日ごとに足し込んでも全件集計と一致するか
+    dates = sorted(df_game["game_date"].unique())[:args.check_days]
+    df_game_part = df_game[df_game["game_date"].isin(dates)]
+    df_score_part = df_score[df_score["game_id"].isin(df_game_part["game_id"])]
+    daily = Datamart(calendar=calendar)
+    for date in dates:
+        daily.update(df_game_part[df_game_part["game_date"] <= date], df_score_part)
+    once = Datamart(calendar=calendar)
+    once.update(df_game_part, df_score_part)
+    print(f"daily folds over {len(dates)} days == one pass:", same_tables(daily, once))
+
+
+if __name__ == "__main__":
+    main()
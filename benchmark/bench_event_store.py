@@ -0,0 +1,108 @@
+"""合成した複数シーズンの速報ページの行で、イベントストアの大きさと試合や選手ごとの取り出しの時間を計測する
+
+    python -m benchmark.bench_event_store --seasons 5 --games 858 --events 300 --lookups 200
+
+文字列のままのDataFrameのメモリとイベントストアのファイルの大きさ、シーズンごとの追記の時間を比べる。
+試合や選手ごとの行の取り出しを、DataFrameの真偽値での絞り込みと比べる。
+開き直したイベントストアから戻したDataFrameが元の行と一致するか、同じ行を追記しても増えないかも確認する。
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.event_store import EventStore
+
+from .bench_datamart import make_lake
+
+COMPARE_COLUMNS = ["game_id", "index", "result_main", "batter_id", "batter_side", "pitcher_id", "pitcher_side"]
+
+
+def dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def time_lookups(func, values):
+    """valuesごとにfuncを呼び、1回あたりの秒数と行数の合計を返す"""
+    start = time.perf_counter()
+    n = sum(func(value) for value in values)
+
+    return (time.perf_counter() - start) / len(values), n
+
+
+def same_rows(df_store, df_score):
+    """イベントストアから戻した行と元の行が同じか。欠損はNoneとnanを区別しない"""
+    df_store = df_store.sort_values(["game_id", "index"], ignore_index=True)
+    df_score = df_score.sort_values(["game_id", "index"], ignore_index=True)
+    for column in COMPARE_COLUMNS:
+        if not df_store[column].astype(object).fillna("").astype(str).equals(df_score[column].astype(object).fillna("").astype(str)):
+            return False
+    for i in range(1, 4):
+        if not np.array_equal(df_store[f"base_{i}"].notna().to_numpy(), df_score[f"base_{i}"].notna().to_numpy()):
+            return False
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--games", type=int, default=858)
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--lookups", type=int, default=200, help="取り出す試合と選手の数")
+    args = parser.parse_args()
+
+    df_game, df_score = make_lake(args.seasons, args.games, args.events)
+    df_object = df_score.astype(object)
+    print(f"{len(df_game)} games, {len(df_score)} score rows")
+
+    store_dir = tempfile.mkdtemp()
+    try:
+        # シーズンごとに追記する
+        store = EventStore(store_dir)
+        seasons = df_game["game_id"].str[3:7]
+        for season in sorted(seasons.unique()):
+            ids = df_game.loc[seasons == season, "game_id"]
+            start = time.perf_counter()
+            n = store.append(df_score[df_score["game_id"].isin(ids)])
+            print(f"append {season} {n:10d} rows {time.perf_counter() - start:8.3f} sec")
+        n_again = store.append(df_score[df_score["game_id"].isin(ids)])
+
+        print(f"object DataFrame {df_object.memory_usage(deep=True).sum() / 2**20:10.1f} MiB")
+        print(f"string DataFrame {df_score.memory_usage(deep=True).sum() / 2**20:10.1f} MiB")
+        print(f"event store      {dir_bytes(store_dir) / 2**20:10.1f} MiB on disk")
+
+        start = time.perf_counter()
+        store = EventStore(store_dir)
+        print(f"open             {time.perf_counter() - start:10.4f} sec")
+
+        rng = np.random.default_rng(0)
+        game_ids = rng.choice(df_game["game_id"].to_numpy(), args.lookups)
+        player_ids = rng.choice(df_score["batter_id"].unique(), args.lookups)
+        lookups = [
+            ("game", game_ids,
+             lambda x: len(store.game(x)["index"]),
+             lambda x: len(df_object[df_object["game_id"] == x])),
+            ("batter", player_ids,
+             lambda x: len(store.player(x, "batter")["index"]),
+             lambda x: len(df_object[df_object["batter_id"] == x])),
+        ]
+        for name, values, store_func, frame_func in lookups:
+            store_seconds, store_rows = time_lookups(store_func, values)
+            frame_seconds, frame_rows = time_lookups(frame_func, values)
+            print(f"{name:8s}slice  store {store_seconds * 1000:8.3f} ms  DataFrame {frame_seconds * 1000:8.3f} ms"
+                  f"  x{frame_seconds / store_seconds:.0f}  same rows: {store_rows == frame_rows}")
+
+        view = store.game(game_ids[0])["index"]
+        print("game slice is a memmap view:", isinstance(view, np.memmap))
+        print("round trip == lake_score:", same_rows(store.to_frame(), df_score))
+        print("rows appended again:", n_again)
+    finally:
+        shutil.rmtree(store_dir)
+
+
+if __name__ == "__main__":
+    main()
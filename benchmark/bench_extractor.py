@@ -0,0 +1,75 @@
+"""試合トップページの抽出をBeautifulSoup版とlxml版で比較する
+
+    python -m benchmark.bench_extractor --html-dir data/html/games --repeat 5
+
+html-dirの試合トップページ（save_htmlで保存したもの）すべてについて
+両者の結果が一致するかを確認し、1秒あたりのパース数を出力する。
+html-dirにページがなければtests/fixtures/html/gamesの合成ページを使う。
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+from src.scraping import ScrapingSponavi
+from tests.legacy import legacy_get_game_info
+from tests.utils import load_config, make_url, same
+
+FIXTURE_HTML_DIR = "tests/fixtures/html/games"
+
+
+def check_parity(ss, pages):
+    n_diff = 0
+    for file_path, html, url in pages:
+        expected = legacy_get_game_info(ss, html, url)
+        actual = ss.get_game_info(html, url)
+        keys = set(expected) | set(actual)
+        diff = [k for k in sorted(keys) if not same(expected.get(k), actual.get(k))]
+        if len(diff) > 0:
+            n_diff += 1
+            print("mismatch", file_path, {k: (expected.get(k), actual.get(k)) for k in diff})
+
+    return n_diff
+
+
+def bench(func, ss, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, html, url in pages:
+            func(ss, html, url)
+    elapsed = time.perf_counter() - start
+
+    return len(pages) * repeat / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--html-dir", default="data/html/games")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # 状態DBは使わないので一時ディレクトリに置く
+    config = load_config()
+    config.path_state_db = os.path.join(tempfile.mkdtemp(), "state.sqlite")
+    ss = ScrapingSponavi(config=config, start_date=None, end_date=None)
+    file_paths = sorted(glob.glob(os.path.join(args.html_dir, "*.html")))
+    if len(file_paths) == 0:
+        print("no html in", args.html_dir, "use", FIXTURE_HTML_DIR)
+        file_paths = sorted(glob.glob(os.path.join(FIXTURE_HTML_DIR, "*.html")))
+    pages = []
+    for file_path in file_paths:
+        with open(file_path, encoding="utf-8") as f:
+            pages.append((file_path, f.read(), make_url(ss, file_path)))
+
+    n_diff = check_parity(ss, pages)
+    print(f"parity: {len(pages) - n_diff}/{len(pages)} pages match")
+
+    bs4_rate = bench(legacy_get_game_info, ss, pages, args.repeat)
+    lxml_rate = bench(lambda ss, html, url: ss.get_game_info(html, url), ss, pages, args.repeat)
+    print(f"bs4 html.parser {bs4_rate:10.1f} pages/sec")
+    print(f"lxml extractor  {lxml_rate:10.1f} pages/sec  x{lxml_rate / bs4_rate:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""503/429/応答の停止を混ぜるローカルサーバーで、取り直しの有無による取得の安定性を比べる
+
+    python -m benchmark.bench_faults --pages 200 --error-rate 0.1 --throttle-rate 0.05 --hang-rate 0.02
+
+前半はページの取得だけを、取り直しもタイムアウトもない設定と、タイムアウトと取り直しのある設定で比べる。
+後半は試合の取得を2回実行し、1回目に取得できなかった試合が2回目に続きから取得されるかを確認する。
+"""
+import argparse
+import contextlib
+import io
+import re
+import shutil
+import tempfile
+import time
+
+from omegaconf import OmegaConf
+
+from src.fetch import FetchEngine
+from src.lake import LakeReader
+from src.metrics import Metrics
+from src.scraping import ScrapingSponavi
+from src.state import ScrapingState
+from tests.pages import END_INDEX, game_page, schedule_page, score_indexes, score_page
+from tests.utils import load_config
+
+from .stub_server import FaultyHandler, StubServer
+
+GAME_DATE = "2021-04-01"
+
+
+class FaultySiteHandler(FaultyHandler):
+    """終了した試合のゲーム一覧、試合トップページ、速報ページを返すハンドラ"""
+    game_id_nums = []
+    indexes = score_indexes()
+
+    def get_page(self, path):
+        if "/schedule/" in path:
+            return schedule_page(self.game_id_nums)
+        if re.search(r"/game/\d+/top", path):
+            return game_page(GAME_DATE, "finish")
+        m = re.search(r"/score\?index=(\d+)", path)
+        if m is not None and m.group(1) in self.indexes:
+            return score_page(self.indexes, m.group(1))
+
+        return None
+
+
+def measure_fetch(url, pages, **options):
+    """同じ設定で速報ページをpages件取得し、成功数、1秒あたりの件数、取り直しの回数を返す"""
+    metrics = Metrics()
+    failed = []
+    engine = FetchEngine(concurrency=8, rate_per_host=0, metrics=metrics, on_failure=lambda u, reason: failed.append(reason), **options)
+    indexes = FaultySiteHandler.indexes[:-1]
+    urls = [url + f"/npb/game/2021000001/score?index={indexes[i % len(indexes)]}&n={i}" for i in range(pages)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        n_success = sum(html is not None for _, html in engine.fetch_many(urls, use_cache=False))
+    seconds = time.perf_counter() - start
+    engine.close()
+    n_retries = sum(value for (name, _), value in metrics.counters.items() if name == "retries")
+
+    return n_success, pages / seconds, n_retries, seconds
+
+
+def make_scraper(url, work_dir):
+    config = load_config()
+    config.merge_with(OmegaConf.load("config/config_fetch.yaml"))
+    config.url_domain = url + "/"
+    config.exec_output = True
+    config.exec_lake_format = "parquet"
+    config.cache = {"enable": False}
+    config.score_crawl.parallel = False
+    config.fetch.rate_per_host = 0
+    config.fetch.read_timeout = 0.5
+    config.fetch.backoff_base = 0.05
+    config.fetch.backoff_max = 1
+    config.fetch.breaker_threshold = 0
+    for key in ["path_output_lake_parquet", "path_output_lake_tsv", "path_output_game_html"]:
+        config[key] = work_dir
+    config.path_state_db = work_dir + "/state.sqlite"
+
+    return ScrapingSponavi(config, GAME_DATE, GAME_DATE)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--games", type=int, default=6)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--throttle-rate", type=float, default=0.05)
+    parser.add_argument("--hang-rate", type=float, default=0.02)
+    parser.add_argument("--hang-seconds", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    faults = {
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "hang_rate": args.hang_rate,
+        "hang_seconds": args.hang_seconds,
+        "retry_after": 0,
+    }
+    FaultySiteHandler.game_id_nums = [f"2021{i:06d}" for i in range(1, args.games + 1)]
+    with StubServer(latency=args.latency, handler=FaultySiteHandler, **faults) as server:
+        print(f"{'setting':28s}{'success':>10s}{'pages/sec':>12s}{'retries':>10s}{'sec':>8s}")
+        for name, options in [
+            ("no timeout, no retry", {"read_timeout": None, "max_retries": 0, "breaker_threshold": 0}),
+            ("timeout + retry", {"read_timeout": 0.5, "max_retries": 3, "backoff_base": 0.05, "backoff_max": 1, "breaker_threshold": 0}),
+        ]:
+            n_success, pages_per_sec, n_retries, seconds = measure_fetch(server.url, args.pages, **options)
+            print(f"{name:28s}{n_success:6d}/{args.pages:<4d}{pages_per_sec:11.1f}{n_retries:10d}{seconds:8.1f}")
+
+        # 1回目に取得できなかった試合やページが2回目に取得されるか
+        work_dir = tempfile.mkdtemp()
+        try:
+            n_expected = args.games * (len(FaultySiteHandler.indexes) - 1)
+            for run in [1, 2]:
+                scraper = make_scraper(server.url, work_dir)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    scraper.retry_dead_letters()
+                    scraper.exec_score_scraping()
+                state = ScrapingState(work_dir + "/state.sqlite")
+                n_completed = sum(state.is_completed(scraper.make_id(x)) for x in FaultySiteHandler.game_id_nums)
+                df_score = LakeReader(work_dir).read("lake_score")
+                n_rows = len(df_score.drop_duplicates(["game_id", "index"])) if df_score is not None else 0
+                print(f"run {run}: {n_completed}/{args.games} games completed, {n_rows}/{n_expected} score rows, "
+                      f"{len(state.get_dead_letters())} dead letters, end page in lake: {df_score is not None and (df_score['index'] == END_INDEX).any()}")
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""FetchEngineの並列数ごとのスループットを計測する
+
+    python -m benchmark.bench_fetch --pages 200 --latency 0.05
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from src.fetch import FetchEngine
+
+from .stub_server import StubServer
+
+
+def bench(base_url, pages, concurrency, rate_per_host):
+    engine = FetchEngine(concurrency=concurrency, rate_per_host=rate_per_host, burst=concurrency)
+    urls = [f"{base_url}/npb/game/{i}/top" for i in range(pages)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        n_ok = sum(html is not None for _, html in engine.fetch_many(urls))
+    elapsed = time.perf_counter() - start
+    engine.close()
+
+    return n_ok / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate", type=float, default=0, help="ホスト毎の1秒あたりのリクエスト数。0なら無制限")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency) as server:
+        print(f"pages={args.pages} latency={args.latency}s rate={args.rate}/s")
+        for concurrency in args.concurrency:
+            pages_per_sec = bench(server.url, args.pages, concurrency, args.rate)
+            print(f"concurrency={concurrency:>3}  {pages_per_sec:8.1f} pages/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""1シーズン分のlake_scoreでTSVとParquetの書き込み・読み込み時間とサイズを比較する
+
+    python -m benchmark.bench_lake --games 858 --events 300
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+from omegaconf import OmegaConf
+
+from src.lake import LakeReader, LakeWriter
+from src.record import RecordBuilder
+from src.scraping import ScrapingBase
+
+from .bench_record import make_events
+
+
+def make_season(columns, n_games, n_events, games_per_day=6):
+    """試合日ごとのlake_scoreのDataFrameを作る"""
+    builder = RecordBuilder(columns, capacity=n_events * games_per_day)
+    events = make_events(n_games * n_events)
+    start = datetime.date(2021, 3, 26)
+    for day in range(0, n_games, games_per_day):
+        builder.clear()
+        builder.extend(next(events) for _ in range(min(games_per_day, n_games - day) * n_events))
+        df = builder.to_frame()
+        df["exec_datetime"] = "2021-10-31 00:00:00"
+        game_date = (start + datetime.timedelta(days=day // games_per_day)).strftime("%Y-%m-%d")
+        yield game_date, df
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def timeit(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=858)
+    parser.add_argument("--events", type=int, default=300)
+    args = parser.parse_args()
+
+    table = OmegaConf.load("config/config_table.yaml").table
+    columns = table.lake_score.column
+    days = list(make_season(columns, args.games, args.events))
+    n_rows = sum(len(df) for _, df in days)
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        # TSV（従来のsave_csv）
+        tsv_path = os.path.join(work_dir, "lake_score.tsv")
+        base = ScrapingBase()
+        write_tsv, _ = timeit(lambda: [base.save_csv(df, tsv_path) for _, df in days])
+        read_tsv, _ = timeit(lambda: pd.read_csv(tsv_path, sep="\t"))
+        read_tsv_filter, _ = timeit(lambda: pd.read_csv(tsv_path, sep="\t", usecols=["game_id", "batter_id", "result_main"]))
+
+        # Parquet
+        parquet_dir = os.path.join(work_dir, "parquet")
+        writer = LakeWriter(parquet_dir, table)
+        reader = LakeReader(parquet_dir)
+        write_parquet, _ = timeit(lambda: [writer.write(df, "lake_score", game_date=game_date) for game_date, df in days])
+        read_parquet, _ = timeit(lambda: reader.read("lake_score"))
+        read_parquet_filter, _ = timeit(lambda: reader.read("lake_score", columns=["game_id", "batter_id", "result_main"]))
+        read_parquet_month, _ = timeit(lambda: reader.read("lake_score", start_date="2021-06-01", end_date="2021-06-30"))
+
+        print(f"rows={n_rows} days={len(days)}")
+        print(f"{'':<8}{'write':>10}{'read':>10}{'3 cols':>10}{'1 month':>10}{'size':>12}")
+        print(f"{'tsv':<8}{write_tsv:10.2f}{read_tsv:10.2f}{read_tsv_filter:10.2f}{'-':>10}{os.path.getsize(tsv_path) / 1024 ** 2:10.1f}MB")
+        print(f"{'parquet':<8}{write_parquet:10.2f}{read_parquet:10.2f}{read_parquet_filter:10.2f}{read_parquet_month:10.2f}{dir_size(parquet_dir) / 1024 ** 2:10.1f}MB")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
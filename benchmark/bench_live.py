@@ -0,0 +1,126 @@
+"""試合中の速報ページが少しずつ増えるローカルサーバーで、ライブ取得のリクエスト数と遅れを測る
+
+    python -m benchmark.bench_live --games 3 --pages-per-sec 10 --min-interval 0.2 --max-interval 2
+
+毎回試合の最初からたどり直す場合に必要なリクエスト数と比べ、全投球が1回ずつ出力されたかを確認する。
+"""
+import argparse
+import contextlib
+import io
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from omegaconf import OmegaConf
+
+from src.lake import LakeReader
+from src.live import LivePoller
+from src.scraping import ScrapingSponavi
+from tests.pages import END_INDEX, game_page, schedule_page, score_indexes, score_page
+from tests.utils import load_config
+
+from .stub_server import StubHandler, StubServer
+
+GAME_DATE = "2021-04-01"
+
+
+class LiveSiteHandler(StubHandler):
+    """開始からの経過時間に応じて速報ページを公開するハンドラ"""
+    games = {}
+    started = 0.0
+    pages_per_sec = 10.0
+    lock = threading.Lock()
+    requests = []
+    recrawl_pages = 0
+
+    @classmethod
+    def revealed(cls, game_id_num):
+        return min(int((time.monotonic() - cls.started) * cls.pages_per_sec) + 1, len(cls.games[game_id_num]))
+
+    def send(self, code, html=None):
+        body = html.encode("utf-8") if html is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.lock:
+            LiveSiteHandler.requests.append(self.path)
+        if "/schedule/" in self.path:
+            return self.send(200, schedule_page(list(self.games)))
+
+        m = re.search(r"/game/(\d+)/top", self.path)
+        if m is not None:
+            indexes = self.games[m.group(1)]
+            revealed = self.revealed(m.group(1))
+            with self.lock:
+                # 毎回最初からたどり直すなら公開済みのページをすべて取得する
+                LiveSiteHandler.recrawl_pages += revealed
+            state = "finish" if revealed == len(indexes) else "live"
+            return self.send(200, game_page(GAME_DATE, state))
+
+        m = re.search(r"/game/(\d+)/score\?index=(\d+)", self.path)
+        if m is not None and m.group(2) in self.games.get(m.group(1), []):
+            html = score_page(self.games[m.group(1)], m.group(2), revealed=self.revealed(m.group(1)))
+            if html is not None:
+                return self.send(200, html)
+
+        return self.send(404)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=3)
+    parser.add_argument("--innings", type=int, default=9)
+    parser.add_argument("--batters", type=int, default=4, help="半イニングごとの打席数")
+    parser.add_argument("--pages-per-sec", type=float, default=10.0)
+    parser.add_argument("--min-interval", type=float, default=0.2)
+    parser.add_argument("--max-interval", type=float, default=2.0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        config = load_config()
+        config.merge_with(OmegaConf.load("config/config_fetch.yaml"))
+        config.fetch.rate_per_host = 0
+        config.exec_output = True
+        config.exec_lake_format = "parquet"
+        config.cache = {"enable": False}
+        for key in ["path_output_lake_parquet", "path_output_lake_tsv", "path_output_game_html"]:
+            config[key] = work_dir
+        config.path_state_db = work_dir + "/state.sqlite"
+
+        indexes = score_indexes(args.innings, args.batters)
+        LiveSiteHandler.games = {f"2021{i:06d}": indexes for i in range(1, args.games + 1)}
+        LiveSiteHandler.pages_per_sec = args.pages_per_sec
+        with StubServer(latency=0, handler=LiveSiteHandler) as server:
+            config.url_domain = server.url + "/"
+            scraper = ScrapingSponavi(config, GAME_DATE, GAME_DATE)
+            poller = LivePoller(scraper, min_interval=args.min_interval, max_interval=args.max_interval)
+
+            LiveSiteHandler.started = time.monotonic()
+            with contextlib.redirect_stdout(io.StringIO()):
+                n_events = poller.run(GAME_DATE)
+            seconds = time.monotonic() - LiveSiteHandler.started
+
+        n_pages = len(indexes) - 1
+        game_seconds = len(indexes) / args.pages_per_sec
+        n_score_requests = sum("/score?" in path for path in LiveSiteHandler.requests)
+        df_score = LakeReader(work_dir).read("lake_score")
+        df_game = LakeReader(work_dir).read("lake_game")
+        print(f"{args.games} games x {n_pages} pages, game length {game_seconds:.1f} sec, finished after {seconds:.1f} sec")
+        print(f"requests           {len(LiveSiteHandler.requests):8d}")
+        print(f"score requests     {n_score_requests:8d}")
+        print(f"re-crawl requests  {LiveSiteHandler.recrawl_pages:8d}  (毎回最初からたどる場合)")
+        print(f"events {n_events}, lake rows {len(df_score)}, unique {len(df_score.drop_duplicates(['game_id', 'index']))}, expected {args.games * n_pages}")
+        print("end page not in lake:", not (df_score["index"] == END_INDEX).any(), ", finished games:", len(df_game))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
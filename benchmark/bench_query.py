@@ -0,0 +1,108 @@
+"""合成したlakeで、TSVを読んでpandasで絞り込む方法とSQLiteの検索のレイテンシを比較する
+
+    python -m benchmark.bench_query --seasons 2 --games 858 --events 300 --queries 50
+
+TSVの方は分析のたびにファイルを読み直す今のノートブックの使い方を想定している。
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from omegaconf import OmegaConf
+
+from src.query import LakeQuery
+
+from .bench_datamart import TEAM_IDS, make_lake
+
+
+def percentile(seconds, q):
+    return np.percentile(np.array(seconds) * 1000, q)
+
+
+def measure(func, params):
+    seconds = []
+    for p in params:
+        start = time.perf_counter()
+        func(p)
+        seconds.append(time.perf_counter() - start)
+
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seasons", type=int, default=2)
+    parser.add_argument("--games", type=int, default=858)
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    table = OmegaConf.load("config/config_table.yaml").table
+    df_game, df_score = make_lake(args.seasons, args.games, args.events)
+    for name, df in [("lake_game", df_game), ("lake_score", df_score)]:
+        for c in table[name].column:
+            if c.name not in df.columns:
+                df[c.name] = None
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        df_game.to_csv(os.path.join(work_dir, "lake_game.tsv"), sep="\t", index=False)
+        df_score.to_csv(os.path.join(work_dir, "lake_score.tsv"), sep="\t", index=False)
+
+        start = time.perf_counter()
+        query = LakeQuery(os.path.join(work_dir, "lake.sqlite"), table)
+        query.sync(lambda table_name, columns=None, game_ids=None: {"lake_game": df_game, "lake_score": df_score}.get(table_name))
+        print(f"{len(df_game)} games, {len(df_score)} score rows, sync {time.perf_counter() - start:.1f} sec")
+
+        rng = np.random.default_rng(0)
+        season = int(df_game["game_date"].max()[:4])
+        pitchers = df_score["pitcher_id"].unique()
+        pitcher_params = [
+            {"pitcher_id": pitchers[i], "start_date": f"{season}-05-01", "end_date": f"{season}-06-30"}
+            for i in rng.integers(0, len(pitchers), args.queries)
+        ]
+        team_params = [
+            {"team_id": TEAM_IDS[i], "start_date": f"{season}-04-01", "end_date": f"{season}-09-30"}
+            for i in rng.integers(0, len(TEAM_IDS), args.queries)
+        ]
+
+        def tsv_pitcher(p):
+            game = pd.read_csv(os.path.join(work_dir, "lake_game.tsv"), sep="\t")
+            score = pd.read_csv(os.path.join(work_dir, "lake_score.tsv"), sep="\t")
+            game = game[(game["game_date"] >= p["start_date"]) & (game["game_date"] <= p["end_date"])]
+            return score[(score["pitcher_id"] == p["pitcher_id"]) & score["game_id"].isin(game["game_id"])]
+
+        def tsv_team(p):
+            game = pd.read_csv(os.path.join(work_dir, "lake_game.tsv"), sep="\t")
+            return game[((game["team_top_id"] == p["team_id"]) | (game["team_bottom_id"] == p["team_id"])) &
+                        (game["game_date"] >= p["start_date"]) & (game["game_date"] <= p["end_date"])]
+
+        # TSVは読み込みが重いので回数を減らす
+        n_tsv = max(args.queries // 10, 3)
+        results = [
+            ("pitcher_events", "tsv + pandas", measure(tsv_pitcher, pitcher_params[:n_tsv])),
+            ("pitcher_events", "sqlite", measure(lambda p: query.query("pitcher_events", **p), pitcher_params)),
+            ("team_games", "tsv + pandas", measure(tsv_team, team_params[:n_tsv])),
+            ("team_games", "sqlite", measure(lambda p: query.query("team_games", **p), team_params)),
+        ]
+
+        # 結果が一致するか
+        p = pitcher_params[0]
+        same = len(tsv_pitcher(p)) == len(query.query("pitcher_events", **p))
+        p = team_params[0]
+        same = same and len(tsv_team(p)) == len(query.query("team_games", **p))
+        print("same rows:", same)
+
+        print(f"{'query':16s}{'method':14s}{'p50 ms':>10s}{'p95 ms':>10s}")
+        for name, method, seconds in results:
+            print(f"{name:16s}{method:14s}{percentile(seconds, 50):10.2f}{percentile(seconds, 95):10.2f}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""スコアの行追記をDataFrame.append相当の方法とRecordBuilderで比較する
+
+    python -m benchmark.bench_record --rows 250000 --legacy-rows 3000
+
+DataFrame.appendはpandas 2.0で削除されたため、内部で行っていたのと同じ
+1行ずつのpd.concatを比較対象にする。二乗オーダーなので件数を減らして計測する。
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from omegaconf import OmegaConf
+
+from src.record import RecordBuilder
+
+
+def make_events(n_rows, seed=0):
+    """1シーズン分（約860試合 x 約300球）を想定したスコアのイベントを作る"""
+    rng = np.random.default_rng(seed)
+    results = ["空振り三振", "見逃し三振", "レフト前ヒット", "ショートゴロ", "センターフライ", "四球"]
+    for i in range(n_rows):
+        yield {
+            "game_id": f"npb{2021000000 + i // 300}",
+            "index": f"{i % 300:07d}",
+            "inning": str(rng.integers(1, 10)),
+            "top_buttom": "top" if i % 2 == 0 else "bottom",
+            "result_main": results[i % len(results)],
+            "result_sub": np.nan,
+            "batter_id": f"npb{rng.integers(1000000, 1001000)}",
+            "batter_side": "右",
+            "pitcher_id": f"npb{rng.integers(1000000, 1001000)}",
+            "pitcher_side": "左",
+            "base_1": "/npb/player/1000001/top" if i % 3 == 0 else np.nan,
+            "base_2": np.nan,
+            "base_3": np.nan,
+        }
+
+
+def run_legacy(events, columns):
+    df = pd.DataFrame()
+    for result in events:
+        df = pd.concat([df, pd.Series(result).to_frame().T], ignore_index=True)
+
+    return df[[c.name for c in columns if c.name in df.columns]]
+
+
+def run_builder(events, columns):
+    builder = RecordBuilder(columns)
+    builder.extend(events)
+
+    return builder.to_frame()
+
+
+def measure(func, n_rows, columns):
+    events = list(make_events(n_rows))
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(events, columns)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=250000)
+    parser.add_argument("--legacy-rows", type=int, default=3000)
+    args = parser.parse_args()
+
+    columns = OmegaConf.load("config/config_table.yaml").table.lake_score.column
+
+    for name, func, n_rows in [
+        ("append", run_legacy, args.legacy_rows),
+        ("builder", run_builder, args.legacy_rows),
+        ("builder", run_builder, args.rows),
+    ]:
+        elapsed, peak = measure(func, n_rows, columns)
+        print(f"{name:<8} rows={n_rows:>8}  {n_rows / elapsed:12.0f} rows/sec  peak={peak / 1024 ** 2:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
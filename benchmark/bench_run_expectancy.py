@@ -0,0 +1,188 @@
+"""合成したシーズンの速報ページで、打席の状態の復元と得点期待値、RE24の計算時間を計測する
+
+    python -m benchmark.bench_run_expectancy --games 858 --pitches 3
+
+打席の結果と走者の進み方を乱数で決めて試合を作り、1行ずつたどる素朴な実装と速度と結果を比べる。
+最終日の試合だけを足し込む差分集計と全件集計の時間を比べ、結果が一致するかも確認する。
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.run_expectancy import END_STATE, RunExpectancy, base_out_events, expectancy_array, state_runs
+
+# 打席結果、確率、アウト数、進塁数（0なら走者は動かない。-1は四球で押し出される走者だけ進む。4は本塁打）
+OUTCOMES = [
+    ("空振り三振", 0.20, 1, 0),
+    ("ショートゴロ", 0.24, 1, 0),
+    ("センターフライ", 0.22, 1, 0),
+    ("四球", 0.09, 0, -1),
+    ("レフト前ヒット", 0.16, 0, 1),
+    ("左中間への二塁打", 0.05, 0, 2),
+    ("右中間への三塁打", 0.01, 0, 3),
+    ("ライトへホームラン", 0.03, 0, 4),
+]
+RUNNER_HREF = "/npb/player/1000001/top"
+
+
+def advance(base, bases):
+    """走者と打者をbases個進め、(新しい走者, 得点)を返す。bases=-1なら押し出される走者だけ進める"""
+    if bases == -1:
+        forced = {0: 1, 1: 3, 2: 3, 3: 7, 4: 5, 5: 7, 6: 7, 7: 7}[base]
+        return forced, int(base == 7)
+    runners = [i for i in range(3) if base >> i & 1] + [-1]
+    new_base, runs = 0, 0
+    for r in runners:
+        to = r + bases
+        if to >= 3:
+            runs += 1
+        else:
+            new_base |= 1 << to
+
+    return new_base, runs
+
+
+def make_season(n_games, n_pitches, season=2021, games_per_day=6, seed=0):
+    """1シーズン分のlake_gameとlake_scoreを作る。打席ごとにn_pitches行の結果のない行をはさむ
+
+    Returns:
+        tuple: (lake_game, lake_score, 試合ごとの得点の合計)
+    """
+    rng = np.random.default_rng(seed)
+    probs = np.array([x[1] for x in OUTCOMES])
+    players = [f"npb{1000000 + i}" for i in range(400)]
+    game_ids = [f"npb{season}{i:06d}" for i in range(n_games)]
+    columns = {k: [] for k in ["game_id", "index", "result_main", "result_sub", "batter_id", "pitcher_id", "base_1", "base_2", "base_3"]}
+    game_runs = {}
+
+    for game_id in game_ids:
+        lineup = rng.choice(len(players), 20, replace=False)
+        game_runs[game_id] = 0
+        for inning in range(1, 10):
+            for top_bottom in [1, 2]:
+                base, outs, batter = 0, 0, 1
+                pitcher = players[lineup[18 + top_bottom - 1]]
+                while outs < 3:
+                    name, _, n_outs, bases = OUTCOMES[rng.choice(len(OUTCOMES), p=probs)]
+                    outs += n_outs
+                    new_base, runs = advance(base, bases) if bases != 0 else (base, 0)
+                    batter_id = players[lineup[(batter - 1) % 9 + 9 * (top_bottom - 1)]]
+                    for pitch in range(n_pitches + 1):
+                        last = pitch == n_pitches
+                        columns["game_id"].append(game_id)
+                        columns["index"].append(f"{inning:02d}{top_bottom}{batter:02d}{pitch:02d}")
+                        columns["result_main"].append(name if last else None)
+                        columns["result_sub"].append(f"{outs}アウト" if last else None)
+                        columns["batter_id"].append(batter_id)
+                        columns["pitcher_id"].append(pitcher)
+                        for i in range(3):
+                            columns[f"base_{i + 1}"].append(RUNNER_HREF if base >> i & 1 else None)
+                    base = new_base if outs < 3 else 0
+                    game_runs[game_id] += runs if outs < 3 else 0
+                    batter += 1
+
+    day = np.arange(n_games) // games_per_day
+    df_game = pd.DataFrame({
+        "game_id": game_ids,
+        "game_date": (pd.Timestamp(f"{season}-03-26") + pd.to_timedelta(day, unit="D")).strftime("%Y-%m-%d"),
+        "game_status": "finish",
+    })
+
+    return df_game, pd.DataFrame(columns), game_runs
+
+
+def naive_run_expectancy(df_score):
+    """1行ずつたどって状態ごとのイニングの終わりまでの得点を平均する素朴な実装"""
+    df = df_score[df_score["result_main"].notna()].sort_values(["game_id", "index"])
+    sums, counts = np.zeros(24), np.zeros(24)
+    half, states, runs_list = None, [], []
+
+    def close():
+        remaining = sum(runs_list)
+        for state, runs in zip(states, runs_list):
+            sums[state] += remaining
+            counts[state] += 1
+            remaining -= runs
+
+    rows = list(df.itertuples(index=False))
+    for i, row in enumerate(rows):
+        key = (row.game_id, row.index[:3])
+        if key != half:
+            if half is not None:
+                close()
+            half, states, runs_list, outs = key, [], [], 0
+        base = sum(1 << j for j, b in enumerate([row.base_1, row.base_2, row.base_3]) if pd.notna(b))
+        outs_after = int(row.result_sub[0])
+        nxt = rows[i + 1] if i + 1 < len(rows) else None
+        if nxt is not None and (nxt.game_id, nxt.index[:3]) == key:
+            base_after = sum(1 << j for j, b in enumerate([nxt.base_1, nxt.base_2, nxt.base_3]) if pd.notna(b))
+            runs = bin(base).count("1") + 1 - bin(base_after).count("1") - (outs_after - outs)
+        else:
+            runs = 0
+        states.append(outs * 8 + base)
+        runs_list.append(max(runs, 0))
+        outs = outs_after
+    close()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=858)
+    parser.add_argument("--pitches", type=int, default=3, help="打席ごとの結果のない行の数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df_game, df_score, game_runs = make_season(args.games, args.pitches)
+    print(f"{len(df_game)} games, {len(df_score)} score rows (generated in {time.perf_counter() - start:.1f} sec)")
+
+    # 打席の状態の復元と得点期待値だけ
+    start = time.perf_counter()
+    df_events = base_out_events(df_score)
+    expectancy = expectancy_array(state_runs(df_events, np.full(len(df_events), 2021)))
+    events_seconds = time.perf_counter() - start
+
+    # 選手ごとの回数まで含めた全件集計
+    start = time.perf_counter()
+    full = RunExpectancy()
+    full.update(df_game, df_score)
+    full_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_events = full.event_credit(df_game, df_score)
+    credit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    naive = naive_run_expectancy(df_score)
+    naive_seconds = time.perf_counter() - start
+
+    runs = df_events.groupby("game_id")["runs"].sum()
+    print(f"{len(df_events)} plate appearances, {df_events['complete'].mean():.1%} in complete half innings")
+    print(f"naive row loop        {naive_seconds:8.3f} sec")
+    print(f"vectorized expectancy {events_seconds:8.3f} sec  x{naive_seconds / events_seconds:.1f}")
+    print(f"full update           {full_seconds:8.3f} sec")
+    print(f"event credit          {credit_seconds:8.3f} sec")
+    print("expectancy == naive:", np.allclose(expectancy[:END_STATE], naive, equal_nan=True)
+          and np.allclose(full.expectancy(2021), expectancy, equal_nan=True))
+    print("runs per game == simulated:", runs.to_dict() == game_runs)
+    print("sum of event re24 == sum of batter re24:",
+          np.isclose(df_events["re24"].sum(), full.re24("batter", 2021)["re24"].sum()))
+    print(full.matrix(2021).round(3))
+
+    # 最終日以外を集計済みにしてから最終日だけ足し込む
+    last_date = df_game["game_date"].max()
+    incremental = RunExpectancy()
+    incremental.update(df_game[df_game["game_date"] < last_date], df_score)
+    start = time.perf_counter()
+    n_games = incremental.update(df_game, df_score[df_score["game_id"].isin(df_game.loc[df_game["game_date"] == last_date, "game_id"])])
+    incremental_seconds = time.perf_counter() - start
+    same = all(incremental.tables[name].equals(full.tables[name]) for name in full.tables)
+    print(f"incremental ({n_games} games) {incremental_seconds:8.3f} sec  x{full_seconds / incremental_seconds:.0f}")
+    print("incremental == full:", same)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""ベンチマーク用のページの記録と配信
+
+実際のサイトからゲーム一覧、試合トップ、速報、選手一覧、選手ページを記録する
+
+    python -m benchmark.fixtures record --start-date 2021-04-01 --end-date 2021-04-01 --teams 巨人 阪神
+
+記録したページを遅延とエラーをはさんで配信する
+
+    python -m benchmark.fixtures serve --fixtures data/fixtures --port 8000 --latency 0.05 --error-rate 0.01
+
+配信中は url_domain=http://127.0.0.1:8000/ で通常の実行をネットワークに接続せずに試せる。
+"""
+import argparse
+import contextlib
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+from omegaconf import OmegaConf
+
+from src.fetch import FetchEngine
+from src.scraping import ScrapingSponavi
+from tests.pages import game_page, player_page, roster_page, schedule_page, score_indexes, score_page
+from tests.utils import load_config
+
+from .stub_server import FixtureHandler, StubServer
+
+
+def make_key(url):
+    """URLのパスとクエリ。ホストが違っても同じページになるようにする"""
+    parts = urlsplit(url)
+    key = unquote(parts.path)
+
+    return key + "?" + unquote(parts.query) if parts.query else key
+
+
+class FixtureStore():
+    """URLごとのhtmlを圧縮して保存する。manifest.jsonにパスとクエリからファイル名への対応を持つ
+
+    Args:
+        fixture_dir (str): 保存先のディレクトリ
+    """
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+        self.manifest_path = os.path.join(fixture_dir, "manifest.json")
+        self.manifest = {}
+        self.pages = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def __len__(self):
+        return len(self.manifest)
+
+    def keys(self, pattern=None):
+        """保存したページのパスとクエリ。patternを渡すと一致するものだけ"""
+        keys = sorted(self.manifest)
+
+        return [k for k in keys if re.search(pattern, k)] if pattern is not None else keys
+
+    def put(self, url, html):
+        key = make_key(url)
+        file_name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".html.gz"
+        os.makedirs(self.fixture_dir, exist_ok=True)
+        with gzip.open(os.path.join(self.fixture_dir, file_name), "wt", encoding="utf-8") as f:
+            f.write(html)
+        with self.lock:
+            self.manifest[key] = file_name
+            self.pages[key] = html
+
+        return None
+
+    def get(self, url):
+        """保存したhtml。なければNone"""
+        key = make_key(url)
+        if key in self.pages:
+            return self.pages[key]
+        file_name = self.manifest.get(key)
+        if file_name is None:
+            return None
+        with gzip.open(os.path.join(self.fixture_dir, file_name), "rt", encoding="utf-8") as f:
+            html = f.read()
+        self.pages[key] = html
+
+        return html
+
+    def save(self):
+        """manifest.jsonを書き出す"""
+        os.makedirs(self.fixture_dir, exist_ok=True)
+        with self.lock:
+            manifest = dict(sorted(self.manifest.items()))
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+        return None
+
+
+class RecordingFetchEngine(FetchEngine):
+    """取得できたページをstoreに保存するFetchEngine"""
+    store = None
+
+    def fetch(self, url, use_cache=True):
+        html = super().fetch(url, use_cache=use_cache)
+        if html is not None and self.store is not None:
+            self.store.put(url, html)
+
+        return html
+
+
+def record(config, store, start_date, end_date, players=True):
+    """通常の取得と同じ順にページをたどり、取得したページをすべて保存する
+
+    lakeや状態DBは一時ディレクトリに書くので、既存の出力には影響しない。
+
+    Args:
+        config (DictConfig): 全体の設定
+        store (FixtureStore): 保存先
+        start_date (str): 開始日
+        end_date (str): 終了日
+        players (bool): 選手一覧と選手ページも記録するか
+    """
+    work_dir = tempfile.mkdtemp()
+    config = config.copy()
+    config.exec_output = True
+    config.exec_upload = False
+    config.cache = {"enable": False}
+    for key in ["path_output_lake_parquet", "path_output_lake_tsv", "path_output_game_html"]:
+        config[key] = work_dir
+    config.path_state_db = os.path.join(work_dir, "state.sqlite")
+
+    scraper = ScrapingSponavi(config, start_date, end_date)
+    scraper.fetch_engine.close()
+    scraper.fetch_engine = RecordingFetchEngine.from_config(config.get("fetch"), metrics=scraper.metrics, on_failure=scraper.state.save_dead_letter)
+    scraper.fetch_engine.store = store
+    scraper.exec_score_scraping()
+    if players:
+        scraper.get_players()
+    scraper.fetch_engine.close()
+    store.save()
+
+    return None
+
+
+def write_synthetic(store, team_dict, base_url="http://fixtures/npb", start_date="2021-04-01", days=2, games=3, players_per_roster=10):
+    """tests.pagesの合成ページをstoreに保存する。記録したページがないときの代わり
+
+    Args:
+        store (FixtureStore): 保存先
+        team_dict (DictConfig): config_team.yamlのteam。選手一覧のURLに使う
+        base_url (str): url_domain + exec_sports。保存するのはパスとクエリだけ
+        start_date (str): 最初の日
+        days (int): 日数
+        games (int): 1日の試合数
+        players_per_roster (int): 選手一覧1ページの選手数
+    """
+    indexes = score_indexes()
+    start = datetime.date.fromisoformat(start_date)
+    for d in range(days):
+        date = start + datetime.timedelta(days=d)
+        game_date = date.strftime("%Y-%m-%d")
+        game_id_nums = [date.strftime("%Y%m%d") + f"{i:02d}" for i in range(1, games + 1)]
+        store.put(base_url + "/schedule/?date=" + game_date, schedule_page(game_id_nums))
+        for game_id_num in game_id_nums:
+            store.put(base_url + f"/game/{game_id_num}/top", game_page(game_date, "finish"))
+            for index in indexes:
+                store.put(base_url + f"/game/{game_id_num}/score?index={index}", score_page(indexes, index))
+
+    player_num = 1000000
+    for team in team_dict.values():
+        for kind in ["p", "b"]:
+            player_nums = list(range(player_num, player_num + players_per_roster))
+            player_num += players_per_roster
+            store.put(base_url + "/teams/" + team.team_id.replace("npb", "") + f"/memberlist?kind={kind}", roster_page(player_nums))
+            for x in player_nums:
+                store.put(base_url + f"/player/{x}/top", player_page(x))
+    store.save()
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_record = subparsers.add_parser("record", help="実際のサイトからページを記録する")
+    parser_record.add_argument("--fixtures", default="data/fixtures")
+    parser_record.add_argument("--start-date", required=True)
+    parser_record.add_argument("--end-date", required=True)
+    parser_record.add_argument("--teams", nargs="*", default=None, help="選手を記録するチーム（config_team.yamlのキー）。省略すると全チーム")
+    parser_record.add_argument("--no-players", action="store_true")
+    parser_serve = subparsers.add_parser("serve", help="記録したページを配信する")
+    parser_serve.add_argument("--fixtures", default="data/fixtures")
+    parser_serve.add_argument("--port", type=int, default=8000)
+    parser_serve.add_argument("--latency", type=float, default=0.05)
+    parser_serve.add_argument("--error-rate", type=float, default=0.0)
+    parser_serve.add_argument("--throttle-rate", type=float, default=0.0)
+    parser_serve.add_argument("--hang-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    store = FixtureStore(args.fixtures)
+    if args.command == "record":
+        config = load_config()
+        config.merge_with(OmegaConf.load("config/config_fetch.yaml"))
+        if args.teams:
+            config.team_list = args.teams
+        record(config, store, args.start_date, args.end_date, players=not args.no_players)
+        print(len(store), "pages in", args.fixtures)
+        return None
+
+    faults = {"error_rate": args.error_rate, "throttle_rate": args.throttle_rate, "hang_rate": args.hang_rate}
+    with StubServer(latency=args.latency, handler=FixtureHandler, port=args.port, store=store, **faults) as server:
+        print(len(store), "pages at", server.url)
+        with contextlib.suppress(KeyboardInterrupt):
+            while True:
+                time.sleep(1)
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """一定の遅延をはさんで固定のhtmlを返すハンドラ"""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    body = ("<html><body>" + "x" * 20000 + "</body></html>").encode("utf-8")
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FaultyHandler(StubHandler):
+    """一定の割合で503、429（Retry-After付き）、応答の停止を返すハンドラ
+
+    get_pageを上書きするとパスごとのhtmlを返せる。Noneなら404。
+    """
+    error_rate = 0.0
+    throttle_rate = 0.0
+    hang_rate = 0.0
+    hang_seconds = 3.0
+    retry_after = 1
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+
+    def get_page(self, path):
+        return self.body.decode("utf-8")
+
+    def send(self, code, html=None, headers=None):
+        body = html.encode("utf-8") if html is not None else b""
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.rng_lock:
+            roll = self.rng.random()
+        time.sleep(self.latency)
+        if roll < self.hang_rate:
+            # クライアントのタイムアウトより長く止まり、応答しない
+            time.sleep(self.hang_seconds)
+            self.close_connection = True
+            return None
+        if roll < self.hang_rate + self.throttle_rate:
+            return self.send(429, headers={"Retry-After": str(self.retry_after)})
+        if roll < self.hang_rate + self.throttle_rate + self.error_rate:
+            return self.send(503)
+
+        html = self.get_page(self.path)
+        if html is None:
+            return self.send(404)
+
+        return self.send(200, html)
+
+
+class FixtureHandler(FaultyHandler):
+    """記録したページ（benchmark.fixtures.FixtureStore）をパスとクエリで引いて返すハンドラ"""
+    store = None
+
+    def get_page(self, path):
+        return self.store.get(path)
+
+
+class StubServer():
+    """ベンチマーク用のローカルHTTPサーバー
+
+    Args:
+        latency (float): 1リクエストあたりの応答遅延（秒）
+        handler (type): リクエストハンドラのクラス
+        port (int): 待ち受けるポート。0なら空いているポート
+        **attrs: ハンドラのクラス属性（FaultyHandlerのerror_rateなど）
+    """
+    def __init__(self, latency=0.05, handler=StubHandler, port=0, **attrs):
+        handler_class = type("Handler", (handler,), dict(attrs, latency=latency))
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,291 @@
+"""記録したページを配信するローカルサーバーに対して、取得からlakeの書き込みまでを計測する
+
+    python -m benchmark.suite --fixtures data/fixtures --latency 0.01 --repeat 3 --baseline data/benchmark/suite_old.json
+
+fixturesにページがなければtests.pagesの合成ページを使う。ベンチマークごとにrepeat回の時間と、
+tracemallocで計測した別の1回のPythonのメモリ確保のピークを、実行環境とコミットとともにJSONで出力する。
+サーバーは別プロセスで動かすので、メモリにはサーバーの分は含まれない。
+baselineを渡すと前回のJSONと比べ、スループットとメモリの比を表示する。
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from omegaconf import OmegaConf
+
+from src.fetch import FetchEngine
+from src.scraping import ScrapingSponavi
+from tests.utils import load_config
+
+from .fixtures import FixtureStore, write_synthetic
+from .stub_server import FixtureHandler, StubServer
+
+
+def serve(fixture_dir, latency, faults, ready):
+    """サーバーのプロセスで記録したページを配信する"""
+    with StubServer(latency=latency, handler=FixtureHandler, store=FixtureStore(fixture_dir), **faults) as server:
+        ready.put(server.url)
+        while True:
+            time.sleep(1)
+
+
+class Suite():
+    """ベンチマークをまとめて実行する
+
+    Args:
+        store (FixtureStore): 記録したページ
+        url (str): 配信しているサーバーのURL
+        work_dir (str): lakeや状態DBを書く一時ディレクトリ
+        concurrency (int): 取得の並列数
+        lake_copies (int): lakeの書き込みで速報ページの行を何倍にするか
+    """
+    def __init__(self, store, url, work_dir, concurrency=8, lake_copies=10):
+        self.store = store
+        self.url = url
+        self.work_dir = work_dir
+        self.concurrency = concurrency
+        self.lake_copies = lake_copies
+        self.n_runs = 0
+        self.scrapers = []
+        self.setup_seconds = 0.0
+        self.score_frames = None
+
+    def make_scraper(self, lake_format="parquet"):
+        """実行ごとに空のlakeと状態DBを持つスクレイパー。作る時間は計測から除く"""
+        start = time.perf_counter()
+        self.n_runs += 1
+        run_dir = os.path.join(self.work_dir, f"run{self.n_runs}")
+        os.makedirs(run_dir)
+        config = load_config()
+        config.merge_with(OmegaConf.load("config/config_fetch.yaml"))
+        config.url_domain = self.url + "/"
+        config.exec_output = True
+        config.exec_lake_format = lake_format
+        config.cache = {"enable": False}
+        config.fetch.concurrency = self.concurrency
+        config.fetch.rate_per_host = 0
+        for key in ["path_output_lake_parquet", "path_output_lake_tsv", "path_output_game_html"]:
+            config[key] = run_dir
+        config.path_state_db = os.path.join(run_dir, "state.sqlite")
+
+        scraper = ScrapingSponavi(config, "2021-04-01", "2021-04-01")
+        self.scrapers.append(scraper)
+        self.setup_seconds += time.perf_counter() - start
+
+        return scraper
+
+    def call(self, func):
+        """表示を捨ててベンチマークを1回実行し、作ったスクレイパーの取得のスレッドを止める"""
+        self.setup_seconds = 0.0
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                return func()
+            finally:
+                for scraper in self.scrapers:
+                    scraper.fetch_engine.close()
+                self.scrapers = []
+
+    def game_id_nums(self):
+        return sorted({key.split("/")[3] for key in self.store.keys(r"/game/\d+/score\?")})
+
+    def bench_get_html(self):
+        """記録したすべてのページを並列に取得する"""
+        engine = FetchEngine(concurrency=self.concurrency, rate_per_host=0, burst=self.concurrency)
+        n = sum(html is not None for _, html in engine.fetch_many([self.url + key for key in self.store.keys()], use_cache=False))
+        engine.close()
+
+        return n
+
+    def bench_get_game_info(self):
+        """試合トップページをパースする。取得はしない"""
+        scraper = self.make_scraper()
+        keys = self.store.keys(r"/game/\d+/top$")
+        for key in keys:
+            scraper.get_game_info(self.store.get(key), self.url + key)
+
+        return len(keys)
+
+    def bench_get_score_info(self):
+        """試合ごとに速報ページを最初から最後までたどる。記録したときと同じくscore_crawlの設定に従う"""
+        scraper = self.make_scraper()
+        frames = list(scraper.get_score_infos([scraper.make_id(x) for x in self.game_id_nums()]).values())
+        self.score_frames = frames
+
+        return sum(len(df) for df in frames)
+
+    def bench_get_players(self):
+        """選手一覧から選手ページを取得し、lake_playerに出力する"""
+        scraper = self.make_scraper()
+        scraper.get_players()
+        df = scraper.read_lake("lake_player", columns=["player_id"])
+
+        return len(df) if df is not None else 0
+
+    def bench_lake(self, lake_format):
+        """速報ページの行を試合ごとに書き込む"""
+        # 書き込む行は速報ページの取得で作る。取得の時間は計測から除く
+        if self.score_frames is None:
+            start, setup_seconds = time.perf_counter(), self.setup_seconds
+            self.bench_get_score_info()
+            self.setup_seconds = setup_seconds + time.perf_counter() - start
+        scraper = self.make_scraper(lake_format)
+        n = 0
+        for copy in range(self.lake_copies):
+            for df in self.score_frames:
+                df = df.assign(game_id=df["game_id"] + f"{copy:03d}", exec_datetime="2021-04-01 00:00:00")
+                scraper.save_lake(df[[c.name for c in scraper.table.lake_score.column]], "lake_score", game_date="2021-04-01")
+                n += len(df)
+
+        return n
+
+    def benchmarks(self):
+        return {
+            "get_html": ("pages", self.bench_get_html),
+            "get_game_info": ("pages", self.bench_get_game_info),
+            "get_score_info": ("pages", self.bench_get_score_info),
+            "get_players": ("players", self.bench_get_players),
+            "lake_parquet": ("rows", lambda: self.bench_lake("parquet")),
+            "lake_tsv": ("rows", lambda: self.bench_lake("tsv")),
+        }
+
+    def run(self, names=None, repeat=3):
+        """ベンチマークを実行する
+
+        Args:
+            names (list): 実行するベンチマーク。Noneならすべて
+            repeat (int): 時間を計る回数
+
+        Returns:
+            list: ベンチマークごとの結果の辞書
+        """
+        results = []
+        for name, (unit, func) in self.benchmarks().items():
+            if names is not None and name not in names:
+                continue
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                items = self.call(func)
+                seconds.append(time.perf_counter() - start - self.setup_seconds)
+
+            # メモリは時間とは別の1回で計る。tracemallocの分だけ遅くなるため
+            tracemalloc.start()
+            self.call(func)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            median = statistics.median(seconds)
+            results.append({
+                "name": name,
+                "unit": unit,
+                "items": items,
+                "seconds": seconds,
+                "median_seconds": median,
+                "items_per_sec": items / median if median > 0 else None,
+                "peak_memory_bytes": peak,
+            })
+            # 速すぎて時間が0なら件数/秒は出せないので"-"にする
+            items_per_sec = results[-1]["items_per_sec"]
+            items_per_sec = f"{items_per_sec:10.1f}" if items_per_sec is not None else f"{'-':>10s}"
+            print(f"{name:16s}{items:8d} {unit:8s}{median:8.3f} sec{items_per_sec} {unit}/sec{peak / 2**20:8.1f} MiB")
+
+        return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """前回の結果と比べてスループットとメモリの比を表示する"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {x["name"]: x for x in json.load(f)["results"]}
+    print("compare with", baseline_path)
+    print(f"{'name':16s}{'throughput':>12s}{'memory':>10s}")
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None or not old["items_per_sec"] or not old["peak_memory_bytes"]:
+            continue
+        throughput = result["items_per_sec"] / old["items_per_sec"]
+        memory = result["peak_memory_bytes"] / old["peak_memory_bytes"]
+        print(f"{result['name']:16s}{throughput:11.2f}x{memory:9.2f}x")
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default="data/fixtures")
+    parser.add_argument("--benchmarks", nargs="*", default=None, help="実行するベンチマーク。省略するとすべて")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--lake-copies", type=int, default=10)
+    parser.add_argument("--output", default=None, help="結果のJSON。省略するとdata/benchmark/suite_実行日時.json")
+    parser.add_argument("--baseline", default=None, help="比べる前回の結果のJSON")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    fixture_dir = args.fixtures
+    synthetic = len(FixtureStore(fixture_dir)) == 0
+    if synthetic:
+        fixture_dir = os.path.join(work_dir, "fixtures")
+        write_synthetic(FixtureStore(fixture_dir), load_config().team)
+    store = FixtureStore(fixture_dir)
+
+    ready = multiprocessing.Queue()
+    faults = {"error_rate": args.error_rate, "retry_after": 0}
+    server = multiprocessing.Process(target=serve, args=(fixture_dir, args.latency, faults, ready), daemon=True)
+    server.start()
+    try:
+        url = ready.get(timeout=30)
+        print(len(store), "pages", "(synthetic)" if synthetic else "", "at", url)
+        results = Suite(store, url, work_dir, concurrency=args.concurrency, lake_copies=args.lake_copies).run(args.benchmarks, args.repeat)
+    finally:
+        server.terminate()
+        shutil.rmtree(work_dir)
+
+    now = datetime.datetime.now()
+    report = {
+        "created_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "fixtures": {"pages": len(store), "synthetic": synthetic},
+        "server": {"latency": args.latency, "error_rate": args.error_rate},
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        # ru_maxrssはLinuxではKiB
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "results": results,
+    }
+    output = args.output or os.path.join("data/benchmark", f"suite_{now.strftime('%Y%m%d%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("result", output)
+
+    if args.baseline is not None:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
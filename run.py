@@ -1,35 +1,132 @@
 # import argparse
+import cProfile
 import datetime
 import os
+import pstats
 
 from omegaconf import OmegaConf
 
+from src.backfill import Backfill
+from src.replay import ArchiveReplay
 from src.scraping import ScrapingSponavi
+from src.state import ScrapingState
 
-now_datetime = datetime.datetime.now()
-
-# 出力先
-conf_dir = "config"
-conf_cli = OmegaConf.from_cli()
-conf_exec = OmegaConf.load(os.path.join(conf_dir, "config_exec.yaml"))
-conf_path = OmegaConf.load(os.path.join(conf_dir, "config_path.yaml"))
-conf_url = OmegaConf.load(os.path.join(conf_dir, "config_url.yaml"))
-conf_team = OmegaConf.load(os.path.join(conf_dir, "config_team.yaml"))
-conf_schedule = OmegaConf.load(os.path.join(conf_dir, "config_schedule.yaml"))
-conf_table = OmegaConf.load(os.path.join(conf_dir, "config_table.yaml"))
-conf_merge = OmegaConf.merge(conf_cli, conf_exec, conf_path, conf_url, conf_team, conf_schedule, conf_table)
-
-# スクレイピング
-ss = ScrapingSponavi(
-    start_date=conf_merge.start_date,
-    end_date=conf_merge.end_date,
-    config=conf_merge
-    )
-
-# 試合データのスクレイピング
-if conf_merge.exec_run_score:
-    ss.exec_score_scraping()
-
-# 選手情報のスクレイピング
-if conf_merge.exec_run_player:
-    ss.exec_player_scraping()
+
+def main():
+    now_datetime = datetime.datetime.now()
+
+    # 出力先
+    conf_dir = "config"
+    conf_cli = OmegaConf.from_cli()
+    conf_exec = OmegaConf.load(os.path.join(conf_dir, "config_exec.yaml"))
+    conf_path = OmegaConf.load(os.path.join(conf_dir, "config_path.yaml"))
+    conf_url = OmegaConf.load(os.path.join(conf_dir, "config_url.yaml"))
+    conf_team = OmegaConf.load(os.path.join(conf_dir, "config_team.yaml"))
+    conf_schedule = OmegaConf.load(os.path.join(conf_dir, "config_schedule.yaml"))
+    conf_table = OmegaConf.load(os.path.join(conf_dir, "config_table.yaml"))
+    conf_fetch = OmegaConf.load(os.path.join(conf_dir, "config_fetch.yaml"))
+    conf_cache = OmegaConf.load(os.path.join(conf_dir, "config_cache.yaml"))
+    conf_bigquery = OmegaConf.load(os.path.join(conf_dir, "config_bigquery.yaml"))
+    conf_replay = OmegaConf.load(os.path.join(conf_dir, "config_replay.yaml"))
+    conf_backfill = OmegaConf.load(os.path.join(conf_dir, "config_backfill.yaml"))
+    conf_merge = OmegaConf.merge(conf_exec, conf_path, conf_url, conf_team, conf_schedule, conf_table, conf_fetch, conf_cache, conf_bigquery, conf_replay, conf_backfill, conf_cli)
+
+    # CLIからexec_profile=Trueで実行全体をプロファイルする
+    profiler = cProfile.Profile() if conf_merge.get("exec_profile", False) else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        ss = run(conf_merge, now_datetime)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            write_profile(profiler, conf_merge.path_metrics, now_datetime)
+
+    # 実行の集計を表示して出力する
+    ss.metrics.report()
+    print("metrics", ss.metrics.write(conf_merge.path_metrics, "run_" + now_datetime.strftime("%Y%m%d%H%M%S")))
+
+    return None
+
+
+def write_profile(profiler, output_dir, now_datetime):
+    """プロファイルを保存し、累積時間の上位を表示する"""
+    os.makedirs(output_dir, exist_ok=True)
+    profile_path = os.path.join(output_dir, "run_" + now_datetime.strftime("%Y%m%d%H%M%S") + ".prof")
+    profiler.dump_stats(profile_path)
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
+    print("profile", profile_path)
+
+    return None
+
+
+def run(conf_merge, now_datetime):
+    # 対象期間
+    start_date = conf_merge.get("start_date")
+    end_date = conf_merge.get("end_date")
+
+    # 前回の続きから今日までを取得する
+    if conf_merge.exec_incremental:
+        resume_date = ScrapingState(conf_merge.path_state_db).get_resume_date()
+        start_date = resume_date if resume_date is not None else start_date
+        end_date = now_datetime.strftime("%Y-%m-%d")
+        print("incremental ", start_date, "-", end_date)
+
+    # スクレイピング
+    ss = ScrapingSponavi(
+        start_date=start_date,
+        end_date=end_date,
+        config=conf_merge
+        )
+
+    # 保存済みのhtmlからlakeを作り直す。ネットワークには接続しない
+    if conf_merge.exec_replay:
+        ArchiveReplay.from_config(ss, conf_merge).run(
+            conf_merge.path_output_game_html,
+            cache_dir=conf_merge.path_cache_html if conf_merge.replay.score_from_cache else None,
+            )
+        return ss
+
+    # 前回までに取得できなかったページを取り直す
+    if conf_merge.fetch.get("retry_dead_letters", True):
+        ss.retry_dead_letters()
+
+    # 長い期間を複数プロセスで取得してlakeにまとめる
+    if conf_merge.exec_backfill:
+        Backfill.from_config(ss, conf_merge).run(start_date, end_date)
+        return ss
+
+    # 当日の試合を試合中から取得する
+    if conf_merge.exec_live:
+        ss.exec_live_scraping()
+        return ss
+
+    # 試合データのスクレイピング
+    if conf_merge.exec_run_score:
+        ss.exec_score_scraping()
+
+    # 選手情報のスクレイピング
+    if conf_merge.exec_run_player:
+        ss.exec_player_scraping()
+
+    # 選手の今季成績のスクレイピング
+    if conf_merge.exec_run_player_score:
+        ss.exec_player_score_scraping()
+
+    # lakeの新しい試合をdatamartに足し込む
+    if conf_merge.exec_run_datamart:
+        ss.exec_datamart()
+
+    # lakeをローカルの検索用のSQLiteに入れる
+    if conf_merge.exec_run_query_sync:
+        ss.exec_query_sync()
+
+    # lakeの新しい試合の速報ページの行をイベントストアに追記する
+    if conf_merge.exec_run_event_store:
+        ss.exec_event_store()
+
+    return ss
+
+
+if __name__ == "__main__":
+    main()
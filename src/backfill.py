@@ -0,0 +1,219 @@
+import contextlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from omegaconf import OmegaConf
+
+from .lake import LakeReader
+from .state import ScrapingState
+
+# まとめるテーブルと並べる順
+MERGE_TABLES = {
+    "lake_game": ["game_date", "game_id"],
+    "lake_score": ["game_id", "index"],
+}
+
+
+def make_shards(dates, sports_list, n_shards):
+    """日付を連続した区間に分け、競技ごとのシャードにする
+
+    Args:
+        dates (list): 取得する日付（YYYY-MM-DD）の昇順のリスト
+        sports_list (list): 競技（url_domainの後ろのパス）のリスト
+        n_shards (int): 競技ごとのシャード数の上限
+
+    Returns:
+        list: sports, start_date, end_date, nameの辞書のリスト
+    """
+    n_shards = max(min(n_shards, len(dates)), 1)
+    shards = []
+    for sports in sports_list:
+        for i in range(n_shards):
+            chunk = dates[len(dates) * i // n_shards:len(dates) * (i + 1) // n_shards]
+            if len(chunk) == 0:
+                continue
+            shards.append({
+                "sports": sports,
+                "start_date": chunk[0],
+                "end_date": chunk[-1],
+                "name": f"{sports}_{chunk[0]}_{chunk[-1]}",
+            })
+
+    return shards
+
+
+def run_shard(config, shard, shard_dir, rate_per_host):
+    """ワーカープロセスで1シャードを取得する。出力はシャードのディレクトリに書く
+
+    Returns:
+        tuple: (シャード名, 秒数, 取得できなかったURLの数)
+    """
+    from .scraping import ScrapingSponavi
+
+    os.makedirs(shard_dir, exist_ok=True)
+    config = OmegaConf.create(config)
+    config.exec_sports = shard["sports"]
+    config.exec_output = True
+    config.exec_upload = False
+    config.exec_lake_format = "parquet"
+    config.path_output_lake_parquet = os.path.join(shard_dir, "lake")
+    config.path_state_db = os.path.join(shard_dir, "state.sqlite")
+    OmegaConf.update(config, "fetch.rate_per_host", rate_per_host, force_add=True)
+
+    start = time.perf_counter()
+    with open(os.path.join(shard_dir, "shard.log"), "a", encoding="utf-8") as f, contextlib.redirect_stdout(f):
+        scraper = ScrapingSponavi(config, shard["start_date"], shard["end_date"])
+        scraper.retry_dead_letters()
+        scraper.exec_score_scraping()
+        scraper.metrics.write(shard_dir, "metrics")
+
+    return shard["name"], time.perf_counter() - start, len(scraper.state.get_dead_letters())
+
+
+class Backfill():
+    """長い期間や複数の競技を日付の区間と競技ごとのシャードに分け、複数プロセスで取得してlakeにまとめる
+
+    シャードはpath_backfillの下のシャードごとのディレクトリに、それぞれの状態DBとlakeを持つので、
+    途中で止まっても同じ期間で実行し直せば続きから取得する。アクセス頻度は全体のrate_per_hostを
+    同時に動くプロセス数で割ったものを各シャードに割り当てる。
+    まとめるときは出力まで終わった試合だけを、まとめ先にまだない試合に限って日付と試合の順に書き出す。
+
+    Args:
+        scraper (ScrapingSponavi): まとめ先のlakeと状態DBを持つスクレイパー
+        config (DictConfig): 全体の設定。ワーカーでスクレイパーを作るのに使う
+        backfill_dir (str): シャードの出力先のディレクトリ
+        sports_list (list): 取得する競技のリスト
+        workers (int): 同時に動かすプロセス数
+        shards_per_sports (int): 競技ごとのシャード数
+    """
+    def __init__(self, scraper, config, backfill_dir, sports_list, workers=4, shards_per_sports=8):
+        self.scraper = scraper
+        self.config = OmegaConf.to_container(config, resolve=True)
+        self.backfill_dir = backfill_dir
+        self.sports_list = list(sports_list)
+        self.workers = max(workers, 1)
+        self.shards_per_sports = shards_per_sports
+        self.rate_per_host = config.get("fetch", {}).get("rate_per_host", 1.0)
+
+    @classmethod
+    def from_config(cls, scraper, config):
+        backfill = config.get("backfill", {})
+        sports_list = backfill.get("sports") or [config.exec_sports]
+
+        return cls(
+            scraper,
+            config,
+            backfill_dir=config.get("path_backfill", "data/backfill"),
+            sports_list=sports_list,
+            workers=backfill.get("workers", 4),
+            shards_per_sports=backfill.get("shards_per_sports", 8),
+            )
+
+    def plan(self, start_date, end_date):
+        """期間のうちconfig_schedule.yamlの試合期間に入る日を、シャードに分ける
+
+        Raises:
+            ValueError: 期間にconfig_schedule.yamlにない年があるとき。その年を黙って飛ばさない
+        """
+        dates = pd.date_range(start=start_date, end=end_date)
+        self.scraper.calendar.report_uncovered(dates)
+        missing_years = self.scraper.calendar.missing_years(dates)
+        if len(missing_years) > 0:
+            raise ValueError(f"years not in config_schedule.yaml: {missing_years}")
+        dates = [d.strftime("%Y-%m-%d") for d, series in zip(dates, self.scraper.calendar.classify(dates)) if series is not None]
+
+        return make_shards(dates, self.sports_list, self.shards_per_sports)
+
+    def shard_dir(self, shard):
+        return os.path.join(self.backfill_dir, shard["name"])
+
+    def run(self, start_date, end_date):
+        """シャードを取得してまとめる
+
+        Args:
+            start_date (str): 開始日
+            end_date (str): 終了日
+
+        Returns:
+            dict: テーブルごとのまとめた行数
+        """
+        shards = self.plan(start_date, end_date)
+        rate_per_host = self.rate_per_host / self.workers if self.rate_per_host > 0 else 0
+        print("backfill", len(shards), "shards", self.workers, "workers", f"{rate_per_host:.2f} req/sec per shard")
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(run_shard, self.config, shard, self.shard_dir(shard), rate_per_host) for shard in shards]
+            for future in as_completed(futures):
+                try:
+                    name, seconds, n_dead = future.result()
+                    print("shard", name, f"{seconds:.0f} sec", n_dead, "dead letters")
+                except Exception as e:
+                    print("error in shard", repr(e))
+
+        counts = self.merge(shards)
+        print("finish backfill", counts, "="*10)
+
+        return counts
+
+    def read_shards(self, shards, table_name):
+        frames = []
+        for shard in sorted(shards, key=lambda x: x["name"]):
+            df = LakeReader(os.path.join(self.shard_dir(shard), "lake"), self.scraper.table).read(table_name)
+            if df is not None and len(df) > 0:
+                frames.append(df)
+
+        return pd.concat(frames, ignore_index=True) if len(frames) > 0 else None
+
+    def merge(self, shards):
+        """シャードのlakeをまとめ先のlakeに書き出し、まとめ先の状態DBに記録する
+
+        同じ試合が複数のシャードにあれば実行日の新しいものを使う。何度まとめても行は重複しない。
+
+        Args:
+            shards (list): make_shardsのシャード
+
+        Returns:
+            dict: テーブルごとの書き出した行数
+        """
+        counts = {}
+        df_game = self.read_shards(shards, "lake_game")
+        if df_game is None:
+            return counts
+
+        # まとめ先にまだない試合だけ
+        df_game["game_date"] = pd.to_datetime(df_game["game_date"]).dt.strftime("%Y-%m-%d")
+        df_game = df_game.sort_values(["game_id", "exec_datetime"], kind="stable").drop_duplicates(subset=["game_id"], keep="last")
+        df_existing = self.scraper.read_lake("lake_game", columns=["game_id"])
+        if df_existing is not None:
+            df_game = df_game[~df_game["game_id"].isin(df_existing["game_id"])]
+        df_game = df_game.sort_values(MERGE_TABLES["lake_game"], ignore_index=True)
+        game_dates = df_game.set_index("game_id")["game_date"]
+
+        df_score = self.read_shards(shards, "lake_score")
+        if df_score is not None:
+            df_score = df_score[df_score["game_id"].isin(game_dates.index)]
+            df_score = df_score.sort_values(["game_id", "index", "exec_datetime"], kind="stable")
+            df_score = df_score.drop_duplicates(subset=["game_id", "index"], keep="last").sort_values(MERGE_TABLES["lake_score"], ignore_index=True)
+
+        for table_name, df in [("lake_game", df_game), ("lake_score", df_score)]:
+            if df is None or len(df) == 0:
+                continue
+            df = df[[c.name for c in self.scraper.table[table_name].column]]
+            for game_date, df_date in df.groupby(df["game_id"].map(game_dates), sort=True):
+                self.scraper.save_lake(df_date, table_name, game_date=game_date)
+            if self.scraper.upload_flag:
+                self.scraper.loader.append(df, table_name)
+            counts[table_name] = len(df)
+
+        # まとめた試合と取得済みの日付を記録し、通常の実行で取り直さないようにする
+        for row in df_game.itertuples():
+            self.scraper.state.save_game(row.game_id, game_date=row.game_date, game_status=row.game_status, completed=True)
+        for shard in shards:
+            for game_date, game_num in ScrapingState(os.path.join(self.shard_dir(shard), "state.sqlite")).get_dates().items():
+                self.scraper.state.save_date(game_date, game_num)
+        if self.scraper.upload_flag:
+            self.scraper.loader.flush()
+
+        return counts
@@ -0,0 +1,221 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+class HtmlCache():
+    """URLをキーにhtmlを圧縮して保存するディスクキャッシュ
+
+    ページの種類ごとにTTLを設定し、期限切れのページはETag/Last-Modifiedで再検証する。
+    合計サイズがmax_bytesを超えたら最終参照が古いものから削除する。
+
+    Args:
+        cache_dir (str): 保存先のディレクトリ
+        ttl_rules (list): URLの正規表現ごとのTTL設定
+        default_ttl (int): どのルールにも一致しないページのTTL（秒）
+        max_bytes (int): キャッシュの合計サイズの上限
+    """
+    def __init__(self, cache_dir, ttl_rules=None, default_ttl=3600, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.ttl_rules = [
+            {
+                "pattern": re.compile(rule["pattern"]),
+                "ttl": rule.get("ttl"),
+                "immutable_past_date": rule.get("immutable_past_date", False),
+                "immutable_marker": rule.get("immutable_marker"),
+            }
+            for rule in (ttl_rules or [])
+        ]
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_bytes = sum(self.file_size(path) for path in self.list_files())
+
+    @classmethod
+    def from_config(cls, config, cache_dir):
+        """設定からキャッシュを作る。無効の場合はNone
+
+        Args:
+            config (DictConfig): cacheの設定
+            cache_dir (str): 保存先のディレクトリ
+
+        Returns:
+            HtmlCache: キャッシュ
+        """
+        if config is None or not config.get("enable", False):
+            return None
+
+        return cls(
+            cache_dir=cache_dir,
+            ttl_rules=config.get("ttl_rules", []),
+            default_ttl=config.get("default_ttl", 3600),
+            max_bytes=config.get("max_bytes", 2 * 1024 ** 3),
+            )
+
+    def make_key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def make_path(self, url):
+        key = self.make_key(url)
+        return os.path.join(self.cache_dir, key[:2], key + ".json.gz")
+
+    def list_files(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                if file_name.endswith(".json.gz"):
+                    yield os.path.join(root, file_name)
+
+    @staticmethod
+    def file_size(path):
+        """ファイルのサイズ。他のスレッドやプロセスが削除していれば0"""
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def file_mtime(path):
+        """ファイルの最終参照時刻。他のスレッドやプロセスが削除していれば0"""
+        try:
+            return os.path.getmtime(path)
+        except FileNotFoundError:
+            return 0
+
+    def get_ttl(self, url, html):
+        """ページのTTLを決める
+
+        Args:
+            url (str): URL
+            html (str): html
+
+        Returns:
+            int: TTL（秒）。Noneなら期限なし
+        """
+        for rule in self.ttl_rules:
+            if not rule["pattern"].search(url):
+                continue
+
+            # 過去日のスケジュールは変化しない
+            if rule["immutable_past_date"]:
+                match = re.search(r"date=(\d{4}-\d{2}-\d{2})", url)
+                if match and match.group(1) < datetime.date.today().strftime("%Y-%m-%d"):
+                    return None
+
+            # 試合終了後のページは変化しない
+            if rule["immutable_marker"] is not None and rule["immutable_marker"] in html:
+                return None
+
+            return rule["ttl"]
+
+        return self.default_ttl
+
+    def get(self, url):
+        """キャッシュを読む
+
+        Args:
+            url (str): URL
+
+        Returns:
+            dict: url, html, fetched_at, expires_at, etag, last_modified。なければNone
+        """
+        path = self.make_path(url)
+        entry = self.read_file(path)
+        if entry is None:
+            return None
+
+        # LRUのために参照時刻を更新。読んだ後に他のスレッドやプロセスが削除していればないものとする
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return entry
+
+    @staticmethod
+    def read_file(path):
+        """キャッシュのファイルを読む。壊れていればNone"""
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry):
+        return entry["expires_at"] is None or entry["expires_at"] > time.time()
+
+    def put(self, url, html, etag=None, last_modified=None):
+        """キャッシュに書き込む
+
+        Args:
+            url (str): URL
+            html (str): html
+            etag (str): ETagヘッダ
+            last_modified (str): Last-Modifiedヘッダ
+        """
+        now = time.time()
+        ttl = self.get_ttl(url, html)
+        entry = {
+            "url": url,
+            "html": html,
+            "fetched_at": now,
+            "expires_at": None if ttl is None else now + ttl,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+
+        path = self.make_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+        with self.lock:
+            old_size = self.file_size(path)
+            os.replace(tmp_path, path)
+            self.total_bytes += self.file_size(path) - old_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+        return None
+
+    def revalidated(self, entry):
+        """304が返ってきたエントリの期限を延長する
+
+        Args:
+            entry (dict): キャッシュのエントリ
+        """
+        self.put(entry["url"], entry["html"], etag=entry["etag"], last_modified=entry["last_modified"])
+
+        return None
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def evict(self):
+        """最終参照の古い順に上限の9割まで削除する。他のスレッドやプロセスが先に削除したファイルは飛ばす"""
+        files = sorted(self.list_files(), key=self.file_mtime)
+        target = self.max_bytes * 0.9
+        for path in files:
+            if self.total_bytes <= target:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+
+        return None
@@ -0,0 +1,301 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# 集計テーブルごとのキー。キー以外の列はすべて足し合わせられる件数
+TABLE_KEYS = {
+    "standings": ["season", "game_series", "team_id"],
+    "head_to_head": ["season", "game_series", "team_id", "opponent_id"],
+    "batter_splits": ["season", "batter_id", "pitcher_side", "base_state"],
+    "pitcher_splits": ["season", "pitcher_id", "batter_side", "base_state"],
+}
+
+# result_mainから数える打席結果
+RESULT_PATTERNS = {
+    "hits": "安打|ヒット|二塁打|三塁打|本塁打|ホームラン",
+    "home_runs": "本塁打|ホームラン",
+    "strikeouts": "三振",
+    "walks": "四球",
+    "hit_by_pitch": "死球",
+}
+
+# 速報ページの列のうち集計に使う列
+SCORE_COLUMNS = ["game_id", "result_main", "batter_id", "batter_side", "pitcher_id", "pitcher_side", "base_1", "base_2", "base_3"]
+
+
+def base_state(df_score):
+    """走者の状況を1塁=1, 2塁=2, 3塁=4のビットの和（0〜7）にする"""
+    state = np.zeros(len(df_score), dtype=np.int8)
+    for i in range(1, 4):
+        state |= df_score[f"base_{i}"].notna().to_numpy().astype(np.int8) << (i - 1)
+
+    return state
+
+
+def team_games(df_game, calendar=None):
+    """終了した試合をチームごとの行（1試合2行）にする
+
+    Args:
+        df_game (DataFrame): lake_game
+        calendar (SeasonCalendar): 渡すと試合の種類を日付から判定し直す
+
+    Returns:
+        DataFrame: season, game_series, team_id, opponent_id, runs_scored, runs_allowed
+    """
+    df = df_game[df_game["game_status"] == "finish"]
+    dates = pd.to_datetime(df["game_date"])
+    season = dates.dt.year.to_numpy()
+    if calendar is not None:
+        game_series = calendar.classify(dates)
+    else:
+        game_series = df["game_series"].to_numpy(dtype=object)
+    game_series = pd.Series(game_series, dtype=object).fillna("unknown").to_numpy()
+    score_top = pd.to_numeric(df["score_top"], errors="coerce").to_numpy()
+    score_bottom = pd.to_numeric(df["score_bottom"], errors="coerce").to_numpy()
+    team_top = df["team_top_id"].astype(str).str.strip().to_numpy()
+    team_bottom = df["team_bottom_id"].astype(str).str.strip().to_numpy()
+
+    return pd.DataFrame({
+        "season": np.concatenate([season, season]),
+        "game_series": np.concatenate([game_series, game_series]),
+        "team_id": np.concatenate([team_top, team_bottom]),
+        "opponent_id": np.concatenate([team_bottom, team_top]),
+        "runs_scored": np.concatenate([score_top, score_bottom]),
+        "runs_allowed": np.concatenate([score_bottom, score_top]),
+    })
+
+
+def aggregate_games(df_team, keys):
+    """チームごとの試合から勝敗と得失点を集計する"""
+    runs_scored = df_team["runs_scored"].to_numpy()
+    runs_allowed = df_team["runs_allowed"].to_numpy()
+    df = df_team[keys].assign(
+        games=1,
+        wins=(runs_scored > runs_allowed).astype(np.int64),
+        losses=(runs_scored < runs_allowed).astype(np.int64),
+        draws=(runs_scored == runs_allowed).astype(np.int64),
+        runs_scored=np.nan_to_num(runs_scored).astype(np.int64),
+        runs_allowed=np.nan_to_num(runs_allowed).astype(np.int64),
+        )
+
+    return df.groupby(keys, as_index=False, sort=True).sum()
+
+
+def plate_appearance_ends(df_score, result):
+    """打席の結果を数える行。打席（試合とindexの先頭5桁）ごとに、打席結果のある最後のページ
+
+    Args:
+        df_score (DataFrame): 試合とindexの順に並べたlake_score
+        result (Series): 欠損を空文字にしたresult_main
+
+    Returns:
+        ndarray: 打席の終わりの行ならTrue
+    """
+    has_result = (result != "").to_numpy()
+    if "index" not in df_score.columns:
+        return has_result
+    key = df_score["game_id"].astype(str) + ":" + df_score["index"].astype(str).str[:5]
+
+    return has_result & ~key.where(has_result).duplicated(keep="last").to_numpy()
+
+
+def score_events(df_score, df_game):
+    """速報ページの行に集計用の列を付ける
+
+    同じ試合とindexのページは最後の1行にし、打席数と打席結果は打席ごとに1回だけ数える。
+
+    Args:
+        df_score (DataFrame): lake_score
+        df_game (DataFrame): lake_game。試合日からシーズンを求める
+
+    Returns:
+        DataFrame: season, 打者と投手, base_state, 打席結果ごとのフラグ
+    """
+    if "index" in df_score.columns:
+        df_score = df_score.drop_duplicates(subset=["game_id", "index"], keep="last").sort_values(["game_id", "index"], ignore_index=True)
+    season = df_score["game_id"].map(df_game.set_index("game_id")["game_date"].astype(str).str[:4]).astype("Int64")
+    result = df_score["result_main"].fillna("").astype(str)
+    pa_end = plate_appearance_ends(df_score, result)
+    df = pd.DataFrame({
+        "season": season,
+        "batter_id": df_score["batter_id"].astype(object),
+        "batter_side": df_score["batter_side"].astype(object).fillna("unknown"),
+        "pitcher_id": df_score["pitcher_id"].astype(object),
+        "pitcher_side": df_score["pitcher_side"].astype(object).fillna("unknown"),
+        "base_state": base_state(df_score),
+        "events": np.ones(len(df_score), dtype=np.int64),
+        "plate_appearances": pa_end.astype(np.int64),
+    })
+    for name, pattern in RESULT_PATTERNS.items():
+        df[name] = (result.str.contains(pattern).to_numpy() & pa_end).astype(np.int64)
+
+    return df[df["season"].notna()]
+
+
+def aggregate_events(df_events, keys):
+    metrics = ["events", "plate_appearances"] + list(RESULT_PATTERNS)
+
+    return df_events.groupby(keys, as_index=False, sort=True, observed=True)[metrics].sum()
+
+
+class Datamart():
+    """lakeから順位表、対戦成績、打者/投手の左右・走者状況別の成績を作る
+
+    集計はすべて足し合わせられる件数で持ち、まだ集計していない試合だけを集計して
+    既存の集計に足し込む。集計済みの試合IDは順位表と打者/投手の成績で別に持ち、速報ページが後から
+    出力された試合も成績に足し込む。集計済みの試合IDと集計テーブルはdatamart_dirにParquetで保存する。
+
+    Args:
+        datamart_dir (str): 保存先のディレクトリ。Noneなら保存しない
+        calendar (SeasonCalendar): 試合の種類を日付から判定するカレンダー
+        team_dict (DictConfig): config_team.yamlのteam。順位表のリーグに使う
+    """
+    def __init__(self, datamart_dir=None, calendar=None, team_dict=None):
+        self.datamart_dir = datamart_dir
+        self.calendar = calendar
+        self.team_league = {str(t.team_id).strip(): t.league for t in team_dict.values()} if team_dict is not None else {}
+        self.tables = {name: None for name in TABLE_KEYS}
+        # 順位表と対戦成績に足し込んだ試合
+        self.game_ids = set()
+        # 打者/投手の成績に足し込んだ試合
+        self.split_game_ids = set()
+        if datamart_dir is not None:
+            self.load()
+
+    def make_path(self, name):
+        return os.path.join(self.datamart_dir, name + ".parquet")
+
+    def load(self):
+        """保存済みの集計を読む"""
+        for name in TABLE_KEYS:
+            if os.path.exists(self.make_path(name)):
+                self.tables[name] = pd.read_parquet(self.make_path(name))
+        if os.path.exists(self.make_path("games")):
+            self.game_ids = set(pd.read_parquet(self.make_path("games"))["game_id"])
+        if os.path.exists(self.make_path("split_games")):
+            self.split_game_ids = set(pd.read_parquet(self.make_path("split_games"))["game_id"])
+
+        return None
+
+    def save(self):
+        """集計を保存する。書き終わってから置き換える"""
+        os.makedirs(self.datamart_dir, exist_ok=True)
+        frames = dict(self.tables)
+        frames["games"] = pd.DataFrame({"game_id": sorted(self.game_ids)})
+        frames["split_games"] = pd.DataFrame({"game_id": sorted(self.split_game_ids)})
+        for name, df in frames.items():
+            if df is None:
+                continue
+            tmp_path = self.make_path(name) + ".tmp"
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.make_path(name))
+
+        return None
+
+    def new_game_ids(self, df_game):
+        """順位表か打者/投手の成績にまだ集計していない終了した試合のID"""
+        finished = df_game.loc[df_game["game_status"] == "finish", "game_id"].astype(str)
+
+        return sorted(set(finished) - (self.game_ids & self.split_game_ids))
+
+    def fold(self, name, delta):
+        """差分の集計を既存の集計に足し込む"""
+        current = self.tables[name]
+        if current is not None and len(current) > 0:
+            delta = pd.concat([current, delta], ignore_index=True).groupby(TABLE_KEYS[name], as_index=False, sort=True).sum()
+        self.tables[name] = delta.reset_index(drop=True)
+
+        return None
+
+    def update(self, df_game, df_score=None):
+        """まだ集計していない試合を集計に足し込む
+
+        Args:
+            df_game (DataFrame): lake_game。集計済みの試合が含まれていても良い
+            df_score (DataFrame): lake_score。Noneなら打者/投手の成績は更新しない
+
+        Returns:
+            int: 順位表か打者/投手の成績に足し込んだ試合数
+        """
+        new_ids = self.new_game_ids(df_game)
+        if len(new_ids) == 0:
+            return 0
+
+        df_game = df_game[df_game["game_id"].astype(str).isin(new_ids)].drop_duplicates(subset=["game_id"], keep="last")
+        standing_ids = sorted(set(new_ids) - self.game_ids)
+        df_team = team_games(df_game[df_game["game_id"].astype(str).isin(standing_ids)], self.calendar)
+        self.fold("standings", aggregate_games(df_team, TABLE_KEYS["standings"]))
+        self.fold("head_to_head", aggregate_games(df_team, TABLE_KEYS["head_to_head"]))
+        self.game_ids.update(standing_ids)
+
+        # 速報ページのある試合だけ成績に足し込む。まだない試合は次回に足し込む
+        split_ids = []
+        if df_score is not None:
+            df_score = df_score[df_score["game_id"].astype(str).isin(set(new_ids) - self.split_game_ids)]
+            split_ids = sorted(set(df_score["game_id"].astype(str)))
+            df_events = score_events(df_score, df_game)
+            self.fold("batter_splits", aggregate_events(df_events, TABLE_KEYS["batter_splits"]))
+            self.fold("pitcher_splits", aggregate_events(df_events, TABLE_KEYS["pitcher_splits"]))
+            self.split_game_ids.update(split_ids)
+
+        return len(set(standing_ids) | set(split_ids))
+
+    def standings(self, season=None, game_series="pennant_race"):
+        """順位表。リーグごとに勝率順に並べ、ゲーム差を付ける
+
+        Args:
+            season (int): シーズン。Noneなら全シーズン
+            game_series (str): 試合の種類
+
+        Returns:
+            DataFrame: 順位表
+        """
+        df = self.tables["standings"]
+        if df is None:
+            return None
+        df = df[df["game_series"] == game_series]
+        if season is not None:
+            df = df[df["season"] == season]
+        df = df.assign(league=df["team_id"].map(self.team_league).fillna("unknown"))
+        df["win_pct"] = df["wins"] / (df["wins"] + df["losses"]).replace(0, np.nan)
+        df = df.sort_values(["season", "league", "win_pct"], ascending=[True, True, False], ignore_index=True)
+
+        # 首位とのゲーム差
+        group = df.groupby(["season", "league"])
+        df["games_behind"] = ((group["wins"].transform("first") - df["wins"]) + (df["losses"] - group["losses"].transform("first"))) / 2
+        df["rank"] = group.cumcount() + 1
+
+        return df
+
+    def head_to_head(self, season=None, game_series="pennant_race"):
+        """チームごとの相手別の対戦成績"""
+        df = self.tables["head_to_head"]
+        if df is None:
+            return None
+        df = df[df["game_series"] == game_series]
+
+        return df[df["season"] == season] if season is not None else df
+
+    def splits(self, role, season=None, player_id=None):
+        """打者（role=batter）か投手（role=pitcher）の左右・走者状況別の成績
+
+        Args:
+            role (str): batterかpitcher
+            season (int): シーズン
+            player_id (str): 選手ID
+
+        Returns:
+            DataFrame: 成績。打率などは件数から計算する
+        """
+        df = self.tables[f"{role}_splits"]
+        if df is None:
+            return None
+        if season is not None:
+            df = df[df["season"] == season]
+        if player_id is not None:
+            df = df[df[f"{role}_id"] == player_id]
+
+        at_bats = (df["plate_appearances"] - df["walks"] - df["hit_by_pitch"]).replace(0, np.nan)
+
+        return df.assign(avg=df["hits"] / at_bats)
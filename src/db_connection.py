@@ -1,24 +1,244 @@
-import datetime
+import io
+import os
+import threading
+import time
+import uuid
 
-import numpy as np
 import pandas as pd
-import pandas_gbq
+import pyarrow.parquet as pq
 from omegaconf import OmegaConf
 
+from .lake import to_arrow
+from .metrics import Metrics
 
-def load_to_bigquery(df, project_id, db_name, table_name, if_exists="fail", schema_dict=None):
-    table_id = db_name + "." + table_name
 
-    print(f"load to {table_id}")
+def make_bigquery_schema(columns):
+    """config_table.yamlの列定義をBigQueryのスキーマにする。型がなければSTRING"""
+    return [{"name": c.name, "type": c.get("type", "STRING")} for c in columns]
 
-    # アップロード
-    pandas_gbq.to_gbq(
-        df, 
-        destination_table=table_id, 
-        project_id=project_id,
-        if_exists=if_exists,
-        table_schema=schema_dict,
-    )
-    print("success")
 
-    return None
+class BigQueryTransport():
+    """Parquetでステージングテーブルに入れ、キーでMERGEする
+
+    Args:
+        project_id (str): GCPのプロジェクトID
+    """
+    def __init__(self, project_id):
+        from google.cloud import bigquery
+
+        self.bigquery = bigquery
+        self.client = bigquery.Client(project=project_id)
+        self.project_id = project_id
+
+    def make_schema(self, columns):
+        return [self.bigquery.SchemaField(x["name"], x["type"]) for x in make_bigquery_schema(columns)]
+
+    def merge(self, df, db_name, table_name, keys, columns):
+        """dfをステージングに入れ、keysが一致する行は更新、それ以外は追加する
+
+        Args:
+            df (DataFrame): 入れるデータ
+            db_name (str): データセット名
+            table_name (str): テーブル名
+            keys (list): MERGEのキー
+            columns (ListConfig): config_table.yamlの列定義
+        """
+        table_id = f"{self.project_id}.{db_name}.{table_name}"
+        # 同時に動くローダー（一括取得と通常の実行など）がステージングを上書きし合わないよう、呼び出しごとに別のテーブルにする
+        staging_id = table_id + "__staging_" + uuid.uuid4().hex
+        print(f"merge into {table_id} {len(df)} rows")
+
+        # 本テーブルがなければ作る
+        self.client.create_table(self.bigquery.Table(table_id, schema=self.make_schema(columns)), exists_ok=True)
+
+        try:
+            # 列定義の型のParquetでステージングに入れる
+            buffer = io.BytesIO()
+            pq.write_table(to_arrow(df, columns), buffer)
+            buffer.seek(0)
+            job_config = self.bigquery.LoadJobConfig(
+                source_format=self.bigquery.SourceFormat.PARQUET,
+                write_disposition=self.bigquery.WriteDisposition.WRITE_TRUNCATE,
+                )
+            self.client.load_table_from_file(buffer, staging_id, job_config=job_config).result()
+
+            # MERGE
+            names = [c.name for c in columns]
+            on = " AND ".join(f"T.`{k}` = S.`{k}`" for k in keys)
+            update = ", ".join(f"`{c}` = S.`{c}`" for c in names if c not in keys)
+            insert = ", ".join(f"`{c}`" for c in names)
+            values = ", ".join(f"S.`{c}`" for c in names)
+            self.client.query(f"""
+                MERGE `{table_id}` T
+                USING `{staging_id}` S
+                ON {on}
+                WHEN MATCHED THEN UPDATE SET {update}
+                WHEN NOT MATCHED THEN INSERT ({insert}) VALUES ({values})
+            """).result()
+        finally:
+            self.client.delete_table(staging_id, not_found_ok=True)
+        print("success")
+
+        return None
+
+
+class LocalTransport():
+    """BigQueryの代わりにローカルのDataFrameにMERGEする。テストや動作確認用
+
+    Args:
+        output_dir (str): テーブルをParquetで保存するディレクトリ。Noneならメモリ上だけ
+    """
+    def __init__(self, output_dir=None):
+        self.output_dir = output_dir
+        self.tables = {}
+        self.load_jobs = 0
+
+    def make_path(self, db_name, table_name):
+        return os.path.join(self.output_dir, f"{db_name}.{table_name}.parquet")
+
+    def get_table(self, db_name, table_name):
+        table_id = f"{db_name}.{table_name}"
+        if table_id not in self.tables and self.output_dir is not None and os.path.exists(self.make_path(db_name, table_name)):
+            self.tables[table_id] = pd.read_parquet(self.make_path(db_name, table_name))
+
+        return self.tables.get(table_id)
+
+    def merge(self, df, db_name, table_name, keys, columns):
+        """BigQueryTransport.mergeと同じ結果になるようにローカルで更新する"""
+        self.load_jobs += 1
+        current = self.get_table(db_name, table_name)
+        if current is not None:
+            current = current[~current.set_index(keys).index.isin(df.set_index(keys).index)]
+            df = pd.concat([current, df], ignore_index=True)
+        self.tables[f"{db_name}.{table_name}"] = df
+
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            df.to_parquet(self.make_path(db_name, table_name), index=False)
+
+        return None
+
+
+class BigQueryLoader():
+    """lakeの行を日をまたいでためておき、件数か時間で区切ってまとめてMERGEする
+
+    同じキーの行はバッファ内で最後のものだけ残し、MERGEで既存の行を更新するので
+    再実行しても行が重複しない。
+
+    Args:
+        transport (BigQueryTransport): MERGEを実行するもの。LocalTransportでも良い
+        table (DictConfig): config_table.yamlのtable
+        max_rows (int): この行数たまったら書き込む
+        max_seconds (float): 最初の行がたまってからこの秒数たったら書き込む
+        metrics (Metrics): 書き込んだ行数と時間の記録先
+    """
+    def __init__(self, transport, table, max_rows=200000, max_seconds=600, metrics=None):
+        self.transport = transport
+        self.table = table
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.buffers = {}
+        self.buffer_started = {}
+        # パイプラインの複数のスレッドから追加される
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_config(cls, config, table, project_id, metrics=None):
+        """設定からローダーを作る
+
+        Args:
+            config (DictConfig): bigqueryの設定
+            table (DictConfig): config_table.yamlのtable
+            project_id (str): GCPのプロジェクトID
+            metrics (Metrics): 記録先
+
+        Returns:
+            BigQueryLoader: ローダー
+        """
+        config = config if config is not None else OmegaConf.create()
+        if config.get("transport", "bigquery") == "local":
+            transport = LocalTransport(config.get("path_local"))
+        else:
+            transport = BigQueryTransport(project_id)
+
+        return cls(
+            transport,
+            table,
+            max_rows=config.get("max_rows", 200000),
+            max_seconds=config.get("max_seconds", 600),
+            metrics=metrics,
+            )
+
+    def buffered_rows(self, table_name):
+        return sum(len(df) for df in self.buffers.get(table_name, []))
+
+    def append(self, df, table_name):
+        """行をためる。件数か時間が上限を超えたら書き込む。書き込めなくても行はためたままにする
+
+        Args:
+            df (DataFrame): lakeのテーブルの行
+            table_name (str): lake_game, lake_score, lake_playerなど
+        """
+        if len(df) == 0:
+            return None
+
+        with self.lock:
+            self.buffers.setdefault(table_name, []).append(df)
+            self.buffer_started.setdefault(table_name, time.monotonic())
+
+            if self.buffered_rows(table_name) >= self.max_rows or \
+                time.monotonic() - self.buffer_started[table_name] >= self.max_seconds:
+                # 書き込めなかった行はバッファに残り、次のflushで書き込み直す。最後のflushでは例外を送出する
+                try:
+                    self.flush(table_name)
+                except Exception:
+                    self.buffer_started[table_name] = time.monotonic()
+
+        return None
+
+    def flush(self, table_name=None):
+        """たまっている行を書き込む
+
+        書き込めたテーブルの行だけバッファから消す。失敗したテーブルの行は残して次のflushで書き込み直し、
+        他のテーブルを書き込んでから最初の例外を送出する。
+
+        Args:
+            table_name (str): 書き込むテーブル。Noneなら全テーブル
+
+        Raises:
+            Exception: transport.mergeの例外
+        """
+        errors = []
+        with self.lock:
+            table_names = [table_name] if table_name is not None else list(self.buffers)
+            for name in table_names:
+                frames = self.buffers.get(name, [])
+                if len(frames) == 0:
+                    continue
+
+                config = self.table[name]
+                keys = list(config.key)
+                df = pd.concat(frames, ignore_index=True).drop_duplicates(subset=keys, keep="last")
+                try:
+                    with self.metrics.timer("write_seconds", sink="bigquery", table=name):
+                        self.transport.merge(
+                            df,
+                            db_name=config.db_name,
+                            table_name=config.table_name,
+                            keys=keys,
+                            columns=config.column,
+                            )
+                except Exception as e:
+                    print("failed to merge", name, len(df), "rows are kept for the next flush", repr(e))
+                    self.metrics.inc("write_errors", sink="bigquery", table=name)
+                    errors.append(e)
+                    continue
+                del self.buffers[name]
+                self.buffer_started.pop(name, None)
+                self.metrics.inc("rows_written", len(df), sink="bigquery", table=name)
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        return None
@@ -0,0 +1,343 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 列ごとの型。IDと文字列は辞書の番号（なければ-1）、走者は1塁=1, 2塁=2, 3塁=4のビット
+COLUMNS = {
+    "game": np.int32,
+    "index": np.int32,
+    "batter": np.int32,
+    "batter_side": np.int16,
+    "pitcher": np.int32,
+    "pitcher_side": np.int16,
+    "result_main": np.int32,
+    "result_sub": np.int32,
+    "bases": np.uint8,
+}
+
+# 列ごとの辞書
+DICTIONARIES = {
+    "game": "game",
+    "batter": "player",
+    "pitcher": "player",
+    "batter_side": "text",
+    "pitcher_side": "text",
+    "result_main": "text",
+    "result_sub": "text",
+}
+
+# 行の番号を引けるようにする列
+INDEX_KEYS = ["game", "batter", "pitcher"]
+
+
+class Interner():
+    """文字列と番号の辞書。追記だけのJSON Linesに保存する
+
+    Args:
+        path (str): 保存先。Noneなら保存しない
+        length (int): 有効な値の数。ファイルがこれより長ければ切り詰める。Noneならファイル全体
+    """
+    def __init__(self, path=None, length=None):
+        self.path = path
+        self.values = []
+        self.codes = {}
+        self.n_saved = 0
+        if path is not None and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()
+            n_lines = len(lines) if length is None else min(length, len(lines))
+            for line in lines[:n_lines]:
+                self.add(json.loads(line))
+            self.n_saved = len(self.values)
+            # 前回の追記が確定する前に止まっていたら、確定した分だけに戻す
+            if n_lines < len(lines):
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(lines[:n_lines])
+                os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+
+        return code
+
+    def encode(self, values, add=True):
+        """値の列を番号にする。欠損は-1
+
+        種類ごとに1回だけ辞書を引くので、同じ値が繰り返す列でも速い。
+
+        Args:
+            values (array-like): 値の列
+            add (bool): 辞書にない値を追加するか。Falseなら-1
+
+        Returns:
+            ndarray: int32の番号
+        """
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        if add:
+            mapped = np.array([self.add(str(x)) for x in uniques], dtype=np.int32)
+        else:
+            mapped = np.array([self.codes.get(str(x), -1) for x in uniques], dtype=np.int32)
+
+        return np.where(codes < 0, -1, mapped[codes] if len(mapped) > 0 else -1).astype(np.int32)
+
+    def decode(self, codes):
+        """番号の列を値にする。-1はNone"""
+        values = np.array(self.values + [None], dtype=object)
+
+        return values[np.asarray(codes)]
+
+    def save(self):
+        """前回の保存から増えた値だけ追記する"""
+        if self.path is None or self.n_saved == len(self.values):
+            return None
+        with open(self.path, "a", encoding="utf-8") as f:
+            for value in self.values[self.n_saved:]:
+                f.write(json.dumps(value, ensure_ascii=False) + "\n")
+        self.n_saved = len(self.values)
+
+        return None
+
+
+def pack_bases(df_score):
+    bases = np.zeros(len(df_score), dtype=np.uint8)
+    for i in range(1, 4):
+        bases |= df_score[f"base_{i}"].notna().to_numpy().astype(np.uint8) << (i - 1)
+
+    return bases
+
+
+class EventStore():
+    """速報ページの行を固定長の列として持つ、追記できるイベントストア
+
+    IDと文字列は辞書の番号にして、列ごとにNumPyの配列のファイルに追記し、np.memmapで開く。
+    試合、打者、投手ごとに行の番号を並べたオフセットのインデックスを持つので、
+    全期間を読み込まずに1試合や1選手の行だけを取り出せる。1試合の行が続いていればコピーせずにmemmapのビューを返す。
+    行数と辞書の長さはmeta.jsonに最後に書き、開くときに辞書をその長さに切り詰めるので、
+    追記の途中で止まっても前回の追記までの行と辞書が有効。
+
+    Args:
+        store_dir (str): 保存先のディレクトリ
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        names = sorted(set(DICTIONARIES.values()))
+        # meta.jsonがなければ何も確定していないので辞書も空にする
+        meta = {"rows": 0, "dictionaries": {name: 0 for name in names}}
+        meta_path = os.path.join(store_dir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        self.n_rows = meta["rows"]
+        # 辞書は確定した長さまで読む。長さのないmeta.jsonならファイル全体
+        lengths = meta.get("dictionaries", {})
+        self.dictionaries = {
+            name: Interner(os.path.join(store_dir, f"dict_{name}.jsonl"), length=lengths.get(name))
+            for name in names
+        }
+        self.open()
+
+    def __len__(self):
+        return self.n_rows
+
+    def make_path(self, name):
+        return os.path.join(self.store_dir, name + ".bin")
+
+    def map_file(self, name, dtype, length=None):
+        """ファイルを読み込み専用のmemmapで開く。lengthがNoneならファイル全体"""
+        path = self.make_path(name)
+        if length == 0 or not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+
+        return np.memmap(path, dtype=dtype, mode="r", shape=(length,) if length is not None else None)
+
+    def open(self):
+        """列とインデックスをmemmapで開く。読み込むのは参照したページだけ"""
+        # インデックスを作り直した後、行数を書く前に止まっていたら作り直す
+        if self.n_rows > 0 and any(
+            not os.path.exists(self.make_path(f"index_{key}_rows")) or os.path.getsize(self.make_path(f"index_{key}_rows")) != self.n_rows * 8
+            for key in INDEX_KEYS
+        ):
+            self.build_indexes(self.n_rows)
+
+        self.columns = {name: self.map_file(name, dtype, self.n_rows) for name, dtype in COLUMNS.items()}
+        self.indexes = {
+            key: (self.map_file(f"index_{key}_offsets", np.int64), self.map_file(f"index_{key}_rows", np.int64, self.n_rows))
+            for key in INDEX_KEYS
+        }
+
+        return None
+
+    def encode(self, df_score):
+        """lake_scoreの行を列ごとの配列にする。ない列はすべて欠損とする"""
+        arrays = {}
+        for name, dictionary in DICTIONARIES.items():
+            column = name + "_id" if name in ["game", "batter", "pitcher"] else name
+            values = df_score[column] if column in df_score.columns else [None] * len(df_score)
+            arrays[name] = self.dictionaries[dictionary].encode(values)
+        arrays["index"] = pd.to_numeric(df_score["index"], errors="coerce").fillna(-1).to_numpy()
+        arrays["bases"] = pack_bases(df_score)
+
+        return {name: np.asarray(arrays[name]).astype(dtype) for name, dtype in COLUMNS.items()}
+
+    @staticmethod
+    def make_keys(games, indexes):
+        """試合の番号とindexを1つの整数にする"""
+        return (np.asarray(games).astype(np.int64) << 32) | (np.asarray(indexes).astype(np.int64) & 0xFFFFFFFF)
+
+    def existing_keys(self, game_codes):
+        """保存済みの試合の行のmake_keys"""
+        keys = [np.zeros(0, dtype=np.int64)]
+        for code in np.unique(game_codes):
+            rows = self.rows_of("game", code)
+            keys.append(self.make_keys(self.columns["game"][rows], self.columns["index"][rows]))
+
+        return np.concatenate(keys)
+
+    def append(self, df_score):
+        """lake_scoreの行を追記する。保存済みの試合とindexの組は飛ばす
+
+        Args:
+            df_score (DataFrame): lake_score
+
+        Returns:
+            int: 追記した行数
+        """
+        df_score = df_score.drop_duplicates(subset=["game_id", "index"], keep="last")
+        arrays = self.encode(df_score)
+
+        # 保存済みの組を除き、試合とindexの順に並べる
+        existing = self.existing_keys(arrays["game"])
+        if len(existing) > 0:
+            keep = ~np.isin(self.make_keys(arrays["game"], arrays["index"]), existing)
+            arrays = {name: array[keep] for name, array in arrays.items()}
+        order = np.lexsort((arrays["index"], arrays["game"]))
+        arrays = {name: array[order] for name, array in arrays.items()}
+        n_new = len(order)
+        if n_new == 0:
+            return 0
+
+        # 開いているmemmapを閉じてから、前回の行数の後ろに書く
+        self.columns, self.indexes = {}, {}
+        for name, dtype in COLUMNS.items():
+            with open(self.make_path(name), "ab") as f:
+                f.truncate(self.n_rows * np.dtype(dtype).itemsize)
+                f.write(arrays[name].tobytes())
+        for dictionary in self.dictionaries.values():
+            dictionary.save()
+        self.build_indexes(self.n_rows + n_new)
+        self.write_meta(self.n_rows + n_new)
+        self.open()
+
+        return n_new
+
+    def build_indexes(self, n_rows):
+        """試合、打者、投手ごとに行の番号を並べ、番号ごとの開始位置を作る"""
+        for key in INDEX_KEYS:
+            column = np.memmap(self.make_path(key), dtype=COLUMNS[key], mode="r", shape=(n_rows,))
+            rows = np.argsort(column, kind="stable").astype(np.int64)
+            offsets = np.searchsorted(column[rows], np.arange(len(self.dictionaries[DICTIONARIES[key]]) + 1)).astype(np.int64)
+            del column
+            for name, array in [(f"index_{key}_rows", rows), (f"index_{key}_offsets", offsets)]:
+                tmp_path = self.make_path(name) + ".tmp"
+                array.tofile(tmp_path)
+                os.replace(tmp_path, self.make_path(name))
+
+        return None
+
+    def write_meta(self, n_rows):
+        tmp_path = os.path.join(self.store_dir, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "rows": n_rows,
+                "dictionaries": {name: dictionary.n_saved for name, dictionary in self.dictionaries.items()},
+                "columns": {name: np.dtype(dtype).name for name, dtype in COLUMNS.items()},
+            }, f)
+        os.replace(tmp_path, os.path.join(self.store_dir, "meta.json"))
+        self.n_rows = n_rows
+
+        return None
+
+    def rows_of(self, key, code):
+        """番号の行。続いていればslice、そうでなければ行の番号の配列"""
+        offsets, rows = self.indexes[key]
+        if code < 0 or code + 1 >= len(offsets):
+            return slice(0, 0)
+        rows = rows[offsets[code]:offsets[code + 1]]
+        if len(rows) > 0 and rows[-1] - rows[0] == len(rows) - 1:
+            return slice(int(rows[0]), int(rows[-1]) + 1)
+
+        return np.asarray(rows)
+
+    def select(self, key, value):
+        """IDの行を列ごとに返す
+
+        Args:
+            key (str): game, batter, pitcher
+            value (str): game_idか選手ID
+
+        Returns:
+            dict: 列名から配列への辞書。行が続いていればmemmapのビュー
+        """
+        code = self.dictionaries[DICTIONARIES[key]].codes.get(value, -1)
+        rows = self.rows_of(key, code)
+
+        return {name: column[rows] for name, column in self.columns.items()}
+
+    def game(self, game_id):
+        """1試合の行。indexの順"""
+        return self.select("game", game_id)
+
+    def player(self, player_id, role="batter"):
+        """打者（role=batter）か投手（role=pitcher）としての1選手の行。追記した順"""
+        return self.select(role, player_id)
+
+    def game_ids(self):
+        """保存済みの試合のID。辞書ではなく、書き込みの確定した行がある試合"""
+        offsets, _ = self.indexes["game"]
+        codes = np.flatnonzero(np.diff(offsets)) if len(offsets) > 1 else []
+
+        return {self.dictionaries["game"].values[code] for code in codes}
+
+    def new_game_ids(self, df_game):
+        """まだ追記していない終了した試合のID"""
+        finished = df_game.loc[df_game["game_status"] == "finish", "game_id"].astype(str)
+
+        return sorted(set(finished) - self.game_ids())
+
+    def to_frame(self, arrays=None):
+        """列をlake_scoreと同じ列名のDataFrameに戻す
+
+        Args:
+            arrays (dict): selectの結果。Noneなら全行
+
+        Returns:
+            DataFrame: game_id, index, inning, top_buttom, result_main, result_sub, batter_id, batter_side,
+                pitcher_id, pitcher_side, base_1, base_2, base_3。走者は居れば1.0、居なければnan
+        """
+        arrays = arrays if arrays is not None else self.columns
+        index = np.asarray(arrays["index"])
+        df = pd.DataFrame({
+            "game_id": self.dictionaries["game"].decode(arrays["game"]),
+            "index": pd.Series(index.astype(str), dtype=object).str.zfill(7).to_numpy(),
+            "inning": index // 100000,
+            "top_buttom": np.where(index // 10000 % 10 == 1, "top", "bottom"),
+        })
+        for name in ["result_main", "result_sub", "batter", "batter_side", "pitcher", "pitcher_side"]:
+            column = name + "_id" if name in ["batter", "pitcher"] else name
+            df[column] = self.dictionaries[DICTIONARIES[name]].decode(arrays[name])
+        bases = np.asarray(arrays["bases"])
+        for i in range(1, 4):
+            df[f"base_{i}"] = np.where(bases >> (i - 1) & 1, 1.0, np.nan)
+
+        return df
@@ -0,0 +1,241 @@
+import datetime
+
+import lxml.html
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+
+def has_class(name):
+    """CSSの.name相当のXPath条件"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# 試合トップページのXPath。モジュール読み込み時に一度だけコンパイルする
+XPATH_TITLE = etree.XPath("(//title)[1]")
+XPATH_STATE = etree.XPath(f"(//span[{has_class('bb-gameCard__state')}])[1]")
+XPATH_DESCRIPTION = etree.XPath("(//p[@class='bb-gameDescription'])[1]")
+XPATH_TEAMS = etree.XPath(f"//a[{has_class('bb-gameScoreTable__team')}]")
+XPATH_SCORES = etree.XPath("//td[@class='bb-gameScoreTable__total']")
+XPATH_HITS = etree.XPath("//td[@class='bb-gameScoreTable__total bb-gameScoreTable__data--hits']")
+XPATH_ERRORS = etree.XPath("//td[@class='bb-gameScoreTable__total bb-gameScoreTable__data--loss']")
+XPATH_PITCHER_RECORD = etree.XPath("(//section[@id='pit_rec'])[1]")
+XPATH_PITCHER_RECORD_DATA = etree.XPath(f".//td[{has_class('bb-gameTable__data')}]")
+XPATH_PITCHER_RECORD_LINK = etree.XPath("(.//a[@class='bb-gameTable__player'])[1]")
+XPATH_STARTING_MEMBER = etree.XPath("(//section[@id='strt_mem'])[1]")
+XPATH_SPLITS_TABLES = etree.XPath(f".//table[{has_class('bb-splitsTable')}]")
+XPATH_FIRST_LINK = etree.XPath("(.//a)[1]")
+XPATH_MOD_COMMON = etree.XPath("//section[@class='bb-modCommon01']")
+XPATH_TABLE_LEFT_DATA = etree.XPath(f".//td[{has_class('bb-tableLeft__data')}]")
+
+# 選手一覧ページの成績表のXPath
+XPATH_FIRST_TABLE = etree.XPath("(//table)[1]")
+XPATH_TABLE_HEADERS = etree.XPath("(.//tr)[1]/th")
+XPATH_PLAYER_ROWS = etree.XPath(f".//tr[{has_class('bb-playerTable__row')}]")
+XPATH_ROW_CELLS = etree.XPath("./td")
+XPATH_PLAYER_LINK = etree.XPath("(.//a[contains(@href, '/player/')])[1]")
+
+GAME_STATUS = {
+    "試合終了": "finish",
+    "試合中止": "cancel",
+    "試合前": "before",
+}
+
+
+def first(xpath, node):
+    nodes = xpath(node)
+    return nodes[0] if len(nodes) > 0 else None
+
+
+def get_text(node, strip=False):
+    """BeautifulSoupのget_textと同じ文字列を返す"""
+    if strip:
+        return "".join(s.strip() for s in node.itertext())
+    return node.text_content()
+
+
+class GamePageExtractor():
+    """試合トップページをlxmlで一度だけパースし、コンパイル済みのXPathで全項目を取り出す
+
+    Args:
+        team_dict (DictConfig): チーム名からチーム情報への辞書
+        make_id (callable): スポナビ上の番号からIDを作る関数
+        get_game_series (callable): 日付から試合の種類を判定する関数
+    """
+    def __init__(self, team_dict, make_id, get_game_series):
+        self.team_dict = team_dict
+        self.make_id = make_id
+        self.get_game_series = get_game_series
+
+    def parse(self, html):
+        return lxml.html.fromstring(html)
+
+    def extract_status(self, root):
+        """試合の状態を判定する
+
+        Args:
+            root (HtmlElement): パース済みのhtml
+
+        Returns:
+            str: finish, cancel, before, unkownのいずれか
+        """
+        state_original = get_text(first(XPATH_STATE, root), strip=True)
+
+        return GAME_STATUS.get(state_original, "unkown")
+
+    def extract(self, html, url):
+        """試合の属性や結果を集める。ScrapingSponavi.get_game_infoと同じ辞書を返す
+
+        Args:
+            html (str): 試合トップページのhtml
+            url (str): 試合のURL
+
+        Returns:
+            dict: 試合の情報
+        """
+        root = self.parse(html)
+
+        result = {}
+
+        # ゲームID
+        result["game_id"] = "npb" + url.split("/")[-2]
+
+        # 日付
+        game_date = get_text(first(XPATH_TITLE, root)).split(" ")[0]
+        result["game_date"] = datetime.datetime.strptime(game_date, "%Y年%m月%d日").strftime("%Y-%m-%d")
+
+        # ステータス。終了していない試合はここまで
+        result["game_status"] = self.extract_status(root)
+        if result["game_status"] != "finish":
+            return result
+
+        # ゲームのタイプを判定（オープン戦、ペナント、CS、日シリ）
+        result["game_series"] = self.get_game_series(result["game_date"])
+
+        # 試合開始時間
+        description = get_text(first(XPATH_DESCRIPTION, root)).split("\n")
+        result["game_start_time"] = description[2].replace(" ", "")
+
+        # チーム名
+        teams = [get_text(x, strip=True) for x in XPATH_TEAMS(root)]
+        result["team_top_name"] = teams[0]
+        result["team_bottom_name"] = teams[1]
+        result["team_top_id"] = self.team_dict[teams[0]].team_id
+        result["team_bottom_id"] = self.team_dict[teams[1]].team_id
+
+        # 合計点
+        scores = [get_text(x, strip=True) for x in XPATH_SCORES(root)]
+        result["score_top"] = scores[0]
+        result["score_bottom"] = scores[1]
+
+        # 勝敗
+        if result["score_top"] > result["score_bottom"]:
+            result["game_result"] = "top_win"
+        elif result["score_top"] < result["score_bottom"]:
+            result["game_result"] = "bottom_win"
+        elif result["score_top"] == result["score_bottom"]:
+            result["game_result"] = "drow"
+
+        # 安打数
+        hits = [get_text(x, strip=True) for x in XPATH_HITS(root)]
+        result["hit_top"] = hits[0]
+        result["hit_bottom"] = hits[1]
+
+        # 失策数
+        errors = [get_text(x, strip=True) for x in XPATH_ERRORS(root)]
+        result["error_top"] = errors[0]
+        result["error_bottom"] = errors[1]
+
+        # 責任投手
+        list_pitcher_ids = []
+        try:
+            for pitcher in XPATH_PITCHER_RECORD_DATA(first(XPATH_PITCHER_RECORD, root)):
+                if get_text(pitcher, strip=True) != "":
+                    pitcher_url = first(XPATH_PITCHER_RECORD_LINK, pitcher)
+                    list_pitcher_ids.append(self.make_id(pitcher_url.get("href").split("/")[-2]))
+                else:
+                    list_pitcher_ids.append(np.nan)
+        except (AttributeError, TypeError):
+            list_pitcher_ids = [] # 引き分け
+        for key, pitcher_id in zip(["picher_win_id", "picher_lose_id", "picher_save_id"], list_pitcher_ids):
+            result[key] = pitcher_id
+
+        # 先発ピッチャー
+        tables = XPATH_SPLITS_TABLES(first(XPATH_STARTING_MEMBER, root))
+        result["starting_picher_top_id"] = self.make_id(first(XPATH_FIRST_LINK, tables[0]).get("href").split("/")[-2])
+        result["starting_picher_bottom_id"] = self.make_id(first(XPATH_FIRST_LINK, tables[2]).get("href").split("/")[-2])
+
+        sections = XPATH_MOD_COMMON(root)
+
+        # 審判
+        data = [get_text(x, strip=True) for x in XPATH_TABLE_LEFT_DATA(sections[-2])]
+        result["umpire_plate"] = data[0]
+        result["umpire_first"] = data[1]
+        result["umpire_second"] = data[2]
+        result["umpire_third"] = data[3]
+
+        # 観客数/試合時間
+        data = [get_text(x, strip=True) for x in XPATH_TABLE_LEFT_DATA(sections[-1])]
+        result["audience_num"] = data[0]
+        result["game_time"] = data[1]
+
+        return result
+
+
+class StatsTableExtractor():
+    """チームの選手一覧ページの成績表をlxmlで一度だけパースし、列ごとに数値に変換する
+
+    表の見出しを列定義のlabelと突き合わせて列を取り出す。見出しのない列はnullになる。
+
+    Args:
+        columns (ListConfig): 列定義（name, label, type）のリスト
+        make_id (callable): スポナビ上の番号からIDを作る関数
+    """
+    def __init__(self, columns, make_id):
+        self.columns = columns
+        self.make_id = make_id
+        self.unknown_headers = set()
+
+    def extract(self, html, team_id):
+        """成績表を取り出す
+
+        Args:
+            html (str): 選手一覧ページのhtml
+            team_id (str): チームID
+
+        Returns:
+            DataFrame: 選手ごとの成績。列定義のうちlabelのある列とplayer_id, team_id
+        """
+        root = lxml.html.fromstring(html)
+        table = first(XPATH_FIRST_TABLE, root)
+        if table is None:
+            return pd.DataFrame(columns=["player_id", "team_id"] + [c.name for c in self.columns if c.get("label") is not None])
+
+        headers = {get_text(th, strip=True): i for i, th in enumerate(XPATH_TABLE_HEADERS(table))}
+        labels = {c.get("label") for c in self.columns}
+        self.unknown_headers.update(h for h in headers if h not in labels)
+
+        rows = XPATH_PLAYER_ROWS(table)
+        cells = [[get_text(td, strip=True) for td in XPATH_ROW_CELLS(row)] for row in rows]
+        links = [first(XPATH_PLAYER_LINK, row) for row in rows]
+
+        # 列ごとにまとめる
+        data = {
+            "player_id": [self.make_id(a.get("href").split("/")[-2]) if a is not None else None for a in links],
+            "team_id": [team_id] * len(rows),
+        }
+        for c in self.columns:
+            if c.get("label") is None:
+                continue
+            i = headers.get(c.label)
+            data[c.name] = [r[i] if i is not None and i < len(r) else None for r in cells]
+        df = pd.DataFrame(data)
+
+        # 成績の列をまとめて数値にする。"-"は記録なし
+        numeric = [c.name for c in self.columns if c.get("label") is not None and c.get("type") in ["INTEGER", "FLOAT"]]
+        df[numeric] = df[numeric].replace("-", np.nan).apply(pd.to_numeric, errors="coerce")
+        for c in self.columns:
+            if c.get("label") is not None and c.get("type") == "INTEGER":
+                df[c.name] = df[c.name].where(df[c.name] % 1 == 0).astype("Int64")
+
+        return df[df["player_id"].notna()].reset_index(drop=True)
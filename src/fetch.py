@@ -0,0 +1,361 @@
+import email.utils
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import Metrics, page_type
+
+# 待ってから取り直すステータスコード
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class FetchError(Exception):
+    """ページを取得できず、処理を続けられない"""
+    def __init__(self, url):
+        super().__init__(f"failed to fetch {url}")
+        self.url = url
+
+
+def parse_retry_after(value):
+    """Retry-Afterヘッダーを秒数にする。秒数とHTTP日付のどちらの形式もある
+
+    Returns:
+        float: 待つ秒数。ヘッダーがないか読めなければNone
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class CircuitBreaker():
+    """ホスト単位で連続して失敗したらしばらく取得をやめる
+
+    failure_threshold回続けて失敗すると開き、reset_seconds秒たつまでリクエストを送らない。
+    たったら1件だけ試し、成功すれば閉じて、失敗すればまたreset_seconds秒開く。
+
+    Args:
+        failure_threshold (int): 開くまでの連続失敗回数。0以下なら開かない
+        reset_seconds (float): 開いてから試し直すまでの秒数
+        clock (callable): 現在の秒数を返す関数
+    """
+    def __init__(self, failure_threshold=5, reset_seconds=60, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """リクエストを送って良いか"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # 試している間はほかのリクエストを止める
+            if self.trial or self.clock() - self.opened_at < self.reset_seconds:
+                return False
+            self.trial = True
+            return True
+
+    def is_closed(self):
+        """遮断していないか。試しのリクエストの枠は使わない"""
+        with self.lock:
+            return self.opened_at is None
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failure_threshold > 0 and self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print("circuit open")
+                self.opened_at = self.clock()
+
+
+class TokenBucket():
+    """ホスト単位のアクセス間隔を制御するトークンバケット
+
+    Args:
+        rate (float): 1秒あたりに補充されるトークン数。0以下なら制限なし
+        burst (int): バケットの容量（連続で許可するリクエスト数）
+        clock (callable): 現在の秒数を返す関数
+        sleep (callable): 秒数だけ待つ関数
+    """
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンが取れるまで待つ
+
+        Returns:
+            float: 待機した秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+
+class FetchEngine():
+    """セッションを共有し、並列数とホスト毎のアクセス頻度を制限してhtmlを取得する
+
+    Args:
+        concurrency (int): 同時に実行するリクエスト数の上限
+        rate_per_host (float): ホスト毎の1秒あたりのリクエスト数
+        burst (int): ホスト毎に連続で許可するリクエスト数
+        cache (HtmlCache): htmlキャッシュ。Noneならキャッシュしない
+        metrics (Metrics): ページの種類ごとのリクエスト数や時間の記録先
+        connect_timeout (float): 接続のタイムアウト（秒）
+        read_timeout (float): 応答を待つタイムアウト（秒）
+        max_retries (int): タイムアウトや5xx/429のときに取り直す回数
+        backoff_base (float): 取り直すまでの待ち時間の基準（秒）。n回目はbackoff_base x 2^nまでのランダムな秒数
+        backoff_max (float): 取り直すまでの待ち時間の上限（秒）。Retry-Afterにも適用する
+        breaker_threshold (int): ホストの遮断までの連続失敗回数
+        breaker_reset_seconds (float): 遮断してから試し直すまでの秒数
+        on_failure (callable): 取り直しても取得できなかったときに(url, 理由)で呼ぶ関数
+        clock (callable): アクセス間隔の計算に使う、現在の秒数を返す関数
+        sleep (callable): アクセス間隔と取り直しを待つ関数
+    """
+    def __init__(self, concurrency=1, rate_per_host=1.0, burst=1, cache=None, metrics=None,
+                 connect_timeout=5, read_timeout=30, max_retries=3, backoff_base=1.0, backoff_max=60,
+                 breaker_threshold=5, breaker_reset_seconds=60, on_failure=None, clock=time.monotonic, sleep=time.sleep):
+        self.concurrency = max(concurrency, 1)
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self.on_failure = on_failure
+        self.clock = clock
+        self.sleep = sleep
+
+        # keep-aliveでコネクションを使いまわす
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.buckets = {}
+        self.breakers = {}
+        self.buckets_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, cache=None, metrics=None, on_failure=None):
+        """設定からエンジンを作る。設定がなければ従来通り1秒に1回の直列取得
+
+        Args:
+            config (DictConfig): fetchの設定
+            cache (HtmlCache): htmlキャッシュ
+            metrics (Metrics): 記録先
+            on_failure (callable): 取得できなかったURLを受け取る関数
+
+        Returns:
+            FetchEngine: エンジン
+        """
+        if config is None:
+            return cls(cache=cache, metrics=metrics, on_failure=on_failure)
+
+        return cls(
+            concurrency=config.get("concurrency", 1),
+            rate_per_host=config.get("rate_per_host", 1.0),
+            burst=config.get("burst", 1),
+            cache=cache,
+            metrics=metrics,
+            connect_timeout=config.get("connect_timeout", 5),
+            read_timeout=config.get("read_timeout", 30),
+            max_retries=config.get("max_retries", 3),
+            backoff_base=config.get("backoff_base", 1.0),
+            backoff_max=config.get("backoff_max", 60),
+            breaker_threshold=config.get("breaker_threshold", 5),
+            breaker_reset_seconds=config.get("breaker_reset_seconds", 60),
+            on_failure=on_failure,
+            )
+
+    def get_bucket(self, url):
+        host = urlparse(url).netloc
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate_per_host, self.burst, clock=self.clock, sleep=self.sleep)
+            return self.buckets[host]
+
+    def get_breaker(self, url):
+        host = urlparse(url).netloc
+        with self.buckets_lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_reset_seconds, clock=self.clock)
+            return self.breakers[host]
+
+    def get_backoff(self, attempt, retry_after=None):
+        """取り直すまでの秒数。Retry-Afterがあればそれに従い、なければ指数的に延ばした範囲でランダムに選ぶ"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_base * 2 ** attempt, self.backoff_max))
+
+    def fail(self, url, reason):
+        print("faild", reason)
+        if self.on_failure is not None:
+            self.on_failure(url, reason)
+
+        return None
+
+    def fetch(self, url, use_cache=True, speculative=False):
+        """1ページ取得する
+
+        Args:
+            url (str): URL
+            use_cache (bool): キャッシュを使うか。Falseなら必ずサイトから取得する
+            speculative (bool): 外れるかもしれない先読みか。遮断中のホストには送らず、取得できなくても
+                取り直さず、on_failureに渡さず、遮断までの失敗にも数えない
+
+        Returns:
+            str: html。取得に失敗した場合はNone
+        """
+        page = page_type(url)
+        entry = None
+        headers = {}
+        if self.cache is not None and use_cache:
+            entry = self.cache.get(url)
+            if entry is not None:
+                if self.cache.is_fresh(entry):
+                    self.metrics.inc("cache_requests", page=page, result="hit")
+                    return entry["html"]
+                headers = self.cache.conditional_headers(entry)
+
+        breaker = self.get_breaker(url)
+        attempt = 0
+        while True:
+            # 先読みは遮断が閉じているときだけ送り、試しのリクエストの枠を使わない
+            if speculative and not breaker.is_closed():
+                self.metrics.inc("requests", page=page, status="circuit_open")
+                return None
+            # 遮断中のホストには送らない
+            if not speculative and not breaker.allow():
+                self.metrics.inc("requests", page=page, status="circuit_open")
+                return self.fail(url, "circuit_open")
+
+            self.metrics.observe("rate_limit_wait_seconds", self.get_bucket(url).acquire(), page=page)
+            print("get html ", url)
+            start = time.perf_counter()
+            retry_after = None
+            try:
+                res = self.session.get(url, headers=headers, timeout=self.timeout)
+                self.metrics.observe("fetch_seconds", time.perf_counter() - start, page=page)
+                self.metrics.inc("requests", page=page, status=res.status_code)
+                self.metrics.inc("bytes_downloaded", len(res.content), page=page)
+                if res.status_code == 304 and entry is not None:
+                    # 更新がないのでキャッシュを延長して使う
+                    print("not modified")
+                    breaker.record_success()
+                    self.metrics.inc("cache_requests", page=page, result="revalidated")
+                    self.cache.revalidated(entry)
+                    return entry["html"]
+                if res.status_code not in RETRY_STATUSES:
+                    # 404などはサイトは応答しているので取り直さない
+                    breaker.record_success()
+                    res.raise_for_status()
+                    print("success")
+                    break
+                reason = str(res.status_code)
+                retry_after = parse_retry_after(res.headers.get("Retry-After"))
+            except requests.exceptions.HTTPError:
+                print("faild", res.status_code)
+                return None
+            except requests.exceptions.RequestException as e:
+                self.metrics.inc("requests", page=page, status="error")
+                reason = type(e).__name__
+
+            if speculative:
+                print("prefetch faild", reason)
+                return None
+            breaker.record_failure()
+            if attempt >= self.max_retries:
+                return self.fail(url, reason)
+            wait = self.get_backoff(attempt, retry_after)
+            print("retry", reason, f"after {wait:.1f}s")
+            self.metrics.inc("retries", page=page, reason=reason)
+            self.metrics.observe("retry_wait_seconds", wait, page=page)
+            self.sleep(wait)
+            attempt += 1
+
+        if self.cache is not None and use_cache:
+            self.metrics.inc("cache_requests", page=page, result="miss")
+        if self.cache is not None:
+            self.cache.put(url, res.text, etag=res.headers.get("ETag"), last_modified=res.headers.get("Last-Modified"))
+
+        return res.text
+
+    def submit(self, url, use_cache=True, speculative=False):
+        """取得をバックグラウンドで開始する
+
+        Args:
+            url (str): URL
+            use_cache (bool): キャッシュを使うか
+            speculative (bool): 外れるかもしれない先読みか。fetchと同じ
+
+        Returns:
+            Future: 結果のhtmlを返すFuture
+        """
+        return self.executor.submit(self.fetch, url, use_cache, speculative)
+
+    def fetch_many(self, urls, use_cache=True):
+        """複数ページを並列に取得し、取得できた順に返す
+
+        Args:
+            urls (list): URLのリスト
+            use_cache (bool): キャッシュを使うか
+
+        Yields:
+            tuple: (url, html)
+        """
+        futures = {self.submit(url, use_cache): url for url in urls}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
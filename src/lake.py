@@ -0,0 +1,203 @@
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# config_table.yamlの型とArrowの型の対応。ここにない型は文字列
+ARROW_TYPES = {
+    "STRING": pa.string(),
+    "INTEGER": pa.int64(),
+    "FLOAT": pa.float64(),
+    "DATE": pa.date32(),
+    "DATETIME": pa.timestamp("s"),
+}
+
+# パーティション。season=YYYY/game_date=YYYY-MM-DD のディレクトリに分ける
+PARTITION_SCHEMA = pa.schema([
+    ("season", pa.int32()),
+    ("game_date", pa.date32()),
+])
+
+
+def is_dictionary_column(name):
+    """チームや選手のIDは種類が少ないので辞書エンコードする"""
+    return name.endswith("_id") and name != "game_id"
+
+
+def make_schema(columns):
+    """列定義からArrowのスキーマを作る
+
+    Args:
+        columns (ListConfig): 列定義（name, type）のリスト
+
+    Returns:
+        pyarrow.Schema: スキーマ
+    """
+    fields = []
+    for c in columns:
+        arrow_type = ARROW_TYPES.get(c.get("type", "STRING"), pa.string())
+        if is_dictionary_column(c.name) and arrow_type == pa.string():
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        fields.append(pa.field(c.name, arrow_type))
+
+    return pa.schema(fields)
+
+
+def to_arrow(df, columns):
+    """DataFrameを列定義の型に変換してArrowのテーブルにする
+
+    Args:
+        df (DataFrame): lakeのテーブル
+        columns (ListConfig): 列定義（name, type）のリスト
+
+    Returns:
+        pyarrow.Table: 型付きのテーブル
+    """
+    schema = make_schema(columns)
+    arrays = []
+    for c, field in zip(columns, schema):
+        col_type = c.get("type", "STRING")
+        values = df[c.name] if c.name in df.columns else pd.Series([None] * len(df), dtype=object)
+        if col_type in ["INTEGER", "FLOAT"]:
+            values = pd.to_numeric(values, errors="coerce")
+        elif col_type == "DATE":
+            values = pd.to_datetime(values, errors="coerce").dt.date
+        elif col_type == "DATETIME":
+            values = pd.to_datetime(values, errors="coerce")
+
+        if col_type in ["INTEGER", "FLOAT", "DATE", "DATETIME"]:
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+            continue
+
+        # 文字列以外が混ざっていたら文字列にする
+        try:
+            array = pa.array(values, type=pa.string(), from_pandas=True)
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            array = pa.array(values.map(lambda x: str(x) if pd.notna(x) else None), type=pa.string(), from_pandas=True)
+        arrays.append(array.dictionary_encode() if pa.types.is_dictionary(field.type) else array)
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class LakeWriter():
+    """lakeのテーブルをseason/game_dateで分割したParquetに書き出す
+
+    書き出すたびにパーティションのディレクトリに新しいファイルを追加する。
+
+    Args:
+        lake_dir (str): 出力先のディレクトリ
+        table (DictConfig): config_table.yamlのtable
+    """
+    def __init__(self, lake_dir, table):
+        self.lake_dir = lake_dir
+        self.table = table
+
+    def write(self, df, table_name, game_date=None):
+        """テーブルを書き出す
+
+        Args:
+            df (DataFrame): 書き出すデータ
+            table_name (str): lake_game, lake_score, lake_playerなど
+            game_date (str): パーティションの日付。Noneならdfのgame_date列を使う
+        """
+        if len(df) == 0:
+            return None
+
+        table = to_arrow(df, self.table[table_name].column)
+
+        # パーティションの列を付ける
+        if game_date is not None:
+            dates = pd.Series([pd.Timestamp(game_date).date()] * len(df))
+        else:
+            dates = pd.to_datetime(df["game_date"].reset_index(drop=True)).dt.date
+        table = table.drop_columns([name for name in PARTITION_SCHEMA.names if name in table.column_names])
+        table = table.append_column("season", pa.array([d.year for d in dates], type=pa.int32()))
+        table = table.append_column("game_date", pa.array(dates, type=pa.date32()))
+
+        pq.write_to_dataset(
+            table,
+            root_path=os.path.join(self.lake_dir, table_name),
+            partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"),
+            basename_template=uuid.uuid4().hex + "-{i}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            )
+
+        return None
+
+
+class LakeReader():
+    """season/game_dateで分割したParquetのlakeを読む
+
+    Args:
+        lake_dir (str): lakeのディレクトリ
+        table (DictConfig): config_table.yamlのtable。渡すと列を追加する前に書いたファイルも
+            列定義のスキーマで読み、ない列はnullになる
+    """
+    def __init__(self, lake_dir, table=None):
+        self.lake_dir = lake_dir
+        self.table = table
+
+    def dataset(self, table_name):
+        schema = None
+        if self.table is not None and table_name in self.table:
+            schema = make_schema(self.table[table_name].column)
+            schema = pa.schema([f for f in schema if f.name not in PARTITION_SCHEMA.names] + list(PARTITION_SCHEMA))
+
+        return ds.dataset(
+            os.path.join(self.lake_dir, table_name),
+            format="parquet",
+            schema=schema,
+            partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"),
+            )
+
+    def exists(self, table_name):
+        return os.path.isdir(os.path.join(self.lake_dir, table_name))
+
+    def make_filter(self, season=None, start_date=None, end_date=None, filter=None):
+        expr = filter
+        conditions = []
+        if season is not None:
+            conditions.append(ds.field("season") == season)
+        if start_date is not None:
+            conditions.append(ds.field("game_date") >= pa.scalar(pd.Timestamp(start_date).date()))
+        if end_date is not None:
+            conditions.append(ds.field("game_date") <= pa.scalar(pd.Timestamp(end_date).date()))
+        for condition in conditions:
+            expr = condition if expr is None else expr & condition
+
+        return expr
+
+    def read_arrow(self, table_name, columns=None, season=None, start_date=None, end_date=None, filter=None):
+        """テーブルをArrowで読む。パーティションの条件に合わないファイルは読まない
+
+        Args:
+            table_name (str): lake_game, lake_score, lake_playerなど
+            columns (list): 読む列。Noneなら全列
+            season (int): シーズン
+            start_date (str): 開始日
+            end_date (str): 終了日
+            filter (pyarrow.dataset.Expression): 追加の条件
+
+        Returns:
+            pyarrow.Table: テーブル
+        """
+        if not self.exists(table_name):
+            return None
+
+        return self.dataset(table_name).to_table(
+            columns=columns,
+            filter=self.make_filter(season, start_date, end_date, filter),
+            )
+
+    def read(self, table_name, columns=None, season=None, start_date=None, end_date=None, filter=None):
+        """テーブルをDataFrameで読む。引数はread_arrowと同じ
+
+        Returns:
+            DataFrame: テーブル。lakeがなければNone
+        """
+        table = self.read_arrow(table_name, columns, season, start_date, end_date, filter)
+
+        return table.to_pandas() if table is not None else None
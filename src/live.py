@@ -0,0 +1,182 @@
+import functools
+import re
+import time
+
+import bs4
+
+# 試合が終わった状態
+FINAL_STATUS = ["finish", "cancel"]
+
+
+class LiveGame():
+    """ポーリング中の1試合の状態
+
+    Args:
+        date (str): 試合日
+        game_id_num (str): スポナビ上の試合番号
+        interval (float): 次に確認するまでの秒数
+    """
+    def __init__(self, date, game_id_num, interval):
+        self.date = date
+        self.game_id_num = game_id_num
+        self.interval = interval
+        self.next_poll = 0.0
+        self.status = None
+        self.done = False
+
+
+class LivePoller():
+    """当日の試合を定期的に確認し、試合中の試合は新しく増えた速報ページだけを取得して出力する
+
+    速報ページは前回取得した最後のページを取り直し、btn_nextが増えていればそこからたどる
+    （ScrapingSponavi.get_score_infoのafter_index）。新しい投球があれば確認の間隔を
+    min_intervalに戻し、なければbackoff倍ずつmax_intervalまで延ばすので、
+    イニング間や試合前は間隔が開く。試合が終わったら試合の結果を出力して確認をやめる。
+
+    Args:
+        scraper (ScrapingSponavi): 取得と出力に使うスクレイパー
+        min_interval (float): 確認の間隔の最小値（秒）
+        max_interval (float): 確認の間隔の最大値（秒）
+        backoff (float): 新しい投球がなかったときに間隔を延ばす倍率
+        clock (callable): 現在時刻（秒）を返す関数
+        sleep (callable): 指定秒数待つ関数
+    """
+    def __init__(self, scraper, min_interval=5, max_interval=120, backoff=2.0, clock=time.monotonic, sleep=time.sleep):
+        self.scraper = scraper
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.games = {}
+
+    @classmethod
+    def from_config(cls, scraper, config):
+        config = config if config is not None else {}
+
+        return cls(
+            scraper,
+            min_interval=config.get("min_interval", 5),
+            max_interval=config.get("max_interval", 120),
+            backoff=config.get("backoff", 2.0),
+            )
+
+    def poll_schedule(self, date):
+        """日付のゲーム一覧を取り直し、まだ出力まで終わっていない試合を追加する"""
+        html = self.scraper.get_html(self.scraper.base_url + "/schedule/?date=" + str(date), use_cache=False)
+        if html is None:
+            return None
+        soup = bs4.BeautifulSoup(html, "html.parser")
+        for game in soup.select('a.bb-score__content'):
+            game_id_num = re.search(r"\d+", game.get('href')).group()
+            if game_id_num not in self.games and not self.scraper.state.is_completed(self.scraper.make_id(game_id_num)):
+                self.games[game_id_num] = LiveGame(date, game_id_num, self.min_interval)
+
+        return None
+
+    def poll_game(self, game):
+        """試合を1回確認する
+
+        Args:
+            game (LiveGame): 試合
+
+        Returns:
+            int: 新しく出力した投球の数
+        """
+        game_id = self.scraper.make_id(game.game_id_num)
+        game_url = self.scraper.base_url + "/game/" + game.game_id_num + "/top"
+        html = self.scraper.get_html(game_url, use_cache=False)
+        if html is None:
+            return 0
+        game.status = self.scraper.check_game_status(html)
+
+        n_events = 0
+        if game.status not in ["before", "cancel"]:
+            progress = self.scraper.state.get_game(game_id)
+            if progress is None or progress["score_completed"] != 1:
+                df_score = self.scraper.get_score_info(
+                    game_id,
+                    after_index=progress["last_index"] if progress is not None else None,
+                    checkpoint=functools.partial(self.scraper.save_score_checkpoint, game_date=game.date),
+                    live=game.status != "finish",
+                    )
+                n_events = len(df_score)
+
+        # 終わった試合は結果を出力して確認をやめる
+        if game.status in FINAL_STATUS:
+            self.scraper.write_games(
+                [(game.date, game.game_id_num, html, self.scraper.get_game_info(html, game_url))],
+                output_dir=self.scraper.output_game_html_path,
+                )
+            game.done = True
+
+        return n_events
+
+    def next_interval(self, game, n_events):
+        if game.status == "before":
+            return self.max_interval
+        if n_events > 0:
+            return self.min_interval
+
+        return min(game.interval * self.backoff, self.max_interval)
+
+    def run(self, date, max_seconds=None):
+        """すべての試合が終わるまで確認を続ける
+
+        Args:
+            date (str): 試合日（YYYY-MM-DD）
+            max_seconds (float): この秒数たったら途中でも終わる。Noneなら試合が終わるまで
+
+        Returns:
+            int: 出力した投球の数
+        """
+        n_total = 0
+        print("live ", date, "="*10)
+        try:
+            n_total = self.poll_until_finish(date, max_seconds)
+        finally:
+            # 途中で止まっても出力済みの分はbigqueryに書き込む
+            if self.scraper.upload_flag:
+                self.scraper.loader.flush()
+
+        print("finish live", n_total, "events", "="*10)
+
+        return n_total
+
+    def poll_until_finish(self, date, max_seconds=None):
+        started = self.clock()
+        next_schedule = started
+        n_total = 0
+        while True:
+            now = self.clock()
+            if now >= next_schedule:
+                self.poll_schedule(date)
+                next_schedule = now + self.max_interval
+
+            active = [game for game in self.games.values() if not game.done]
+            if len(active) == 0:
+                break
+            if max_seconds is not None and now - started >= max_seconds:
+                break
+
+            for game in active:
+                if game.next_poll > now:
+                    continue
+                try:
+                    n_events = self.poll_game(game)
+                except Exception as e:
+                    print("error in live", game.game_id_num, repr(e))
+                    n_events = 0
+                n_total += n_events
+                game.interval = self.next_interval(game, n_events)
+                game.next_poll = self.clock() + game.interval
+                print("live", game.game_id_num, game.status, n_events, "new events", f"next {game.interval:.0f}s")
+
+            # 最後の試合が終わったら次のゲーム一覧の確認まで待たずに終わる
+            active = [game for game in self.games.values() if not game.done]
+            if len(active) == 0:
+                break
+            wake = min([game.next_poll for game in active] + [next_schedule])
+            self.sleep(max(wake - self.clock(), 0))
+
+        return n_total
@@ -0,0 +1,197 @@
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+
+# URLからページの種類を判定する。上から順に評価する
+PAGE_TYPES = [
+    ("score", re.compile(r"/score\?index=")),
+    ("schedule", re.compile(r"/schedule/")),
+    ("game", re.compile(r"/game/\d+/")),
+    ("player", re.compile(r"/player/\d+/")),
+    ("roster", re.compile(r"/memberlist")),
+]
+
+# 秒数のヒストグラムの区切り
+SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Prometheusのメトリクス名の接頭辞
+PREFIX = "sokuho_"
+
+
+def page_type(url):
+    """URLからページの種類（score, schedule, game, player, roster, other）を判定する"""
+    for name, pattern in PAGE_TYPES:
+        if pattern.search(url):
+            return name
+
+    return "other"
+
+
+def format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra is not None else [])
+    if len(items) == 0:
+        return ""
+
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Histogram():
+    """区切りごとの件数と合計を持つヒストグラム
+
+    Args:
+        buckets (list): 区切りの上限の昇順のリスト
+    """
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """区切りの上限でのおおよその分位点"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for upper, n in zip(self.buckets + [float("inf")], self.counts):
+            cumulative += n
+            if cumulative >= target:
+                return upper
+
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class Metrics():
+    """実行中のカウンタとヒストグラムを集め、JSONかPrometheusのテキスト形式で出力する
+
+    パイプラインの複数のスレッドから記録されるのでロックで守る。
+    ラベルはキーワード引数で渡し、同じ名前とラベルの組ごとに集計する。
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    @staticmethod
+    def make_key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """カウンタを増やす"""
+        key = self.make_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+        return None
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに値を記録する"""
+        key = self.make_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+        return None
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """withの中の経過秒数をヒストグラムに記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "elapsed_seconds": time.monotonic() - self.started,
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    dict({"name": name, "labels": dict(labels)}, **histogram.to_dict())
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        """Prometheusのテキスト形式"""
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                # カウンタは慣例どおり_totalで終わる名前にする
+                metric = PREFIX + (name if name.endswith("_total") else name + "_total")
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if PREFIX + name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} histogram")
+                    typed.add(PREFIX + name)
+                cumulative = 0
+                for upper, n in zip([str(b) for b in histogram.buckets] + ["+Inf"], histogram.counts):
+                    cumulative += n
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(labels, [('le', upper)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_dir, run_name):
+        """run_name.jsonとrun_name.promを書き出す
+
+        Args:
+            output_dir (str): 出力先のディレクトリ
+            run_name (str): ファイル名
+
+        Returns:
+            str: JSONのpath
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        json_path = os.path.join(output_dir, run_name + ".json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        with open(os.path.join(output_dir, run_name + ".prom"), "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+
+        return json_path
+
+    def report(self):
+        """ヒストグラムごとの件数、合計秒数、おおよそのp50/p95と、カウンタを表示する"""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        print("metrics", "="*10)
+        print(f"{'name':52s}{'count':>8s}{'sum':>10s}{'p50':>8s}{'p95':>8s}")
+        for (name, labels), histogram in histograms:
+            label = name + format_labels(labels)
+            print(f"{label:52s}{histogram.count:8d}{histogram.sum:10.2f}{histogram.quantile(0.5):8.3f}{histogram.quantile(0.95):8.3f}")
+        for (name, labels), value in counters:
+            label = name + format_labels(labels)
+            print(f"{label:52s}{value:8d}" if isinstance(value, int) else f"{label:52s}{value:8.2f}")
+
+        return None
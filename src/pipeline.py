@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+import traceback
+
+from .fetch import FetchError
+from .metrics import Metrics
+
+# ステージの終わりを次のステージに伝える印
+END = object()
+
+# sinkの書き込みの失敗を記録するときのステージ名
+SINK_NAME = "sink"
+
+
+class Stage():
+    """パイプラインの1段。入力を1件ずつfuncに渡し、返ってきた要素を次の段に流す
+
+    Args:
+        name (str): ステージ名
+        func (callable): 1件を受け取り、次の段に流す要素のiterableを返す関数
+        workers (int): 並列に動かすスレッド数
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(workers, 1)
+
+
+class BatchSink():
+    """パイプラインの出力を件数でまとめて書き込む
+
+    Args:
+        flush_func (callable): たまった要素のリストを受け取って書き込む関数
+        batch_size (int): この件数たまったら書き込む
+        on_error (callable): 書き込みに失敗したとき(要素のリスト, 例外)を受け取る関数。Noneなら例外を送出する
+    """
+    def __init__(self, flush_func, batch_size=100, on_error=None):
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.items = []
+        self.lock = threading.Lock()
+        # 書き込みは同時に1つだけ
+        self.flush_lock = threading.Lock()
+
+    def write(self, item):
+        with self.lock:
+            self.items.append(item)
+            if len(self.items) < self.batch_size:
+                return None
+            items, self.items = self.items, []
+        self.write_batch(items)
+
+        return None
+
+    def flush(self):
+        with self.lock:
+            items, self.items = self.items, []
+        if len(items) > 0:
+            self.write_batch(items)
+
+        return None
+
+    def write_batch(self, items):
+        """まとめて書き込む。失敗したらバッチの全要素をon_errorに渡す"""
+        with self.flush_lock:
+            try:
+                self.flush_func(items)
+            except Exception as e:
+                if self.on_error is None:
+                    raise
+                self.on_error(items, e)
+
+        return None
+
+
+class Pipeline():
+    """ステージを上限付きのキューでつなぎ、各ステージをそれぞれのスレッドで動かす
+
+    キューがいっぱいになると前の段が待つので、範囲が長くても保持する件数は
+    queue_size x ステージ数 で頭打ちになる。1件の処理で例外が起きても
+    その件だけ飛ばして続ける。sinkの書き込みに失敗したときはバッチの全要素を失敗として記録する。
+
+    Args:
+        stages (list): Stageのリスト。前から順に処理する
+        sink (BatchSink): 最後の段の出力の書き込み先
+        queue_size (int): ステージ間のキューの長さ
+        metrics (Metrics): ステージごとの処理時間の記録先
+    """
+    def __init__(self, stages, sink, queue_size=32, metrics=None):
+        self.stages = stages
+        self.sink = sink
+        self.queue_size = queue_size
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.errors = []
+        self.errors_lock = threading.Lock()
+        if self.sink.on_error is None:
+            self.sink.on_error = self.record_batch_error
+
+    def record_error(self, stage, item, error):
+        print("error in", stage.name, repr(item)[:200])
+        # 取得の失敗は取得側で記録済みなので理由だけ表示する
+        if isinstance(error, FetchError):
+            print(error)
+        else:
+            traceback.print_exception(type(error), error, error.__traceback__)
+        with self.errors_lock:
+            self.errors.append((stage.name, item, error))
+        self.metrics.inc("stage_errors", stage=stage.name)
+
+    def record_batch_error(self, items, error):
+        """sinkの書き込みに失敗したバッチの全要素を失敗として記録する"""
+        print("error in sink", len(items), "items")
+        traceback.print_exception(type(error), error, error.__traceback__)
+        with self.errors_lock:
+            self.errors.extend((SINK_NAME, item, error) for item in items)
+        self.metrics.inc("stage_errors", len(items), stage=SINK_NAME)
+
+    def run_stage(self, stage, q_in, put_out, finished):
+        while True:
+            item = q_in.get()
+            if item is END:
+                finished()
+                return
+            # 次の段のキューが空くのを待った時間は除く
+            start = time.perf_counter()
+            blocked = 0.0
+            try:
+                for output in stage.func(item):
+                    put_start = time.perf_counter()
+                    put_out(output)
+                    blocked += time.perf_counter() - put_start
+            except Exception as e:
+                self.record_error(stage, item, e)
+            self.metrics.observe("stage_seconds", time.perf_counter() - start - blocked, stage=stage.name)
+            self.metrics.observe("stage_blocked_seconds", blocked, stage=stage.name)
+
+    def run(self, source):
+        """sourceの要素をすべて処理し終わるまで待つ
+
+        Args:
+            source (iterable): 最初の段に流す要素
+
+        Returns:
+            list: (ステージ名, 要素, 例外)のリスト
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+
+        for i, stage in enumerate(self.stages):
+            q_in = queues[i]
+            if i + 1 < len(self.stages):
+                q_out = queues[i + 1]
+                put_out = q_out.put
+                n_next = self.stages[i + 1].workers
+            else:
+                q_out = None
+                put_out = self.sink.write
+                n_next = 0
+
+            # 全スレッドが終わったら次の段のスレッド数だけ終わりの印を流す
+            remaining = [stage.workers]
+            lock = threading.Lock()
+
+            def finished(remaining=remaining, lock=lock, q_out=q_out, n_next=n_next):
+                with lock:
+                    remaining[0] -= 1
+                    done = remaining[0] == 0
+                if done and q_out is not None:
+                    for _ in range(n_next):
+                        q_out.put(END)
+
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self.run_stage, args=(stage, q_in, put_out, finished), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        # 最初の段に流す
+        try:
+            for item in source:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(END)
+
+        for thread in threads:
+            thread.join()
+        self.sink.flush()
+
+        return self.errors
@@ -0,0 +1,177 @@
+import collections
+import datetime
+import hashlib
+import json
+import threading
+
+import pandas as pd
+
+# 版の管理に使う列。プロフィールの変化の判定には使わない
+SCD_COLUMNS = ["player_id", "team_id", "valid_from", "profile_hash", "exec_datetime"]
+# どの名簿にもいなくなった選手を閉じる版のprofile_hash。team_idは空にする
+CLOSED_HASH = "closed"
+
+
+def make_profile_hash(record, columns):
+    """選手のプロフィールのハッシュを作る。変化の判定に使う
+
+    Args:
+        record (dict): 選手の情報
+        columns (ListConfig): lake_playerの列定義
+
+    Returns:
+        str: ハッシュ
+    """
+    profile = [None if pd.isna(record.get(c.name)) else str(record.get(c.name)) for c in columns if c.name not in SCD_COLUMNS]
+
+    return hashlib.sha1(json.dumps(profile, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def to_scd(df_player):
+    """lake_playerの版にvalid_toとis_currentを付ける
+
+    Args:
+        df_player (DataFrame): lake_player
+
+    Returns:
+        DataFrame: 選手ID、valid_fromの順に並べ、次の版の開始日をvalid_toにしたもの。
+            閉じる版は名簿にいない期間なのでis_currentはFalse
+    """
+    df = df_player.sort_values(["player_id", "valid_from", "exec_datetime"], ignore_index=True)
+    df["valid_to"] = df.groupby("player_id")["valid_from"].shift(-1)
+    df["is_current"] = df["valid_to"].isna() & (df["profile_hash"] != CLOSED_HASH)
+
+    return df
+
+
+class PlayerDimension():
+    """選手のディメンション（SCD type 2）の最新の版を持ち、取得する選手を決める
+
+    名簿に新しく出てきた選手と所属チームが変わった選手は取得し、それ以外は
+    revalidate_days〜2倍の間で選手ごとにずらした周期で確認し直す。
+    取得した選手はプロフィールか所属が変わったときだけ新しい版として追加する。
+    すべての名簿を確認できたら、どの名簿にもいなかった選手を閉じる版を追加する。
+
+    Args:
+        snapshot (DataFrame): 選手ごとの最新の版。player_id, team_id, profile_hash
+        checked (dict): 選手IDから最後に確認した日時への辞書
+        revalidate_days (int): 変化のない選手を確認し直す周期の最短日数
+    """
+    def __init__(self, snapshot, checked=None, revalidate_days=30):
+        self.current = {
+            row.player_id: (row.team_id, row.profile_hash)
+            for row in snapshot.itertuples(index=False)
+        }
+        self.checked = checked if checked is not None else {}
+        self.revalidate_days = revalidate_days
+        self.planned = set()
+        # 選手を1人以上読めた名簿
+        self.rosters = set()
+        # 理由ごとの件数。new, moved, stale, skip, changed, closed
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_lake(cls, df_player, checked=None, revalidate_days=30):
+        """前回までのlake_playerから作る
+
+        Args:
+            df_player (DataFrame): lake_player。なければNone
+            checked (dict): 選手IDから最後に確認した日時への辞書
+            revalidate_days (int): 確認し直す周期の最短日数
+
+        Returns:
+            PlayerDimension: ディメンション
+        """
+        if df_player is None or len(df_player) == 0:
+            snapshot = pd.DataFrame(columns=["player_id", "team_id", "profile_hash"])
+        else:
+            df = df_player.copy()
+            for name in ["team_id", "valid_from", "profile_hash"]:
+                if name not in df.columns:
+                    df[name] = None
+            df["team_id"] = df["team_id"].astype(object)
+            snapshot = to_scd(df)
+            snapshot = snapshot[snapshot["is_current"]]
+
+        return cls(snapshot, checked=checked, revalidate_days=revalidate_days)
+
+    def add_roster(self, roster):
+        """選手を読めた名簿を記録する"""
+        with self.lock:
+            self.rosters.add(roster)
+
+        return None
+
+    def close_unseen(self, today):
+        """どの名簿にもいなかった選手の版を閉じる。すべての名簿を読めたときだけ呼ぶ
+
+        Args:
+            today (date): 実行日
+
+        Returns:
+            list: 閉じる版の辞書のリスト。team_idは空、profile_hashはCLOSED_HASH
+        """
+        records = []
+        for player_id in sorted(set(self.current) - self.planned):
+            records.append({
+                "player_id": player_id,
+                "team_id": None,
+                "valid_from": today.strftime("%Y-%m-%d"),
+                "profile_hash": CLOSED_HASH,
+            })
+        with self.lock:
+            self.counts["closed"] += len(records)
+
+        return records
+
+    def is_stale(self, player_id, today):
+        """確認し直す時期か。選手IDのハッシュで周期を1〜2倍にずらし、同じ日に集中しないようにする"""
+        checked_at = self.checked.get(player_id)
+        if checked_at is None:
+            return True
+        spread = int(hashlib.sha1(player_id.encode("utf-8")).hexdigest(), 16) % max(self.revalidate_days, 1)
+        elapsed = today - datetime.datetime.strptime(checked_at[:10], "%Y-%m-%d").date()
+
+        return elapsed.days >= self.revalidate_days + spread
+
+    def plan(self, player_id, team_id, today):
+        """選手ページを取得するかを決める。同じ選手は1回だけ
+
+        Args:
+            player_id (str): 選手ID
+            team_id (str): 名簿の所属チームのID
+            today (date): 実行日
+
+        Returns:
+            str: new, moved, staleのいずれか。取得しないならNone
+        """
+        with self.lock:
+            if player_id in self.planned:
+                return None
+            self.planned.add(player_id)
+
+        current = self.current.get(player_id)
+        if current is None:
+            reason = "new"
+        elif current[0] != team_id:
+            reason = "moved"
+        elif self.is_stale(player_id, today):
+            reason = "stale"
+        else:
+            reason = None
+
+        with self.lock:
+            self.counts[reason if reason is not None else "skip"] += 1
+
+        return reason
+
+    def is_changed(self, record):
+        """取得した選手が最新の版から変わったか"""
+        current = self.current.get(record["player_id"])
+        changed = current is None or current != (record["team_id"], record["profile_hash"])
+        if changed:
+            with self.lock:
+                self.counts["changed"] += 1
+
+        return changed
@@ -0,0 +1,207 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+# config_table.yamlの型とSQLiteの型の対応。ここにない型はTEXT
+SQLITE_TYPES = {
+    "INTEGER": "INTEGER",
+    "FLOAT": "REAL",
+}
+
+# 日付は比較できるように文字列にそろえる
+DATE_FORMATS = {
+    "DATE": "%Y-%m-%d",
+    "DATETIME": "%Y-%m-%d %H:%M:%S",
+}
+
+# テーブルごとのインデックス
+INDEXES = {
+    "lake_game": [["game_id"], ["game_date"], ["team_top_id", "game_date"], ["team_bottom_id", "game_date"]],
+    "lake_score": [["game_id", "index"], ["batter_id"], ["pitcher_id"]],
+    "lake_player": [["player_id", "valid_from"], ["team_id"]],
+}
+
+# よく使う検索。名前付きのパラメータで呼ぶ
+QUERIES = {
+    # 試合の全投球
+    "game_events": """
+        SELECT * FROM lake_score WHERE game_id = :game_id ORDER BY "index"
+    """,
+    # 投手の期間内の投球
+    "pitcher_events": """
+        SELECT g.game_date, s.*
+        FROM lake_score s JOIN lake_game g ON g.game_id = s.game_id
+        WHERE s.pitcher_id = :pitcher_id AND g.game_date BETWEEN :start_date AND :end_date
+        ORDER BY g.game_date, s."index"
+    """,
+    # 打者の期間内の打席
+    "batter_events": """
+        SELECT g.game_date, s.*
+        FROM lake_score s JOIN lake_game g ON g.game_id = s.game_id
+        WHERE s.batter_id = :batter_id AND g.game_date BETWEEN :start_date AND :end_date
+        ORDER BY g.game_date, s."index"
+    """,
+    # チームの期間内の試合。表と裏でそれぞれインデックスを使う
+    "team_games": """
+        SELECT * FROM (
+            SELECT * FROM lake_game WHERE team_top_id = :team_id AND game_date BETWEEN :start_date AND :end_date
+            UNION ALL
+            SELECT * FROM lake_game WHERE team_bottom_id = :team_id AND game_date BETWEEN :start_date AND :end_date
+        ) ORDER BY game_date, game_id
+    """,
+    # 選手の最新の版
+    "player": """
+        SELECT * FROM lake_player WHERE player_id = :player_id ORDER BY valid_from DESC LIMIT 1
+    """,
+    # チームの所属選手（最新の版）
+    "team_players": """
+        SELECT p.* FROM lake_player p
+        WHERE p.team_id = :team_id AND p.valid_from = (SELECT MAX(valid_from) FROM lake_player WHERE player_id = p.player_id)
+        ORDER BY p.player_id
+    """,
+}
+
+
+def quote(name):
+    """列名をSQLの識別子にする。indexなどの予約語があるため"""
+    return '"' + name + '"'
+
+
+class LakeQuery():
+    """lakeのテーブルをSQLiteに入れ、インデックスを張ってローカルで検索する
+
+    lake_game/lake_scoreはまだ入っていない試合だけ追加し、lake_playerは入れ直す。
+
+    Args:
+        db_path (str): SQLiteのファイルのpath。":memory:"ならメモリ上
+        table (DictConfig): config_table.yamlのtable
+    """
+    def __init__(self, db_path, table):
+        if db_path != ":memory:" and os.path.dirname(db_path) != "":
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        self.table = table
+        self.lock = threading.Lock()
+        for table_name in INDEXES:
+            self.create_table(table_name)
+
+    def create_table(self, table_name):
+        columns = ", ".join(quote(c.name) + " " + SQLITE_TYPES.get(c.get("type", "STRING"), "TEXT") for c in self.table[table_name].column)
+        with self.lock, self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns})")
+            for index_columns in INDEXES[table_name]:
+                name = f"idx_{table_name}_" + "_".join(index_columns)
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({', '.join(quote(c) for c in index_columns)})")
+
+        return None
+
+    def to_rows(self, df, table_name):
+        """DataFrameを列定義の順のタプルにする。日付は文字列、欠損はNULL"""
+        names = [c.name for c in self.table[table_name].column]
+        data = {}
+        for c in self.table[table_name].column:
+            values = df[c.name] if c.name in df.columns else pd.Series([None] * len(df), index=df.index)
+            col_type = c.get("type", "STRING")
+            if col_type in SQLITE_TYPES:
+                values = pd.to_numeric(values, errors="coerce").astype("float64").tolist()
+                cast = int if col_type == "INTEGER" else float
+                data[c.name] = [None if x != x else cast(x) for x in values]
+                continue
+            if col_type in DATE_FORMATS:
+                values = pd.to_datetime(values, errors="coerce").dt.strftime(DATE_FORMATS[col_type])
+            values = values.astype(object).where(values.notna(), None).tolist()
+            data[c.name] = [None if x is None else str(x) for x in values]
+
+        return list(zip(*[data[name] for name in names]))
+
+    def execute_insert(self, df, table_name):
+        """トランザクションの中で行を追加する。ロックは呼び出し側で取る"""
+        placeholders = ", ".join("?" for _ in self.table[table_name].column)
+        self.conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", self.to_rows(df, table_name))
+
+        return None
+
+    def insert(self, df, table_name):
+        with self.lock, self.conn:
+            self.execute_insert(df, table_name)
+
+        return None
+
+    def loaded_game_ids(self, table_name):
+        with self.lock:
+            return {row[0] for row in self.conn.execute(f"SELECT DISTINCT game_id FROM {table_name}")}
+
+    def sync(self, read_lake):
+        """lakeの内容を取り込む
+
+        Args:
+            read_lake (callable): ScrapingSponavi.read_lakeと同じ引数でlakeのテーブルを返す関数
+
+        Returns:
+            dict: テーブルごとの追加した行数
+        """
+        counts = {}
+        df_game = read_lake("lake_game")
+        if df_game is not None:
+            new_ids = sorted(set(df_game["game_id"].astype(str)) - self.loaded_game_ids("lake_game"))
+            df_game = df_game[df_game["game_id"].astype(str).isin(new_ids)].drop_duplicates(subset=["game_id"], keep="last")
+
+            # 速報ページはlake_gameに入れる試合の分を入れる
+            score_ids = sorted(set(new_ids) - self.loaded_game_ids("lake_score"))
+            df_score = read_lake("lake_score", game_ids=score_ids) if len(score_ids) > 0 else None
+            if df_score is not None:
+                df_score = df_score.drop_duplicates(subset=["game_id", "index"], keep="last")
+
+            # 試合と速報ページは1つのトランザクションで入れる。途中で失敗すれば両方入らず、次のsyncで入れ直す
+            with self.lock, self.conn:
+                self.execute_insert(df_game, "lake_game")
+                if df_score is not None:
+                    self.execute_insert(df_score, "lake_score")
+            counts["lake_game"] = len(df_game)
+            if df_score is not None:
+                counts["lake_score"] = len(df_score)
+
+        df_player = read_lake("lake_player")
+        if df_player is not None:
+            with self.lock, self.conn:
+                self.conn.execute("DELETE FROM lake_player")
+                self.execute_insert(df_player, "lake_player")
+            counts["lake_player"] = len(df_player)
+
+        with self.lock, self.conn:
+            self.conn.execute("ANALYZE")
+
+        return counts
+
+    def sql(self, sql, params=None):
+        """SQLを実行してDataFrameで返す
+
+        Args:
+            sql (str): SQL
+            params (dict): 名前付きのパラメータ
+
+        Returns:
+            DataFrame: 結果
+        """
+        with self.lock:
+            cursor = self.conn.execute(sql, params or {})
+            rows = cursor.fetchall()
+
+        return pd.DataFrame(rows, columns=[d[0] for d in cursor.description])
+
+    def query(self, name, **params):
+        """QUERIESの検索を実行する
+
+        Args:
+            name (str): QUERIESのキー
+            **params: パラメータ。start_date/end_dateは省略すると全期間
+
+        Returns:
+            DataFrame: 結果
+        """
+        params.setdefault("start_date", "0000-00-00")
+        params.setdefault("end_date", "9999-99-99")
+
+        return self.sql(QUERIES[name], params)
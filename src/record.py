@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+# config_table.yamlの型ごとのバッファのdtype。ここにない型は文字列としてobjectで持つ
+BUFFER_DTYPES = {
+    "INTEGER": np.float64,
+    "FLOAT": np.float64,
+}
+
+# DataFrameにするときのdtype
+FRAME_DTYPES = {
+    "INTEGER": "Int64",
+    "FLOAT": "float64",
+}
+
+
+class RecordBuilder():
+    """config_table.yamlの列定義から型付きの列バッファを確保し、1行ずつ追記する
+
+    DataFrame.appendのように行ごとにDataFrameを作り直さず、
+    容量が足りなくなったら倍に拡張するので追記は償却O(1)になる。
+
+    Args:
+        columns (ListConfig): 列定義（name, type）のリスト
+        capacity (int): 最初に確保する行数
+    """
+    def __init__(self, columns, capacity=1024):
+        self.columns = [c.name for c in columns]
+        self.types = {c.name: c.get("type", "STRING") for c in columns}
+        self.capacity = max(capacity, 1)
+        self.size = 0
+        self.buffers = {name: self.alloc(name, self.capacity) for name in self.columns}
+
+    def __len__(self):
+        return self.size
+
+    def alloc(self, name, capacity):
+        dtype = BUFFER_DTYPES.get(self.types[name], object)
+        return np.full(capacity, np.nan, dtype=dtype)
+
+    def grow(self):
+        self.capacity *= 2
+        for name in self.columns:
+            buffer = self.alloc(name, self.capacity)
+            buffer[:self.size] = self.buffers[name][:self.size]
+            self.buffers[name] = buffer
+
+    def convert(self, name, value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return np.nan
+        if self.types[name] in BUFFER_DTYPES:
+            return float(value) if value != "" else np.nan
+        return value
+
+    def append(self, record):
+        """1行追記する。列定義にないキーは無視し、ないキーは欠損にする
+
+        Args:
+            record (dict): 1行分のデータ
+        """
+        if self.size == self.capacity:
+            self.grow()
+        for name in self.columns:
+            self.buffers[name][self.size] = self.convert(name, record.get(name))
+        self.size += 1
+
+        return None
+
+    def extend(self, records):
+        """複数行追記する
+
+        Args:
+            records (iterable): 1行分のデータ(dict)の列
+        """
+        for record in records:
+            self.append(record)
+
+        return None
+
+    def to_frame(self):
+        """列定義の順に並んだDataFrameにする
+
+        Returns:
+            DataFrame: 追記したデータ
+        """
+        data = {}
+        for name in self.columns:
+            buffer = self.buffers[name][:self.size]
+            dtype = FRAME_DTYPES.get(self.types[name])
+            data[name] = pd.array(buffer, dtype=dtype) if dtype is not None else buffer
+
+        return pd.DataFrame(data, columns=self.columns)
+
+    def to_arrow(self):
+        """列定義の順に並んだArrowテーブルにする
+
+        Returns:
+            pyarrow.Table: 追記したデータ
+        """
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(self.to_frame(), preserve_index=False)
+
+    def clear(self):
+        """追記したデータを捨てる。確保したバッファは使いまわす"""
+        for name in self.columns:
+            self.buffers[name][:self.size] = np.nan
+        self.size = 0
+
+        return None
@@ -0,0 +1,403 @@
+import datetime
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from omegaconf import OmegaConf
+
+from .cache import HtmlCache
+from .lake import LakeReader, LakeWriter
+from .record import RecordBuilder
+
+# save_htmlが書くファイル名。ゲーム日_ゲームID_ゲームステータス_実行日.html
+ARCHIVE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})_g(\d+)_(\w+)_(\d{14})\.html$")
+# キャッシュにある速報ページのURL
+SCORE_URL_PATTERN = re.compile(r"/game/(\d+)/score\?index=(\w+)")
+# 作り直すテーブルとそのキー
+TABLE_KEYS = {
+    "lake_game": ["game_id"],
+    "lake_score": ["game_id", "index"],
+}
+
+# ワーカープロセスごとのスクレイパー。パーサーだけを使う
+worker_scraper = None
+
+
+def parse_archive_name(file_name):
+    """アーカイブのファイル名から試合日、試合番号、ステータス、実行日を取り出す
+
+    Args:
+        file_name (str): ファイル名
+
+    Returns:
+        dict: game_date, game_id_num, game_status, exec_datetime。形式が違えばNone
+    """
+    m = ARCHIVE_PATTERN.match(file_name)
+    if m is None:
+        return None
+
+    return {
+        "game_date": m.group(1),
+        "game_id_num": m.group(2),
+        "game_status": m.group(3),
+        "exec_datetime": datetime.datetime.strptime(m.group(4), "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def init_worker(config):
+    """ワーカープロセスでパース用のスクレイパーを作る。取得や出力はしない"""
+    from .scraping import ScrapingSponavi
+
+    global worker_scraper
+    config = OmegaConf.create(config)
+    config.exec_upload = False
+    config.path_state_db = ":memory:"
+    OmegaConf.update(config, "cache.enable", False, force_add=True)
+    worker_scraper = ScrapingSponavi(config, None, None)
+
+
+def parse_game_file(item):
+    """試合トップページのhtmlをパースする
+
+    Returns:
+        tuple: (path, 試合の情報, エラー)
+    """
+    path, meta = item
+    try:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        url = worker_scraper.base_url + "/game/" + meta["game_id_num"] + "/top"
+        result = worker_scraper.get_game_info(html, url)
+        result["exec_datetime"] = meta["exec_datetime"]
+    except Exception as e:
+        return path, None, repr(e)
+
+    return path, result, None
+
+
+def parse_score_file(path):
+    """キャッシュの速報ページをパースする。速報ページ以外と試合終了のページはNone
+
+    Returns:
+        tuple: (path, 1球分の情報, エラー)
+    """
+    try:
+        entry = HtmlCache.read_file(path)
+        m = SCORE_URL_PATTERN.search(entry["url"]) if entry is not None else None
+        if m is None:
+            return path, None, None
+        result, _ = worker_scraper.parse_score_page(entry["html"], worker_scraper.make_id(m.group(1)), m.group(2))
+        if result is not None:
+            result["exec_datetime"] = datetime.datetime.fromtimestamp(entry["fetched_at"]).strftime("%Y-%m-%d %H:%M:%S")
+    except Exception as e:
+        return path, None, repr(e)
+
+    return path, result, None
+
+
+def missing_rows(df, df_other, keys):
+    """df_otherにないキーのdfの行
+
+    Args:
+        df (DataFrame): 絞り込む行
+        df_other (DataFrame): 比べる行。Noneならdfのまま
+        keys (list): キーの列
+
+    Returns:
+        DataFrame: dfの行のうち、キーがdf_otherにないもの
+    """
+    if df_other is None or len(df_other) == 0:
+        return df
+    # lakeから読んだ列とパースした列で型が違うことがあるので文字列で比べる
+    missing = ~pd.MultiIndex.from_frame(df[keys].astype(str)).isin(pd.MultiIndex.from_frame(df_other[keys].astype(str)))
+
+    return df[missing]
+
+
+def keep_missing_rows(df_new, df_old, keys):
+    """作り直した行に、作り直せなかったキーの既存の行を足す
+
+    Args:
+        df_new (DataFrame): 作り直した行
+        df_old (DataFrame): 既存の行。Noneならdf_newのまま
+        keys (list): キーの列
+
+    Returns:
+        DataFrame: df_newとdf_newにないキーのdf_oldの行
+    """
+    if df_old is None or len(df_old) == 0:
+        return df_new.reset_index(drop=True)
+
+    return pd.concat([df_new, missing_rows(df_old, df_new, keys)], ignore_index=True)
+
+
+def key_set(df, keys):
+    """キーの組の集合。dfがNoneなら空"""
+    return set(df[keys].astype(str).itertuples(index=False, name=None)) if df is not None else set()
+
+
+class ArchiveReplay():
+    """保存済みのhtmlを複数プロセスでパースし直してlakeを作り直す
+
+    試合トップページはsave_htmlのアーカイブから、速報ページはhtmlのキャッシュから読む。
+    パースしたらまとめて1回でlakeに書き出す。ネットワークには接続しない。
+
+    overwriteのときは、作り直した行と、作り直せなかった試合や速報ページ（アーカイブがない、パースできない、
+    キャッシュから消えた）の既存の行を合わせたテーブルを別のディレクトリに書き、読み直して既存のキーが
+    すべて残っていることを確かめてからテーブルごとに入れ替える。途中で止まっても既存の出力は消えない。
+
+    Args:
+        scraper (ScrapingSponavi): lakeの出力に使うスクレイパー
+        config (DictConfig): 全体の設定。ワーカーでスクレイパーを作るのに使う
+        workers (int): プロセス数。Noneならコア数
+        chunksize (int): 1回にワーカーに渡すファイル数
+        overwrite (bool): 既存の出力を作り直したテーブルで置き換えるか。Falseなら既存の出力にないキーの行だけ追記する
+    """
+    def __init__(self, scraper, config, workers=None, chunksize=64, overwrite=True):
+        self.scraper = scraper
+        self.config = OmegaConf.to_container(config, resolve=True)
+        self.workers = workers
+        self.chunksize = chunksize
+        self.overwrite = overwrite
+
+    @classmethod
+    def from_config(cls, scraper, config):
+        replay = config.get("replay", {})
+
+        return cls(
+            scraper,
+            config,
+            workers=replay.get("workers"),
+            chunksize=replay.get("chunksize", 64),
+            overwrite=replay.get("overwrite", True),
+            )
+
+    def scan_games(self, archive_dir):
+        """アーカイブのファイルを集める。同じ試合が複数あれば実行日の新しいものを使う
+
+        Args:
+            archive_dir (str): アーカイブのディレクトリ
+
+        Returns:
+            list: (path, ファイル名の情報)のリスト
+        """
+        latest = {}
+        for file_name in sorted(os.listdir(archive_dir)):
+            meta = parse_archive_name(file_name)
+            if meta is None:
+                continue
+            current = latest.get(meta["game_id_num"])
+            if current is None or current[1]["exec_datetime"] <= meta["exec_datetime"]:
+                latest[meta["game_id_num"]] = (os.path.join(archive_dir, file_name), meta)
+
+        return list(latest.values())
+
+    def map(self, pool, func, items, builder):
+        """ファイルをワーカーでパースしてbuilderに追記する
+
+        Returns:
+            tuple: (パースしたファイル数, エラーのリスト)
+        """
+        n_files = 0
+        errors = []
+        for path, result, error in pool.map(func, items, chunksize=self.chunksize):
+            n_files += 1
+            if error is not None:
+                errors.append((path, error))
+            elif result is not None:
+                builder.append(result)
+
+        return n_files, errors
+
+    def lake_dir(self):
+        """lakeのディレクトリ。Parquetならテーブルごとのディレクトリ、TSVならテーブルごとのファイルを置く"""
+        return self.scraper.lake_writer.lake_dir if self.scraper.lake_format == "parquet" else self.scraper.output_lake_tsv_path
+
+    def table_path(self, lake_dir, table_name):
+        return os.path.join(lake_dir, table_name if self.scraper.lake_format == "parquet" else table_name + ".tsv")
+
+    def score_dates(self, df_score, df_game):
+        """速報ページの行のパーティションの試合日。lake_gameから引き、なければ既存の行のパーティションを使う"""
+        game_dates = df_game.drop_duplicates("game_id", keep="last").set_index("game_id")["game_date"].astype(str).str[:10]
+        dates = df_score["game_id"].map(game_dates)
+        if "game_date" in df_score.columns:
+            dates = dates.fillna(df_score["game_date"].astype(str).str[:10])
+
+        return dates
+
+    def write_tables(self, lake_dir, df_game, df_score):
+        """lake_gameとlake_scoreをlake_dirに書く。試合日の分からない速報ページの行はParquetには書かない
+
+        Returns:
+            dict: テーブルごとの書いた行数
+        """
+        game_columns = [c.name for c in self.scraper.table.lake_game.column]
+        score_columns = [c.name for c in self.scraper.table.lake_score.column]
+        n_rows = {}
+        if self.scraper.lake_format == "parquet":
+            writer = LakeWriter(lake_dir, self.scraper.table)
+            writer.write(df_game[game_columns], "lake_game")
+            n_rows["lake_game"] = len(df_game)
+            if df_score is not None:
+                dates = self.score_dates(df_score, df_game)
+                for game_date, df in df_score.groupby(dates, sort=True):
+                    writer.write(df[score_columns], "lake_score", game_date=game_date)
+                n_rows["lake_score"] = int(dates.notna().sum())
+        else:
+            os.makedirs(lake_dir, exist_ok=True)
+            for table_name, df, columns in [("lake_game", df_game, game_columns), ("lake_score", df_score, score_columns)]:
+                if df is not None:
+                    df[columns].to_csv(self.table_path(lake_dir, table_name), sep="\t", index=False)
+                    n_rows[table_name] = len(df)
+
+        return n_rows
+
+    def read_table(self, lake_dir, table_name, columns=None):
+        if self.scraper.lake_format == "parquet":
+            return LakeReader(lake_dir, self.scraper.table).read(table_name, columns=columns)
+        path = self.table_path(lake_dir, table_name)
+
+        return pd.read_csv(path, sep="\t", dtype=str, usecols=columns) if os.path.exists(path) else None
+
+    def verify(self, staging_dir, n_rows, old_keys):
+        """書いたテーブルを読み直し、行数と既存のキーがすべて残っていることを確かめる
+
+        Raises:
+            RuntimeError: 行数が違うか、既存のキーがなくなっているとき
+        """
+        for table_name, n in n_rows.items():
+            keys = TABLE_KEYS[table_name]
+            df = self.read_table(staging_dir, table_name, columns=keys)
+            n_read = len(df) if df is not None else 0
+            lost = old_keys[table_name] - key_set(df, keys)
+            if n_read != n or len(lost) > 0:
+                raise RuntimeError(f"replay check failed for {table_name}: wrote {n} rows, read {n_read}, lost {len(lost)} existing keys")
+
+        return None
+
+    def swap(self, staging_dir, table_names):
+        """確かめたテーブルを既存のテーブルと入れ替え、古いテーブルを消す"""
+        lake_dir = self.lake_dir()
+        os.makedirs(lake_dir, exist_ok=True)
+        replaced = []
+        for table_name in table_names:
+            staged = self.table_path(staging_dir, table_name)
+            if not os.path.exists(staged):
+                continue
+            path = self.table_path(lake_dir, table_name)
+            if os.path.exists(path):
+                os.rename(path, path + ".replaced")
+                replaced.append(path + ".replaced")
+            os.rename(staged, path)
+
+        for path in replaced:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        return None
+
+    def rebuild(self, df_game, df_score):
+        """作り直した行と作り直せなかった既存の行を合わせ、別のディレクトリに書いて確かめてから入れ替える
+
+        Returns:
+            dict: テーブルごとの書いた行数と、既存の行から残した行数
+        """
+        df_game_old = self.scraper.read_lake("lake_game")
+        df_score_old = self.scraper.read_lake("lake_score") if df_score is not None else None
+        old_keys = {"lake_game": key_set(df_game_old, TABLE_KEYS["lake_game"])}
+        df_game_all = keep_missing_rows(df_game, df_game_old, TABLE_KEYS["lake_game"])
+        kept = {"lake_game": len(df_game_all) - len(df_game)}
+        df_score_all = None
+        if df_score is not None:
+            old_keys["lake_score"] = key_set(df_score_old, TABLE_KEYS["lake_score"])
+            df_score_all = keep_missing_rows(df_score, df_score_old, TABLE_KEYS["lake_score"])
+            kept["lake_score"] = len(df_score_all) - len(df_score)
+
+        staging_dir = self.lake_dir().rstrip(os.sep) + ".replay_staging"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        try:
+            n_rows = self.write_tables(staging_dir, df_game_all, df_score_all)
+            self.verify(staging_dir, n_rows, old_keys)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        self.swap(staging_dir, list(n_rows))
+
+        return {table_name: {"rows": n, "kept": kept[table_name]} for table_name, n in n_rows.items()}
+
+    def append(self, df_game, df_score):
+        """作り直した行のうち、既存の出力にないキーの行だけ追記する。既存の行は直さない
+
+        Returns:
+            dict: テーブルごとの書いた行数
+        """
+        df_game_old = self.scraper.read_lake("lake_game", columns=["game_id", "game_date"])
+        df_game_new = missing_rows(df_game, df_game_old, TABLE_KEYS["lake_game"])
+        n_rows = {"lake_game": len(df_game_new)}
+        self.scraper.save_lake(df_game_new[[c.name for c in self.scraper.table.lake_game.column]], "lake_game")
+        if df_score is not None:
+            df_score = missing_rows(df_score, self.scraper.read_lake("lake_score", columns=TABLE_KEYS["lake_score"]), TABLE_KEYS["lake_score"])
+            # 試合日はアーカイブになければ既存のlake_gameから引く
+            df_dates = pd.concat([df_game_old, df_game[["game_id", "game_date"]]], ignore_index=True) if df_game_old is not None else df_game
+            dates = self.score_dates(df_score, df_dates)
+            columns = [c.name for c in self.scraper.table.lake_score.column]
+            for game_date, df in df_score.groupby(dates, sort=True):
+                self.scraper.save_lake(df[columns], "lake_score", game_date=game_date)
+            n_rows["lake_score"] = int(dates.notna().sum())
+
+        return {table_name: {"rows": n, "kept": 0} for table_name, n in n_rows.items()}
+
+    def run(self, archive_dir, cache_dir=None):
+        """アーカイブからlake_gameを、キャッシュがあればlake_scoreも作り直す
+
+        Args:
+            archive_dir (str): 試合トップページのアーカイブのディレクトリ
+            cache_dir (str): htmlのキャッシュのディレクトリ。Noneなら速報ページは作らない
+
+        Returns:
+            dict: テーブルごとのファイル数、行数、既存の行から残した行数、エラー数、秒数
+        """
+        stats = {}
+        game_files = self.scan_games(archive_dir)
+        score_files = list(HtmlCache(cache_dir).list_files()) if cache_dir is not None and os.path.isdir(cache_dir) else []
+        print("replay", len(game_files), "game files", len(score_files), "cache files")
+
+        game_builder = RecordBuilder(self.scraper.table.lake_game.column, capacity=max(len(game_files), 1))
+        score_builder = RecordBuilder(self.scraper.table.lake_score.column)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(self.config,)) as pool:
+            start = time.perf_counter()
+            n_files, errors = self.map(pool, parse_game_file, game_files, game_builder)
+            stats["lake_game"] = {"files": n_files, "rows": len(game_builder), "errors": len(errors), "seconds": time.perf_counter() - start}
+
+            start = time.perf_counter()
+            n_files, score_errors = self.map(pool, parse_score_file, score_files, score_builder)
+            stats["lake_score"] = {"files": n_files, "rows": len(score_builder), "errors": len(score_errors), "seconds": time.perf_counter() - start}
+
+        for path, error in errors + score_errors:
+            print("error", path, error)
+
+        # まとめて書き出す
+        df_game = game_builder.to_frame()
+        df_game = df_game.sort_values(["game_date", "game_id"], ignore_index=True)[[c.name for c in self.scraper.table.lake_game.column]]
+        df_score = None
+        if len(score_files) > 0:
+            df_score = score_builder.to_frame()
+            df_score = df_score.sort_values(["game_id", "index"], ignore_index=True)[[c.name for c in self.scraper.table.lake_score.column]]
+        written = self.rebuild(df_game, df_score) if self.overwrite else self.append(df_game, df_score)
+        for table_name, stat in written.items():
+            stats[table_name].update(stat)
+        if "lake_score" not in written:
+            stats.pop("lake_score")
+
+        for table_name, stat in stats.items():
+            files_per_sec = stat["files"] / stat["seconds"] if stat["seconds"] > 0 else 0
+            print(f"{table_name}: {stat['files']} files, {stat['rows']} rows ({stat['kept']} kept from the existing lake), "
+                  f"{stat['errors']} errors, {files_per_sec:.1f} files/sec")
+
+        return stats
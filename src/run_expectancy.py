@@ -0,0 +1,350 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from .datamart import RESULT_PATTERNS, base_state
+
+# 集計テーブルごとのキー。キー以外の列はすべて足し合わせられる値
+TABLE_KEYS = {
+    "state_runs": ["season", "state"],
+    "player_states": ["season", "role", "player_id", "state"],
+}
+
+# 状態はアウト数 x 8 + 走者（1塁=1, 2塁=2, 3塁=4）。3アウトでイニングが終わった状態はEND_STATE
+N_STATES = 24
+END_STATE = 24
+
+# result_mainからアウト数を見積もる。上から順に評価し、最初に一致したものを使う
+OUT_PATTERNS = [
+    (3, "三重殺"),
+    (2, "併殺"),
+    (0, RESULT_PATTERNS["hits"] + "|" + RESULT_PATTERNS["walks"] + "|" + RESULT_PATTERNS["hit_by_pitch"] + "|失策|エラー|野選|振り逃げ"),
+    (1, "三振|ゴロ|フライ|飛球|ライナー|犠打|犠飛|バント|アウト"),
+]
+
+# 速報ページの列のうちRE24に使う列
+SCORE_COLUMNS = ["game_id", "index", "result_main", "result_sub", "batter_id", "pitcher_id", "base_1", "base_2", "base_3"]
+
+BASE_LABELS = ["___", "1__", "_2_", "12_", "__3", "1_3", "_23", "123"]
+
+
+def count_runners(base):
+    return (base & 1) + ((base >> 1) & 1) + ((base >> 2) & 1)
+
+
+def map_unique(values, func):
+    """文字列の列を種類ごとに1回だけfuncで変換する。打席結果の種類は行数よりずっと少ない"""
+    codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+
+    return np.asarray(func(pd.Series(uniques, dtype=object).astype(str)))[codes]
+
+
+def outs_on_play(result):
+    """打席結果の文字列からアウト数を見積もる"""
+    outs = np.zeros(len(result), dtype=np.int8)
+    matched = np.zeros(len(result), dtype=bool)
+    for n, pattern in OUT_PATTERNS:
+        hit = result.str.contains(pattern).to_numpy() & ~matched
+        outs[hit] = n
+        matched |= hit
+
+    return outs
+
+
+def group_cumsum(values, group, new_group):
+    """グループの中での累積和（その行を含む）"""
+    cumulative = np.cumsum(values)
+    offset = (cumulative - values)[new_group]
+
+    return cumulative - offset[group]
+
+
+def base_out_events(df_score):
+    """速報ページから打席ごとの状態の変化を作る
+
+    打席結果のあるページを打席の終わりとし、試合とハーフイニング（indexの先頭3桁）ごとに
+    indexの順に並べて、打席前と打席後のアウト数と走者、打席で入った得点、イニングの終わりまでの得点を求める。
+    アウト数はresult_subの「Nアウト」を優先し、なければ打席結果から見積もる。得点はresult_subの「N点」を優先し、
+    なければ打席前の走者と打者の人数から、次の打席の走者とアウトになった人数を引いて求める。
+    行ごとのループは使わず、並べた配列の隣との比較と累積和で計算する。
+
+    Args:
+        df_score (DataFrame): lake_score
+
+    Returns:
+        DataFrame: game_id, index, batter_id, pitcher_id, outs_before, base_before, outs_after, base_after,
+            runs, state_before, state_after, runs_to_end, complete
+    """
+    result = df_score["result_main"]
+    df = df_score[(result.notna() & (result != "")).to_numpy()]
+    df = df.drop_duplicates(subset=["game_id", "index"], keep="last").sort_values(["game_id", "index"], ignore_index=True)
+    n = len(df)
+
+    game = df["game_id"].astype(str).to_numpy()
+    half = df["index"].astype(str).str[:3].to_numpy()
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = (game[1:] != game[:-1]) | (half[1:] != half[:-1])
+    last_in_group = np.ones(n, dtype=bool)
+    last_in_group[:-1] = new_group[1:]
+    group = np.cumsum(new_group) - 1
+
+    result = df["result_main"]
+    result_sub = df["result_sub"].astype(object).fillna("") if "result_sub" in df.columns else pd.Series([""] * n)
+    home_run = map_unique(result, lambda x: x.str.contains(RESULT_PATTERNS["home_runs"]).to_numpy())
+
+    # アウト数
+    outs_after = group_cumsum(map_unique(result, outs_on_play).astype(np.int64), group, new_group)
+    outs_sub = map_unique(result_sub, lambda x: pd.to_numeric(x.str.extract(r"(\d)アウト", expand=False), errors="coerce").to_numpy())
+    outs_after = np.clip(np.where(np.isnan(outs_sub), outs_after, outs_sub), 0, 3).astype(np.int64)
+    outs_before = np.zeros(n, dtype=np.int64)
+    outs_before[1:] = outs_after[:-1]
+    outs_before[new_group] = 0
+    outs_before = np.minimum(outs_before, outs_after)
+
+    # 走者
+    base_before = base_state(df).astype(np.int64)
+    base_after = np.zeros(n, dtype=np.int64)
+    base_after[:-1] = base_before[1:]
+    base_after[last_in_group] = 0
+
+    # 得点
+    runs = count_runners(base_before) + 1 - count_runners(base_after) - (outs_after - outs_before)
+    # イニングの最後の打席は次の走者がわからないので、本塁打のときだけ走者と打者を得点にする
+    runs = np.where(last_in_group, np.where(home_run, count_runners(base_before) + 1, 0), runs)
+    runs_sub = map_unique(result_sub, lambda x: pd.to_numeric(x.str.extract(r"(\d+)点", expand=False), errors="coerce").to_numpy())
+    runs = np.clip(np.where(np.isnan(runs_sub), runs, runs_sub), 0, 4).astype(np.int64)
+
+    # イニングの終わりまでの得点。3アウトまで続いたイニングだけを期待値の計算に使う
+    runs_to_end = np.bincount(group, weights=runs)[group] - group_cumsum(runs, group, new_group) + runs
+    complete = (outs_after[last_in_group] >= 3)[group]
+
+    state_before = outs_before * 8 + base_before
+    state_after = np.where(outs_after >= 3, END_STATE, np.minimum(outs_after, 2) * 8 + base_after)
+
+    return pd.DataFrame({
+        "game_id": game,
+        "index": df["index"].to_numpy(),
+        "batter_id": df["batter_id"].astype(object).to_numpy(),
+        "pitcher_id": df["pitcher_id"].astype(object).to_numpy(),
+        "outs_before": outs_before,
+        "base_before": base_before,
+        "outs_after": outs_after,
+        "base_after": base_after,
+        "runs": runs,
+        "state_before": state_before,
+        "state_after": state_after,
+        "runs_to_end": runs_to_end.astype(np.int64),
+        "complete": complete,
+    })
+
+
+def state_runs(df_events, season):
+    """状態ごとの打席数とイニングの終わりまでの得点の合計"""
+    df = df_events[df_events["complete"].to_numpy()]
+
+    return pd.DataFrame({
+        "season": season[df_events["complete"].to_numpy()],
+        "state": df["state_before"].to_numpy(),
+        "events": np.ones(len(df), dtype=np.int64),
+        "runs_to_end": df["runs_to_end"].to_numpy(),
+    }).groupby(TABLE_KEYS["state_runs"], as_index=False, sort=True).sum()
+
+
+def player_states(df_events, season):
+    """選手ごとに打席前の状態の回数（starts）、打席後の状態の回数（ends）、得点を数える
+
+    RE24の合計は sum(ends x 期待値) - sum(starts x 期待値) + 得点 なので、
+    期待値が変わっても回数から計算し直せる。
+    """
+    n = len(df_events)
+    zeros = np.zeros(n, dtype=np.int64)
+    ones = np.ones(n, dtype=np.int64)
+    frames = []
+    for role in ["batter", "pitcher"]:
+        player_id = df_events[f"{role}_id"].to_numpy()
+        for state, starts, ends, runs in [
+            (df_events["state_before"].to_numpy(), ones, zeros, df_events["runs"].to_numpy()),
+            (df_events["state_after"].to_numpy(), zeros, ones, zeros),
+        ]:
+            frames.append(pd.DataFrame({
+                "season": season,
+                "role": role,
+                "player_id": player_id,
+                "state": state,
+                "starts": starts,
+                "ends": ends,
+                "runs": runs,
+            }))
+    df = pd.concat(frames, ignore_index=True)
+
+    return df[df["player_id"].notna()].groupby(TABLE_KEYS["player_states"], as_index=False, sort=True).sum()
+
+
+def expectancy_array(df_state_runs):
+    """状態ごとの得点期待値の配列。END_STATEは0、打席のない状態はnan"""
+    runs = np.bincount(df_state_runs["state"], weights=df_state_runs["runs_to_end"], minlength=N_STATES)[:N_STATES]
+    events = np.bincount(df_state_runs["state"], weights=df_state_runs["events"], minlength=N_STATES)[:N_STATES]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expectancy = runs / events
+
+    return np.append(expectancy, 0.0)
+
+
+class RunExpectancy():
+    """lakeの速報ページからアウト数と走者の状態ごとの得点期待値と、打者/投手のRE24を作る
+
+    シーズンごとに状態ごとの得点の合計と、選手ごとの状態の回数を足し合わせられる形で持ち、
+    まだ集計していない試合だけを集計して足し込む。RE24は期待値が変わるたびに回数から計算し直すので、
+    試合が増えてもそのシーズンの打席をすべて数え直す必要はない。集計はcache_dirにParquetで保存する。
+
+    Args:
+        cache_dir (str): 保存先のディレクトリ。Noneなら保存しない
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.tables = {name: None for name in TABLE_KEYS}
+        self.game_ids = set()
+        if cache_dir is not None:
+            self.load()
+
+    def make_path(self, name):
+        return os.path.join(self.cache_dir, name + ".parquet")
+
+    def load(self):
+        """保存済みの集計を読む"""
+        for name in TABLE_KEYS:
+            if os.path.exists(self.make_path(name)):
+                self.tables[name] = pd.read_parquet(self.make_path(name))
+        if os.path.exists(self.make_path("games")):
+            self.game_ids = set(pd.read_parquet(self.make_path("games"))["game_id"])
+
+        return None
+
+    def save(self):
+        """集計を保存する。書き終わってから置き換える"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        frames = dict(self.tables)
+        frames["games"] = pd.DataFrame({"game_id": sorted(self.game_ids)})
+        for name, df in frames.items():
+            if df is None:
+                continue
+            tmp_path = self.make_path(name) + ".tmp"
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.make_path(name))
+
+        return None
+
+    def new_game_ids(self, df_game):
+        """まだ集計していない終了した試合のID"""
+        finished = df_game.loc[df_game["game_status"] == "finish", "game_id"].astype(str)
+
+        return sorted(set(finished) - self.game_ids)
+
+    def fold(self, name, delta):
+        """差分の集計を既存の集計に足し込む"""
+        current = self.tables[name]
+        if current is not None and len(current) > 0:
+            delta = pd.concat([current, delta], ignore_index=True).groupby(TABLE_KEYS[name], as_index=False, sort=True).sum()
+        self.tables[name] = delta.reset_index(drop=True)
+
+        return None
+
+    @staticmethod
+    def season_of(df_events, df_game):
+        return df_events["game_id"].map(df_game.drop_duplicates("game_id", keep="last").set_index("game_id")["game_date"].astype(str).str[:4]).astype("Int64")
+
+    def update(self, df_game, df_score):
+        """まだ集計していない試合を集計に足し込む
+
+        Args:
+            df_game (DataFrame): lake_game。集計済みの試合が含まれていても良い
+            df_score (DataFrame): lake_score
+
+        Returns:
+            int: 足し込んだ試合数。打席のある試合だけを集計済みにし、速報ページがまだない試合は次回に足し込む
+        """
+        new_ids = self.new_game_ids(df_game)
+        if len(new_ids) == 0:
+            return 0
+
+        df_events = base_out_events(df_score[df_score["game_id"].astype(str).isin(new_ids)])
+        season = self.season_of(df_events, df_game)
+        df_events, season = df_events[season.notna().to_numpy()], season[season.notna()].to_numpy(dtype=np.int64)
+        if len(df_events) > 0:
+            self.fold("state_runs", state_runs(df_events, season))
+            self.fold("player_states", player_states(df_events, season))
+        added = set(df_events["game_id"])
+        self.game_ids.update(added)
+
+        return len(added)
+
+    def expectancy(self, season):
+        df = self.tables["state_runs"]
+        if df is None:
+            return None
+
+        return expectancy_array(df[df["season"] == season])
+
+    def matrix(self, season):
+        """得点期待値の表。行は走者、列はアウト数
+
+        Args:
+            season (int): シーズン
+
+        Returns:
+            DataFrame: 得点期待値
+        """
+        expectancy = self.expectancy(season)
+        if expectancy is None:
+            return None
+
+        return pd.DataFrame(expectancy[:N_STATES].reshape(3, 8).T, index=BASE_LABELS, columns=[0, 1, 2])
+
+    def re24(self, role, season):
+        """打者（role=batter）か投手（role=pitcher）のシーズンのRE24。投手は打者側から見た値
+
+        Args:
+            role (str): batterかpitcher
+            season (int): シーズン
+
+        Returns:
+            DataFrame: player_id, events, runs, re24
+        """
+        df = self.tables["player_states"]
+        expectancy = self.expectancy(season)
+        if df is None or expectancy is None:
+            return None
+
+        df = df[(df["season"] == season) & (df["role"] == role)]
+        value = (df["ends"] - df["starts"]).to_numpy() * np.nan_to_num(expectancy)[df["state"].to_numpy()]
+        df = df.assign(value=value).groupby("player_id", as_index=False, sort=True)[["starts", "runs", "value"]].sum()
+
+        return pd.DataFrame({
+            "player_id": df["player_id"],
+            "events": df["starts"],
+            "runs": df["runs"],
+            "re24": df["value"] + df["runs"],
+        }).sort_values("re24", ascending=False, ignore_index=True)
+
+    def event_credit(self, df_game, df_score):
+        """打席ごとのRE24。集計済みのシーズンの得点期待値で評価する
+
+        Args:
+            df_game (DataFrame): lake_game
+            df_score (DataFrame): lake_score
+
+        Returns:
+            DataFrame: base_out_eventsの列にseason, re24を加えたもの
+        """
+        df_events = base_out_events(df_score)
+        season = self.season_of(df_events, df_game)
+        seasons = sorted(season.dropna().unique())
+        expectancy = np.full((len(seasons) + 1, END_STATE + 1), np.nan)
+        for i, s in enumerate(seasons):
+            if self.expectancy(s) is not None:
+                expectancy[i] = self.expectancy(s)
+        row = pd.Series(season).map({s: i for i, s in enumerate(seasons)}).fillna(len(seasons)).to_numpy(dtype=np.int64)
+        re24 = expectancy[row, df_events["state_after"].to_numpy()] - expectancy[row, df_events["state_before"].to_numpy()] + df_events["runs"].to_numpy()
+
+        return df_events.assign(season=season, re24=re24)
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import bs4
+
+from .fetch import FetchError
+from .record import RecordBuilder
+
+# 速報ページの最初のindex（1回表1人目）
+SCORE_FIRST_INDEX = "0110100"
+
+
+def is_score_index(index):
+    """indexが「回(2桁)+表裏(1桁)+打者(2桁)+枝番(2桁)」の形式か"""
+    return index is not None and len(index) == 7 and index.isdigit()
+
+
+class ScoreCrawler():
+    """速報ページを半イニングごとに分けて並列に取得する
+
+    1ページ目のスコアテーブルにある各回のリンクのindexを半イニングの先頭とし、
+    半イニングごとにbtn_nextをたどる処理を並列に実行して、最後に回の順に並べ直す。
+    たどっている間は次の打者のページを先読みしておく。
+
+    Args:
+        scraper (ScrapingSponavi): ページの取得とパースに使うスクレイパー
+        workers (int): 同時にたどる半イニングの数
+        prefetch_depth (int): 先読みする打者の数。0なら先読みしない
+    """
+    def __init__(self, scraper, workers=8, prefetch_depth=1):
+        self.scraper = scraper
+        self.prefetch_depth = prefetch_depth
+        self.game_executor = ThreadPoolExecutor(max_workers=workers)
+        self.inning_executor = ThreadPoolExecutor(max_workers=workers)
+
+    @classmethod
+    def from_config(cls, scraper, config):
+        """設定からクローラーを作る。設定がないか無効ならNone
+
+        Args:
+            scraper (ScrapingSponavi): スクレイパー
+            config (DictConfig): score_crawlの設定
+
+        Returns:
+            ScoreCrawler: クローラー
+        """
+        if config is None or not config.get("parallel", False):
+            return None
+
+        return cls(
+            scraper,
+            workers=config.get("workers", 8),
+            prefetch_depth=config.get("prefetch_depth", 1),
+            )
+
+    def get_inning_indices(self, html):
+        """スコアテーブルのリンクから半イニングの先頭のindexを集める
+
+        Args:
+            html (str): 速報ページのhtml
+
+        Returns:
+            list: 半イニングの先頭のindex。試合の順
+        """
+        soup = bs4.BeautifulSoup(html, "html.parser")
+        indices = {a.get("index") for a in soup.select("a.bb-gameScoreTable__score") if is_score_index(a.get("index"))}
+        indices.add(SCORE_FIRST_INDEX)
+
+        return sorted(indices)
+
+    def predict_indices(self, index):
+        """同じ半イニングの次の打者のindexを予測する"""
+        if not is_score_index(index):
+            return []
+        batter = int(index[3:5])
+
+        return [index[:3] + f"{batter + i:02d}" + "00" for i in range(1, self.prefetch_depth + 1) if batter + i < 100]
+
+    def crawl_inning(self, game_id, start_index, stop_index, first_html=None):
+        """半イニングの投球を先頭からたどる
+
+        スコアテーブルのリンクが欠けていて、stop_indexに着く前に別の半イニングに入ったときは、
+        止まったページから半イニングを区切らずにbtn_nextに従ってstop_indexまでたどる。
+
+        Args:
+            game_id (str): ゲームID
+            start_index (str): 半イニングの先頭のindex
+            stop_index (str): 次の半イニングの先頭のindex。最後の半イニングならNone
+            first_html (str): 先頭のページのhtml。取得済みの場合に渡す
+
+        Returns:
+            list: 1球分の情報の辞書のリスト
+
+        Raises:
+            FetchError: 途中のページを取得できなかったとき
+        """
+        results = []
+        prefetched = {}
+        visited = set()
+        half = start_index[:3] if is_score_index(start_index) else None
+        index, ended = self.walk(game_id, start_index, stop_index, first_html, half, results, prefetched, visited)
+
+        # stop_indexに着かずに別の半イニングに入ったら、btn_nextだけに従って続きをたどる
+        if not ended and index is not None and index != stop_index and index not in visited:
+            print("score table links incomplete", game_id, "follow btn_next from", index, "to", stop_index)
+            index, ended = self.walk(game_id, index, stop_index, None, None, results, prefetched, visited)
+
+        if not ended and index is not None and index != stop_index:
+            print("score pages loop", game_id, "at", index)
+
+        return results
+
+    def walk(self, game_id, index, stop_index, html, half, results, prefetched, visited):
+        """indexからbtn_nextをたどり、1球分の情報をresultsに追記する
+
+        Args:
+            game_id (str): ゲームID
+            index (str): 最初のページのindex
+            stop_index (str): 着いたら止まるindex
+            html (str): 最初のページのhtml。取得済みの場合に渡す
+            half (str): indexの先頭3桁。渡すと別の半イニングに入ったところで止まる
+            results (list): 1球分の情報の追記先
+            prefetched (dict): 先読みしたページのindexからfutureへの辞書
+            visited (set): 取得済みのindex
+
+        Returns:
+            tuple: (止まったところの次のページのindex, 試合終了のページに着いたか)
+
+        Raises:
+            FetchError: 途中のページを取得できなかったとき
+        """
+        while index is not None and index != stop_index and index not in visited:
+            # 別の半イニングに入ったら終わり
+            if half is not None and is_score_index(index) and index[:3] != half:
+                break
+            visited.add(index)
+
+            if html is None:
+                future = prefetched.pop(index, None)
+                if future is not None:
+                    html = future.result()
+                # 先読みで取れなかったページは、失敗を記録する通常の取得で取り直す
+                if html is None:
+                    html = self.scraper.get_html(self.scraper.get_score_url(game_id, index))
+
+            # 次の打者を先読み。予想が外れて取得できなくても失敗として扱わない
+            for predicted in self.predict_indices(index):
+                if predicted not in prefetched and predicted not in visited and predicted != stop_index:
+                    prefetched[predicted] = self.scraper.fetch_engine.submit(self.scraper.get_score_url(game_id, predicted), speculative=True)
+
+            if html is None:
+                raise FetchError(self.scraper.get_score_url(game_id, index))
+            result, index = self.scraper.parse_score_page(html, game_id, index)
+            html = None
+
+            # 試合終了
+            if result is None:
+                return index, True
+            results.append(result)
+
+        return index, False
+
+    def crawl(self, game_id):
+        """1試合の投球を半イニングごとに並列に取得する
+
+        Args:
+            game_id (str): ゲームID
+
+        Returns:
+            DataFrame: 試合の全投球。試合の順に並ぶ
+        """
+        first_html = self.scraper.get_html(self.scraper.get_score_url(game_id, SCORE_FIRST_INDEX))
+        starts = self.get_inning_indices(first_html) if first_html is not None else [SCORE_FIRST_INDEX]
+        stops = starts[1:] + [None]
+
+        futures = [
+            self.inning_executor.submit(
+                self.crawl_inning,
+                game_id,
+                start,
+                stop,
+                first_html if start == SCORE_FIRST_INDEX else None,
+                )
+            for start, stop in zip(starts, stops)
+        ]
+
+        score_builder = RecordBuilder(self.scraper.table.lake_score.column)
+        for future in futures:
+            score_builder.extend(future.result())
+
+        return score_builder.to_frame()
+
+    def crawl_many(self, list_game_id):
+        """複数試合を並列に取得する
+
+        Args:
+            list_game_id (list): ゲームIDのリスト
+
+        Returns:
+            tuple: (取得できた試合のゲームIDから全投球のDataFrameへの辞書, 取得できなかった試合のゲームIDから例外への辞書)
+        """
+        futures = {game_id: self.game_executor.submit(self.crawl, game_id) for game_id in list_game_id}
+
+        # 1試合の失敗で他の試合の結果を捨てない
+        dict_score_info, dict_error = {}, {}
+        for game_id, future in futures.items():
+            try:
+                dict_score_info[game_id] = future.result()
+            except Exception as e:
+                dict_error[game_id] = e
+
+        return dict_score_info, dict_error
@@ -1,32 +1,56 @@
 import datetime
+import functools
 import os
 import re
-import time
+import threading
 
 import bs4
 import numpy as np
 import pandas as pd
-import requests
-
-from .db_connection import load_to_bigquery
+import pyarrow.dataset as ds
+
+from .cache import HtmlCache
+from .datamart import SCORE_COLUMNS, Datamart
+from .db_connection import BigQueryLoader
+from .event_store import EventStore
+from .extractor import GamePageExtractor, StatsTableExtractor
+from .fetch import FetchEngine, FetchError
+from .lake import LakeReader, LakeWriter
+from .live import LivePoller
+from .metrics import Metrics
+from .pipeline import BatchSink, Pipeline, Stage
+from .player_dim import PlayerDimension, make_profile_hash
+from .query import LakeQuery
+from .record import RecordBuilder
+from .run_expectancy import SCORE_COLUMNS as RE_SCORE_COLUMNS
+from .run_expectancy import RunExpectancy
+from .score_crawler import SCORE_FIRST_INDEX, ScoreCrawler
+from .season_calendar import SeasonCalendar
+from .state import ScrapingState
 
 
 class ScrapingBase():
-    def __init__(self):
+    def __init__(self, fetch_engine=None, metrics=None):
         self.exec_datetime = datetime.datetime.now()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.fetch_engine = fetch_engine if fetch_engine is not None else FetchEngine(metrics=self.metrics)
+        # パイプラインの複数のスレッドから同じファイルに追記する
+        self.file_lock = threading.Lock()
 
-    def get_html(self, url):
-        print("get html ", url)
-        time.sleep(1)
-        res = requests.get(url)
-        try:
-            res.raise_for_status()
-            print("success")
-        except requests.exceptions.RequestException:
-            print("faild")
-            return None
-        
-        return res.text
+    def get_html(self, url, use_cache=True):
+        return self.fetch_engine.fetch(url, use_cache=use_cache)
+
+    def get_htmls(self, urls, use_cache=True):
+        """複数のページを並列に取得し、取得できた順に返す
+
+        Args:
+            urls (list): URLのリスト
+            use_cache (bool): キャッシュを使うか
+
+        Yields:
+            tuple: (url, html)
+        """
+        return self.fetch_engine.fetch_many(urls, use_cache=use_cache)
 
     def save_html(self, html, file_path):
         with open(file_path, "w", encoding="utf-8") as f:
@@ -35,16 +59,25 @@ class ScrapingBase():
         return None
 
     def save_csv(self, df, file_path):
-        if os.path.exists(file_path):
-            df.to_csv(file_path, mode='a', header=False, sep="\t", index=False)
-        else:
-            df.to_csv(file_path, sep="\t", index=False)
+        with self.file_lock:
+            if os.path.exists(file_path):
+                df.to_csv(file_path, mode='a', header=False, sep="\t", index=False)
+            else:
+                df.to_csv(file_path, sep="\t", index=False)
         
         return None
 
 class ScrapingSponavi(ScrapingBase):
     def __init__(self, config, start_date, end_date):
-        super().__init__()
+        cache = HtmlCache.from_config(config.get("cache"), cache_dir=config.get("path_cache_html", "data/cache/html"))
+        metrics = Metrics()
+        # 取り直しても取得できなかったURLは次回取り直す
+        self.state = ScrapingState(
+            config.get("path_state_db", "data/state.sqlite"),
+            max_failures=config.get("pipeline", {}).get("max_game_failures", 3),
+            )
+        fetch_engine = FetchEngine.from_config(config.get("fetch"), cache=cache, metrics=metrics, on_failure=self.state.save_dead_letter)
+        super().__init__(fetch_engine=fetch_engine, metrics=metrics)
         self.project_id = os.getenv("PROJECT_ID")
         self.sports = config.exec_sports
         self.upload_flag = config.exec_upload
@@ -52,12 +85,34 @@ class ScrapingSponavi(ScrapingBase):
         self.base_url = config.url_domain + config.exec_sports
         self.output_game_html_path = config.path_output_game_html
         self.output_lake_tsv_path = config.path_output_lake_tsv
+        self.lake_format = config.get("exec_lake_format", "tsv")
+        self.lake_writer = LakeWriter(config.get("path_output_lake_parquet", "data/lake_parquet"), config.table)
+        self.datamart_path = config.get("path_output_datamart", "data/datamart")
+        self.query_db_path = config.get("path_query_db", "data/lake.sqlite")
+        self.event_store_path = config.get("path_event_store", "data/events")
+        self.lake_reader = LakeReader(config.get("path_output_lake_parquet", "data/lake_parquet"), config.table)
         self.start_date = start_date
         self.end_date = end_date
         self.team_dict = config.team
         self.team_list = config.team_list
         self.schedule = config.schedule
+        self.calendar = SeasonCalendar(self.schedule)
         self.table = config.table
+        self.game_extractor = GamePageExtractor(
+            team_dict=self.team_dict,
+            make_id=self.make_id,
+            get_game_series=self.get_game_series,
+            )
+        self.stats_extractors = {
+            table_name: StatsTableExtractor(self.table[table_name].column, make_id=self.make_id)
+            for table_name in ["lake_player_batting", "lake_player_pitching"]
+        }
+        self.score_crawler = ScoreCrawler.from_config(self, config.get("score_crawl"))
+        self.checkpoint_pages = config.get("score_crawl", {}).get("checkpoint_pages", 50)
+        self.pipeline_config = config.get("pipeline", {})
+        self.player_crawl = config.get("player_crawl", {})
+        self.live_config = config.get("live", {})
+        self.loader = BigQueryLoader.from_config(config.get("bigquery"), self.table, self.project_id, metrics=self.metrics) if self.upload_flag else None
     
     def make_id(self, id):
         """スポナビ上のID番からIDを生成する
@@ -70,49 +125,61 @@ class ScrapingSponavi(ScrapingBase):
         """
         return self.sports + str(id)
 
+    def save_lake(self, df, table_name, game_date=None):
+        """lakeのテーブルを出力する。exec_lake_formatに応じてParquetかTSVに書く
+
+        Args:
+            df (DataFrame): 出力するデータ
+            table_name (str): lake_game, lake_score, lake_playerなど
+            game_date (str): Parquetのパーティションの日付。Noneならdfのgame_date列を使う
+        """
+        sink = "lake_parquet" if self.lake_format == "parquet" else "lake_tsv"
+        with self.metrics.timer("write_seconds", sink=sink, table=table_name):
+            if self.lake_format == "parquet":
+                self.lake_writer.write(df, table_name, game_date=game_date)
+            else:
+                self.save_csv(df, file_path=os.path.join(self.output_lake_tsv_path, table_name + ".tsv"))
+        self.metrics.inc("rows_written", len(df), sink=sink, table=table_name)
+
+        return None
+
+    def read_lake(self, table_name, columns=None, game_ids=None):
+        """lakeのテーブルを読む。exec_lake_formatに応じてParquetかTSVから読む
+
+        Args:
+            table_name (str): lake_game, lake_score, lake_playerなど
+            columns (list): 読む列。Noneなら全列
+            game_ids (list): 読む試合のID。Noneなら全試合
+
+        Returns:
+            DataFrame: テーブル。まだ出力していなければNone
+        """
+        if self.lake_format == "parquet":
+            filter = ds.field("game_id").isin(list(game_ids)) if game_ids is not None else None
+            return self.lake_reader.read(table_name, columns=columns, filter=filter)
+
+        file_path = os.path.join(self.output_lake_tsv_path, table_name + ".tsv")
+        if not os.path.exists(file_path):
+            return None
+
+        df = pd.read_csv(file_path, sep="\t", dtype=str, usecols=columns)
+
+        return df[df["game_id"].isin(game_ids)] if game_ids is not None else df
+
     def check_game_status(self, html):
-        soup = bs4.BeautifulSoup(html, "html.parser")
-        state_original = soup.select_one('span.bb-gameCard__state').get_text(strip=True)
-        
-        if state_original=="試合終了":
-            game_status = "finish"
-        elif state_original == "試合中止":
-            game_status = "cancel"
-        elif state_original == "試合前":
-            game_status = "before"
-        else:
-            game_status = "unkown"
-        
-        return game_status
+        return self.game_extractor.extract_status(self.game_extractor.parse(html))
 
     def get_game_series(self, game_date_str):
         """日付から試合の種類を判定
 
         Args:
-            game_date_str ([type]): [description]
+            game_date_str (str): 試合日（YYYY-MM-DD）
+
+        Returns:
+            str: 試合の種類。config_schedule.yamlの期間外ならNone
         """
-        def str2time(date_str):
-            return datetime.datetime.strptime(date_str, "%Y-%m-%d")
-
-        game_date = str2time(game_date_str)
-        schedule = self.schedule["year_"+str(game_date.year)]
-
-        if game_date >= str2time(schedule.pre_season_match.start_date) and \
-            game_date <= str2time(schedule.pre_season_match.end_date):
-            game_series = "pre_season_match"
-        elif game_date >= str2time(schedule.pennant_race.start_date) and \
-            game_date <= str2time(schedule.pennant_race.end_date):
-            game_series = "pennant_race"
-        elif game_date >= str2time(schedule.climax_series.start_date) and \
-            game_date <= str2time(schedule.climax_series.end_date):
-            game_series = "climax_series"
-        elif game_date >= str2time(schedule.nihon_series.start_date) and \
-            game_date <= str2time(schedule.nihon_series.end_date):
-            game_series = "nihon_series"
-
-        return game_series
+        return self.calendar.get_series(game_date_str)
 
-    
     def get_game_info(self, html, url):
         """試合の属性や結果を集める
 
@@ -121,277 +188,381 @@ class ScrapingSponavi(ScrapingBase):
             url (str): 試合のURL
 
         Returns:
-            [type]: [description]
+            dict: 試合の情報
         """
-        soup = bs4.BeautifulSoup(html, "html.parser")
+        with self.metrics.timer("parse_seconds", extractor="game"):
+            return self.game_extractor.extract(html, url)
 
-        # 結果を格納する辞書
-        result = {}
-
-        # ゲームID
-        result["game_id"] = "npb" + url.split("/")[-2]
-
-        # 日付
-        game_date = soup.select_one("title").get_text().split(" ")[0]
-        result["game_date"] = datetime.datetime.strptime(game_date, "%Y年%m月%d日").strftime("%Y-%m-%d")
-
-        # ステータス
-        state_original = soup.select_one('span.bb-gameCard__state').get_text(strip=True)
-        if state_original=="試合終了":
-            result["game_status"] = "finish"
-        elif state_original == "試合中止":
-            result["game_status"] = "cancel"
-            return result
-        elif state_original == "試合前":
-            result["game_status"] = "before"
-            return result
-        else:
-            result["game_status"] = "unkown"
-            return result
-
-        # ゲームのタイプを判定（オープン戦、ペナント、CS、日シリ）
-        result["game_series"] = self.get_game_series(result["game_date"])
-
-        # 球場
-        description = soup.select_one("p[class='bb-gameDescription']")
-        result["team_top_name"] = description.get_text().split("\n")[3].replace(" ","")
-
-        # 試合開始時間
-        description = soup.select_one("p[class='bb-gameDescription']")
-        result["game_start_time"] = description.get_text().split("\n")[2].replace(" ","")
-
-        # チーム名
-        teams = [x.get_text(strip=True) for x in soup.select("a.bb-gameScoreTable__team")]
-        result["team_top_name"] = teams[0]
-        result["team_bottom_name"] = teams[1]
-        result["team_top_id"] = self.team_dict[teams[0]].team_id
-        result["team_bottom_id"] = self.team_dict[teams[1]].team_id
-
-        # 合計点
-        scores = [x.get_text(strip=True) for x in soup.select("td[class='bb-gameScoreTable__total']")]
-        result["score_top"] = scores[0]
-        result["score_bottom"] = scores[1]
-
-        # 勝敗
-        if result["score_top"] > result["score_bottom"]:
-            result["game_result"] = "top_win"
-        elif result["score_top"] < result["score_bottom"]:
-            result["game_result"] = "bottom_win"
-        elif result["score_top"] == result["score_bottom"]:
-            result["game_result"] = "drow"
-
-        # 安打数
-        hits = [x.get_text(strip=True) for x in soup.select("td[class='bb-gameScoreTable__total bb-gameScoreTable__data--hits']")]
-        result["hit_top"] = hits[0]
-        result["hit_bottom"] = hits[1]
-
-        # 失策数
-        hits = [x.get_text(strip=True) for x in soup.select("td[class='bb-gameScoreTable__total bb-gameScoreTable__data--loss']")]
-        result["error_top"] = hits[0]
-        result["error_bottom"] = hits[1]
-
-        # 責任投手
-        try:
-            soup_pick = soup.select_one("section[id='pit_rec']")
-            pitchers = [x for x in soup_pick.select("td.bb-gameTable__data")]
-            list_pitcher_ids = []
-            for pitcher in pitchers:
-                if pitcher.get_text(strip=True) != "":
-                    pitcher_url = pitcher.select_one("a[class='bb-gameTable__player']")
-                    list_pitcher_ids.append(self.make_id(pitcher_url.get("href").split("/")[-2]))
-                else:
-                    list_pitcher_ids.append(np.nan)
-            result["picher_win_id"] = list_pitcher_ids[0]
-            result["picher_lose_id"] = list_pitcher_ids[1]
-            result["picher_save_id"] = list_pitcher_ids[2]
-        except:
-            pass # 引き分け
-
-        # 先発ピッチャー
-        soup_pick = soup.select_one("section[id='strt_mem']")
-        soup_target_tables = [x for x in soup_pick.select("table.bb-splitsTable")]
-        soup_pitcher_top = soup_target_tables[0].select_one("a")
-        soup_pitcher_bottom = soup_target_tables[2].select_one("a")
-        result["starting_picher_top_id"] = self.make_id(soup_pitcher_top.get("href").split("/")[-2])
-        result["starting_picher_bottom_id"] = self.make_id(soup_pitcher_bottom.get("href").split("/")[-2])
-
-        # 審判
-        soup_pick = soup.select("section[class='bb-modCommon01']")[-2]
-        data = [x.get_text(strip=True) for x in soup_pick.select("td.bb-tableLeft__data")]
-        result["umpire_plate"] = data[0]
-        result["umpire_first"] = data[1]
-        result["umpire_second"] = data[2]
-        result["umpire_third"] = data[3]
-
-        # 観客数/試合時間
-        soup_pick = soup.select("section[class='bb-modCommon01']")[-1]
-        data = [x.get_text(strip=True) for x in soup_pick.select("td.bb-tableLeft__data")]
-        result["audience_num"] = data[0]
-        result["game_time"] = data[1]
-
-        return result
-
-    def get_games(self, date, output_dir):
-        """対象日の全試合のデータを集める
+    def discover_games(self, date):
+        """対象日のゲーム一覧ページから、出力まで終わっていない試合を流す
 
         Args:
-            date (datetime): データ収集する日
-            output_dir (str): 出力先のpath
+            date (str): データ収集する日
 
-        Returns:
-            [type]: [description]
+        Yields:
+            tuple: (日付, スポナビ上の試合番号)
         """
         print("start ", date, "="*10)
 
-        # 実行日
-        str_datetime = self.exec_datetime.strftime("%Y%m%d%H%M%S")
-
         # 対象日のゲーム一覧htmlを取得
         url_date_schedule = self.base_url + "/schedule/?date=" + str(date)
         html_date = self.get_html(url_date_schedule)
+        if html_date is None:
+            return
         soup = bs4.BeautifulSoup(html_date, "html.parser")
         elems_game = soup.select('a.bb-score__content')
         print("there are ", len(elems_game), "games")
 
-        if len(elems_game) == 0:
-            "試合がない日はスキップ"
-            print("finish ", date, "="*10)
-            return None
-        else:
-            df_game_info_all = pd.DataFrame()
-            df_score_info_all = pd.DataFrame()
-            # 対象日のゲームをループ
-            for game in elems_game:
-                game_url_tmp = game.get('href')
-                game_id_num = re.search("\d+", game_url_tmp).group()
-                
-                # ゲームのhtmlを取得
-                game_url = self.base_url+"/game/"+game_id_num+"/top"
-                game_html = self.get_html(game_url)
-
-                # ゲームの結果を取得
-                game_info = self.get_game_info(game_html, game_url)
-
-                # 速報ページのスコアを取得
-                score_info = self.get_score_info(self.make_id(game_id_num))
-                
-                # 結果を保存。試合が完了しているときのみ
-                if game_info["game_status"] in ["finish", "cancel"]:
-                    # file名：ゲーム日_ゲームID_ゲームステータス_実行日
-                    file_name = "_".join([date, "g"+game_id_num, game_info["game_status"], str_datetime])+".html"
-                    out_path = os.path.join(output_dir, file_name)
-
-                    # 出力
-                    if self.output_flag:
-                        self.save_html(game_html, out_path)
-
-                    # dfを結合
-                    df_game_info_all = df_game_info_all.append(pd.Series(game_info), ignore_index=True)
-                    df_score_info_all = df_score_info_all.append(score_info, ignore_index=True)
-            
-            # 実行日列を追加
-            df_game_info_all["exec_datetime"] = self.exec_datetime.strftime("%Y-%m-%d %H:%M:%S")
-            df_score_info_all["exec_datetime"] = self.exec_datetime.strftime("%Y-%m-%d %H:%M:%S")
-
-            # 列順を並び変える
-            df_game_info_all = df_game_info_all[[c.name for c in self.table.lake_game.column]]
-            df_score_info_all = df_score_info_all[[c.name for c in self.table.lake_score.column]]
-
-            # 結果を出力
-            if self.output_flag:
-                self.save_csv(df=df_game_info_all, file_path=os.path.join(self.output_lake_tsv_path, "lake_game.tsv"))
-                self.save_csv(df=df_score_info_all, file_path=os.path.join(self.output_lake_tsv_path, "lake_score.tsv"))
-            else:
-                print(df_game_info_all)
-            
-            # bigqueryにテーブル作成
-            if self.upload_flg:
-                # game
-                load_to_bigquery(
-                    df_game_info_all, 
-                    project_id=self.project_id,
-                    db_name=self.table.lake_game.db_name,
-                    table_name=self.table.lake_game.table_name,
-                    schema_dict=self.table_name.lake_game.column,
-                    if_exists="append",
-                    )
+        # 出力まで終わった試合と失敗し続けた試合は除く
+        list_game_id_num = [re.search("\d+", game.get('href')).group() for game in elems_game]
+        list_game_id_num = [x for x in list_game_id_num if not self.state.is_completed(self.make_id(x))]
+        print(len(elems_game) - len(list_game_id_num), "games are already completed")
+        n_games = len(list_game_id_num)
+        list_game_id_num = [x for x in list_game_id_num if not self.state.is_failed(self.make_id(x))]
+        if len(list_game_id_num) < n_games:
+            print(n_games - len(list_game_id_num), "games are skipped after repeated failures")
+
+        # 流す前に未完了として記録し、途中で止まっても次回の開始日に含まれるようにする
+        if self.output_flag:
+            for game_id_num in list_game_id_num:
+                self.state.save_game(self.make_id(game_id_num), game_date=date, game_status="unkown", completed=False)
+            self.state.save_date(date, len(elems_game))
+
+        for game_id_num in list_game_id_num:
+            yield date, game_id_num
+
+    def fetch_game(self, item):
+        """試合トップページを取得する"""
+        date, game_id_num = item
+        game_url = self.base_url + "/game/" + game_id_num + "/top"
+        html = self.get_html(game_url)
+        if html is not None:
+            yield date, game_id_num, game_url, html
+
+    def parse_game(self, item):
+        """試合トップページから試合の情報を取り出す"""
+        date, game_id_num, game_url, html = item
+        yield date, game_id_num, html, self.get_game_info(html, game_url)
+
+    def crawl_game_score(self, item):
+        """終了した試合の速報ページを取得する。スコアはチェックポイントで出力する"""
+        date, game_id_num, html, game_info = item
+        if game_info["game_status"] == "finish":
+            self.get_score_infos(
+                [self.make_id(game_id_num)],
+                checkpoint=functools.partial(self.save_score_checkpoint, game_date=date),
+                )
+        yield item
 
-                # score
-                load_to_bigquery(
-                    df_score_info_all, 
-                    project_id=self.project_id,
-                    db_name=self.table.lake_score.db_name,
-                    table_name=self.table.lake_score.table_name,
-                    schema_dict=self.table_name.lake_score.column,
-                    if_exists="append",
+    def write_games(self, items, output_dir):
+        """パイプラインを流れてきた試合をまとめて出力する
+
+        Args:
+            items (list): (日付, 試合番号, html, 試合の情報)のリスト
+            output_dir (str): htmlの出力先のpath
+        """
+        # 実行日
+        str_datetime = self.exec_datetime.strftime("%Y%m%d%H%M%S")
+
+        game_builder = RecordBuilder(self.table.lake_game.column, capacity=len(items))
+        for date, game_id_num, html, game_info in items:
+            # 結果を保存。試合が完了しているときのみ
+            if game_info["game_status"] in ["finish", "cancel"]:
+                # file名：ゲーム日_ゲームID_ゲームステータス_実行日
+                file_name = "_".join([date, "g"+game_id_num, game_info["game_status"], str_datetime])+".html"
+                out_path = os.path.join(output_dir, file_name)
+
+                # 出力
+                if self.output_flag:
+                    self.save_html(html, out_path)
+
+                # 結果を追記
+                game_builder.append(game_info)
+
+        # dfにまとめる
+        with self.metrics.timer("frame_seconds", table="lake_game"):
+            df_game_info_all = game_builder.to_frame()
+
+        # 実行日列を追加
+        df_game_info_all["exec_datetime"] = self.exec_datetime.strftime("%Y-%m-%d %H:%M:%S")
+
+        # 列順を並び変える
+        df_game_info_all = df_game_info_all[[c.name for c in self.table.lake_game.column]]
+
+        # 結果を出力。スコアはチェックポイントで出力済み
+        if self.output_flag:
+            self.save_lake(df_game_info_all, "lake_game")
+
+            # 試合の状態を記録。before/unkownの試合は次回また確認する
+            for date, game_id_num, html, game_info in items:
+                self.state.save_game(
+                    self.make_id(game_id_num),
+                    game_date=date,
+                    game_status=game_info["game_status"],
+                    completed=game_info["game_status"] in ["finish", "cancel"],
                     )
+        else:
+            print(df_game_info_all)
 
-            print("finish ", date, "="*10)
+        # bigqueryに入れる。ローダーにためて件数か時間でまとめて書き込む。スコアはチェックポイントで追加済み
+        if self.upload_flag:
+            self.loader.append(df_game_info_all, "lake_game")
 
-            return None
+        return None
 
-    def get_score_info(self, game_id):
-        score_url_base = self.base_url + f"/game/{game_id.replace('npb', '')}/score?index="
-        param_index = "0110100"
-        score_url = score_url_base + param_index
-
-        df_score_info = pd.DataFrame()
-        game_continue = True
-        while game_continue:
-            html = self.get_html(score_url)
-            soup = bs4.BeautifulSoup(html, "html.parser")
-
-            result = {}
-            # game_id, index
-            result["game_id"] = game_id
-            result["index"] = soup.select_one("a[class='bb-gameScoreTable__score']").get("index")
-
-            # 試合進行状況を取得
-            inning_text = soup.select_one("div[id='sbo']").select_one("em").get_text(strip=True)
-            result["inning"] = inning_text[0]
-            result["top_buttom"] = "top" if inning_text[-1] == "表" else "bottom"
-
-            # 試合終了判定
-            if inning_text == "試合終了":
-                game_continue = False
+    def make_pipeline(self, stages, flush_func):
+        """設定のworkersとbatch_sizeでパイプラインを作る
+
+        Args:
+            stages (list): (ステージ名, 関数)のリスト
+            flush_func (callable): 最後のステージの出力をまとめて書き込む関数
+
+        Returns:
+            Pipeline: パイプライン
+        """
+        workers = self.pipeline_config.get("workers", {})
+
+        return Pipeline(
+            [Stage(name, func, workers=workers.get(name, 1)) for name, func in stages],
+            sink=BatchSink(flush_func, batch_size=self.pipeline_config.get("batch_size", 50)),
+            queue_size=self.pipeline_config.get("queue_size", 32),
+            metrics=self.metrics,
+            )
+
+    def get_games(self, list_date, output_dir):
+        """対象日の全試合のデータを集める
+
+        日付の一覧、試合ページの取得、パース、速報ページの取得、出力をステージに分けて流す。
+        ある日の試合の取得中に次の日の一覧を取得するので、日をまたいで並列に進む。
+
+        Args:
+            list_date (list): データ収集する日（YYYY-MM-DD）のリスト
+            output_dir (str): 出力先のpath
+        """
+        pipeline = self.make_pipeline(
+            [
+                ("discover", self.discover_games),
+                ("fetch", self.fetch_game),
+                ("parse", self.parse_game),
+                ("score", self.crawl_game_score),
+            ],
+            flush_func=functools.partial(self.write_games, output_dir=output_dir),
+            )
+        errors = pipeline.run(list_date)
+        print("finish ", len(list_date), "days", len(errors), "errors", "="*10)
+
+        # 取得以外で失敗した試合を数える。取得の失敗はdead_letterで取り直す
+        if self.output_flag:
+            for stage_name, item, error in errors:
+                if stage_name == "discover" or isinstance(error, FetchError):
+                    continue
+                game_id = self.make_id(item[1])
+                if self.state.save_game_failure(game_id, repr(error)[:1000]):
+                    print(game_id, "failed", self.state.max_failures, "times, skip it from now on")
+
+        return None
+
+    def get_score_url(self, game_id, index):
+        return self.base_url + f"/game/{game_id.replace('npb', '')}/score?index=" + index
+
+    def parse_score_page(self, html, game_id, index):
+        """速報ページから1球分の情報を取り出し、パースの時間を記録する"""
+        with self.metrics.timer("parse_seconds", extractor="score"):
+            return self.extract_score_page(html, game_id, index)
+
+    def extract_score_page(self, html, game_id, index):
+        """速報ページから1球分の情報を取り出す
+
+        Args:
+            html (str): 速報ページのhtml
+            game_id (str): ゲームID
+            index (str): 速報ページのindex
+
+        Returns:
+            tuple: (1球分の情報, 次のページのindex)。試合終了のページなら(None, None)
+        """
+        soup = bs4.BeautifulSoup(html, "html.parser")
+
+        result = {}
+        # game_id, index
+        result["game_id"] = game_id
+        result["index"] = index
+
+        # 試合進行状況を取得
+        inning_text = soup.select_one("div[id='sbo']").select_one("em").get_text(strip=True)
+        result["inning"] = inning_text[0]
+        result["top_buttom"] = "top" if inning_text[-1] == "表" else "bottom"
+
+        # 試合終了判定
+        if inning_text == "試合終了":
+            return None, None
+
+        # バッター情報を取得
+        soup_batter = soup.select_one("table[id='batt']")
+        if soup_batter is not None:
+            result["batter_id"] = self.make_id(soup_batter.select_one("a").get("href").split("/")[-2])
+            result["batter_side"] = soup_batter.select_one("td.dominantHand").get_text()
+        else:
+            # 代打のとき
+            result["batter_id"] = np.nan
+            result["batter_side"] = np.nan
+
+        # ピッチャー情報を取得
+        soup_pitcher = soup.select_one("div[id='pitcherL']")
+        if soup_pitcher is None:
+            soup_pitcher = soup.select_one("div[id='pitcherR']")
+        result["pitcher_id"] = self.make_id(soup_pitcher.select_one("a").get("href").split("/")[-2])
+        result["pitcher_side"] = soup_pitcher.select_one("td.dominantHand").get_text()
+
+        # 結果を取得
+        soup_res_main = soup.select_one("div[id='result']").select_one("span")
+        result["result_main"] = soup_res_main.get_text() if soup_res_main is not None else np.nan
+        soup_res_sub = soup.select_one("div[id='result']").select_one("em")
+        result["result_sub"] = soup_res_sub.get_text() if soup_res_sub is not None else np.nan
+
+        # 走者情報
+        for i in range(1, 4):
+            base = soup.select_one(f"div[id='base{i}']")
+            result[f"base_{i}"] = base.get("href") if base is not None else np.nan
+
+        # 次のページ
+        soup_next = soup.select_one("a[id='btn_next']")
+        next_index = soup_next.get("index") if soup_next is not None else None
+
+        return result, next_index
+
+    def get_score_info(self, game_id, start_index=None, checkpoint=None, after_index=None, live=False):
+        """速報ページをbtn_nextに従って1ページずつたどる
+
+        Args:
+            game_id (str): ゲームID
+            start_index (str): 最初に取得するページのindex。Noneなら試合の最初から
+            checkpoint (callable): checkpoint_pagesごとと最後に呼ぶ関数。
+                (game_id, 前回からの投球のDataFrame, 最後のindex, 次のindex)を受け取る
+            after_index (str): 取得済みの最後のページのindex。渡すとそのページを取り直し、
+                新しく増えた次のページからたどる
+            live (bool): 試合中か。Trueなら試合終了のページに着くまで完了にしない
+
+        Returns:
+            DataFrame: 今回取得した投球
+
+        Raises:
+            FetchError: 途中のページを取得できなかったとき。それまでの投球は出力し、次回はそのページから取得する
+        """
+        param_index = start_index if start_index is not None else SCORE_FIRST_INDEX
+        last_index = None
+        ended = False
+
+        # 取得済みの最後のページに次のページへのリンクが増えたか
+        if after_index is not None:
+            html = self.get_html(self.get_score_url(game_id, after_index), use_cache=False)
+            if html is None:
+                raise FetchError(self.get_score_url(game_id, after_index))
+            result, param_index = self.parse_score_page(html, game_id, after_index)
+            last_index = after_index
+            ended = result is None
+
+        score_builder = RecordBuilder(self.table.lake_score.column)
+        checkpoint_builder = RecordBuilder(self.table.lake_score.column)
+        while param_index is not None and not ended:
+            # 試合中は最後のページが変わるのでキャッシュを使わない
+            html = self.get_html(self.get_score_url(game_id, param_index), use_cache=not live)
+            if html is None:
+                if checkpoint is not None:
+                    checkpoint(game_id, checkpoint_builder.to_frame(), last_index, param_index)
+                raise FetchError(self.get_score_url(game_id, param_index))
+            result, next_index = self.parse_score_page(html, game_id, param_index)
+
+            # 試合終了
+            if result is None:
+                ended = True
                 break
 
-            # バッター情報を取得
-            soup_batter = soup.select_one("table[id='batt']")
-            if soup_batter is not None:
-                result["batter_id"] = self.make_id(soup_batter.select_one("a").get("href").split("/")[-2])
-                result["batter_side"] = soup_batter.select_one("td.dominantHand").get_text()
+            # 結果を追記
+            score_builder.append(result)
+            checkpoint_builder.append(result)
+            last_index, param_index = param_index, next_index
+
+            # 途中経過を出力
+            if checkpoint is not None and len(checkpoint_builder) >= self.checkpoint_pages:
+                checkpoint(game_id, checkpoint_builder.to_frame(), last_index, param_index)
+                checkpoint_builder.clear()
+
+        if checkpoint is not None:
+            checkpoint(game_id, checkpoint_builder.to_frame(), last_index, None, completed=ended or not live)
+
+        with self.metrics.timer("frame_seconds", table="lake_score"):
+            return score_builder.to_frame()
+
+    def get_score_infos(self, list_game_id, checkpoint=None):
+        """複数試合の速報ページを取得する。設定に応じて回ごとに並列に取得する
+
+        途中まで出力済みの試合は、記録されたindexの続きから1ページずつたどる。
+
+        Args:
+            list_game_id (list): ゲームIDのリスト
+            checkpoint (callable): get_score_infoのcheckpointと同じ
+
+        Returns:
+            dict: ゲームIDから今回取得した投球のDataFrameへの辞書
+
+        Raises:
+            FetchError: 回ごとに並列に取得した試合のどれかを取得できなかったとき。取得できた試合は出力済み
+        """
+        dict_score_info = {}
+        list_game_id_crawl = []
+        for game_id in list_game_id:
+            progress = self.state.get_game(game_id)
+            if progress is not None and progress["score_completed"] == 1:
+                continue
+            elif progress is not None and progress["next_index"] is not None:
+                dict_score_info[game_id] = self.get_score_info(game_id, start_index=progress["next_index"], checkpoint=checkpoint)
+            elif progress is not None and progress["last_index"] is not None:
+                # 試合中に途中まで取得した試合
+                dict_score_info[game_id] = self.get_score_info(game_id, after_index=progress["last_index"], checkpoint=checkpoint)
+            elif self.score_crawler is None:
+                dict_score_info[game_id] = self.get_score_info(game_id, checkpoint=checkpoint)
             else:
-                # 代打のとき
-                result["batter_id"] = np.nan
-                result["batter_side"] = np.nan
-
-            # ピッチャー情報を取得
-            soup_pitcher = soup.select_one("div[id='pitcherL']")
-            if soup_pitcher is None:
-                soup_pitcher = soup.select_one("div[id='pitcherR']")
-            result["pitcher_id"] = self.make_id(soup_pitcher.select_one("a").get("href").split("/")[-2])
-            result["pitcher_side"] = soup_pitcher.select_one("td.dominantHand").get_text()
-
-            # 結果を取得
-            soup_res_main = soup.select_one("div[id='result']").select_one("span")
-            result["result_main"] = soup_res_main.get_text() if soup_res_main is not None else np.nan
-            soup_res_sub = soup.select_one("div[id='result']").select_one("em")
-            result["result_sub"] = soup_res_sub.get_text() if soup_res_sub is not None else np.nan
-
-            # 走者情報
-            for i in range(1, 4):
-                base = soup.select_one(f"div[id='base{i}']")
-                result[f"base_{i}"] = base.get("href") if base is not None else np.nan
-
-            # dfを結合
-            df_score_info = df_score_info.append(pd.Series(result), ignore_index=True)
-
-            # 次のループへ
-            param_index = soup.select_one("a[id='btn_next']").get("index") # indexを上書き
-            score_url = score_url_base + param_index # urlを上書き
-        
-        return df_score_info
+                list_game_id_crawl.append(game_id)
+
+        if len(list_game_id_crawl) > 0:
+            dict_crawled, dict_error = self.score_crawler.crawl_many(list_game_id_crawl)
+            for game_id, df_score_info in dict_crawled.items():
+                dict_score_info[game_id] = df_score_info
+                if checkpoint is not None:
+                    checkpoint(game_id, df_score_info, None, None)
+
+            # 取得できた試合を出力してから、取得できなかった試合を知らせる。次回は最初から取り直す
+            for game_id, error in dict_error.items():
+                print("score crawl failed", game_id, repr(error))
+            if len(dict_error) > 0:
+                raise next(iter(dict_error.values()))
+
+        return dict_score_info
+
+    def save_score_checkpoint(self, game_id, df_score_info, last_index, next_index, game_date=None, completed=None):
+        """速報ページの取得結果を出力し、どこまで出力したかを記録する
+
+        Args:
+            game_id (str): ゲームID
+            df_score_info (DataFrame): 前回の出力からの投球
+            last_index (str): 出力した最後のページのindex
+            next_index (str): 次に取得するページのindex。最後まで取得したならNone
+            game_date (str): 試合日
+            completed (bool): 最後まで取得したか。Noneならnext_indexがNoneかで判定する
+        """
+        df_score_info = df_score_info.copy()
+        df_score_info["exec_datetime"] = self.exec_datetime.strftime("%Y-%m-%d %H:%M:%S")
+        df_score_info = df_score_info[[c.name for c in self.table.lake_score.column]]
+
+        if self.upload_flag:
+            self.loader.append(df_score_info, "lake_score")
+
+        if self.output_flag:
+            self.save_lake(df_score_info, "lake_score", game_date=game_date)
+            self.state.save_score_progress(game_id, last_index, next_index, completed=next_index is None if completed is None else completed)
+
+        return None
 
     def get_player_info(self, html):
 
@@ -428,65 +599,252 @@ class ScrapingSponavi(ScrapingBase):
 
         return result
     
+    def fetch_roster(self, item):
+        """チームの選手一覧ページから選手の番号を流す"""
+        team_id, players_url = item
+        html = self.get_html(players_url)
+        if html is None:
+            return
+        soup = bs4.BeautifulSoup(html, "html.parser")
+        list_players_pre = soup.select("td[class='bb-playerTable__data bb-playerTable__data--player']")
+        list_player_num = [x.select_one("a").get("href").split("/")[-2] for x in list_players_pre]
+        if len(list_player_num) > 0:
+            self.player_dim.add_roster(players_url)
+        for player_num in list_player_num:
+            yield team_id, player_num
+
+    def plan_player(self, item):
+        """前回のlake_playerと比べて、選手ページを取得する選手だけ流す"""
+        team_id, player_num = item
+        reason = self.player_dim.plan(self.make_id(player_num), team_id, self.exec_datetime.date())
+        if reason is not None:
+            yield team_id, player_num, reason
+
+    def fetch_player(self, item):
+        """選手ページを取得してパースし、前回から変わった選手だけ流す"""
+        team_id, player_num, reason = item
+        # 新しい選手と所属が変わった選手は取り直す。確認し直すだけならキャッシュで再検証する
+        html = self.get_html(self.base_url + f"/player/{player_num}/top", use_cache=reason == "stale")
+        if html is None:
+            return
+        with self.metrics.timer("parse_seconds", extractor="player"):
+            result = self.get_player_info(html)
+        result["player_id"] = self.make_id(player_num)
+        result["team_id"] = team_id
+        result["valid_from"] = self.exec_datetime.strftime("%Y-%m-%d")
+        result["profile_hash"] = make_profile_hash(result, self.table.lake_player.column)
+
+        if self.player_dim.is_changed(result):
+            yield result
+        elif self.output_flag:
+            self.state.save_player(result["player_id"], team_id)
+
+    def write_players(self, items):
+        """パイプラインを流れてきた選手の新しい版をまとめて出力する
+
+        Args:
+            items (list): 選手の情報の辞書のリスト
+        """
+        player_builder = RecordBuilder(self.table.lake_player.column, capacity=len(items))
+        player_builder.extend(items)
+
+        with self.metrics.timer("frame_seconds", table="lake_player"):
+            df_player_info = player_builder.to_frame()
+        df_player_info["exec_datetime"] = self.exec_datetime.strftime("%Y-%m-%d %H:%M:%S")
+        df_player_info = df_player_info[[c.name for c in self.table.lake_player.column]]
+
+        self.save_lake(df_player_info, "lake_player", game_date=self.exec_datetime.strftime("%Y-%m-%d"))
+        if self.upload_flag:
+            self.loader.append(df_player_info, "lake_player")
+
+        # 出力した選手を確認済みにする
+        if self.output_flag:
+            for item in items:
+                self.state.save_player(item["player_id"], item["team_id"])
+
+        return None
+
     def get_players(self):
-        df_player_info = pd.DataFrame()
-        # チームの選手ページをループ
+        """選手のディメンションを更新する
+
+        選手一覧のページを前回のlake_playerと比べ、新しい選手、所属が変わった選手、
+        確認し直す時期の選手だけ選手ページを取得する。プロフィールか所属が変わった選手だけ
+        valid_fromを実行日にした新しい版をlake_playerに追加する。すべての名簿を読めたら、
+        どの名簿にもいなかった選手を閉じる版を追加する。
+        """
+        self.player_dim = PlayerDimension.from_lake(
+            self.read_lake("lake_player"),
+            checked=self.state.get_player_checked(),
+            revalidate_days=self.player_crawl.get("revalidate_days", 30),
+            )
+
+        # チームの選手一覧ページ
+        list_players_url = []
         for team in self.team_list:
             for kind in ["p", "b"]:
                 team_info = self.team_dict[team]
-                players_url = self.base_url + "/teams/" + team_info.team_id.replace("npb", "") + f"/memberlist?kind={kind}"
-                players_html = self.get_html(players_url)
-                soup = bs4.BeautifulSoup(players_html, "html.parser")
-                list_players_pre = soup.select("td[class='bb-playerTable__data bb-playerTable__data--player']")
-                list_players = [x.select_one("a").get("href").split("/")[-2] for x in list_players_pre]
-
-                # 順に選手情報を取得
-                for player_num in list_players:
-                    player_url = f"https://baseball.yahoo.co.jp/npb/player/{player_num}/top"
-                    player_html = self.get_html(player_url)
-                    result = self.get_player_info(player_html)
-                    result["player_id"] = self.make_id(player_num)
-
-                    # dfを結合
-                    df_player_info = df_player_info.append(pd.Series(result), ignore_index=True)
+                list_players_url.append((team_info.team_id, self.base_url + "/teams/" + team_info.team_id.replace("npb", "") + f"/memberlist?kind={kind}"))
+
+        # 選手一覧、取得する選手の判定、選手ページの取得、出力をステージに分けて流す
+        pipeline = self.make_pipeline(
+            [
+                ("roster", self.fetch_roster),
+                ("plan", self.plan_player),
+                ("player", self.fetch_player),
+            ],
+            flush_func=self.write_players,
+            )
+        errors = pipeline.run(list_players_url)
+
+        # すべての名簿を読めたときだけ、どの名簿にもいなかった選手の版を閉じる
+        if len(self.player_dim.rosters) == len(list_players_url):
+            closed = self.player_dim.close_unseen(self.exec_datetime.date())
+            if len(closed) > 0:
+                self.write_players(closed)
+        else:
+            print("skip closing players", len(list_players_url) - len(self.player_dim.rosters), "rosters not read")
+        print("players", dict(self.player_dim.counts))
+        print("finish players", len(errors), "errors")
 
-        df_player_info["exec_datetime"] = self.exec_datetime.strftime("%Y-%m-%d %H:%M:%S")
-        df_player_info = df_player_info[[c.name for c in self.table.lake_player.column]]
+        return None
 
-        self.save_csv(df_player_info, file_path=os.path.join(self.output_lake_tsv_path, "lake_player.tsv"))
+
+    def get_player_score(self):
+        """チームの選手一覧ページから選手ごとの今季成績を集めて、実行日のスナップショットとして出力する"""
+        # 打者と投手の選手一覧ページをまとめて取得
+        dict_url = {}
+        for team in self.team_list:
+            team_info = self.team_dict[team]
+            for kind, table_name in [("b", "lake_player_batting"), ("p", "lake_player_pitching")]:
+                url = self.base_url + "/teams/" + team_info.team_id.replace("npb", "") + f"/memberlist?kind={kind}"
+                dict_url[url] = (team_info.team_id, table_name)
+
+        dict_list_df = {"lake_player_batting": [], "lake_player_pitching": []}
+        for url, html in self.get_htmls(list(dict_url)):
+            if html is None:
+                continue
+            team_id, table_name = dict_url[url]
+            with self.metrics.timer("parse_seconds", extractor="stats"):
+                dict_list_df[table_name].append(self.stats_extractors[table_name].extract(html, team_id))
+
+        snapshot_date = self.exec_datetime.strftime("%Y-%m-%d")
+        for table_name, list_df in dict_list_df.items():
+            if len(list_df) == 0:
+                continue
+            df = pd.concat(list_df, ignore_index=True)
+            df["snapshot_date"] = snapshot_date
+            df["exec_datetime"] = self.exec_datetime.strftime("%Y-%m-%d %H:%M:%S")
+            df = df[[c.name for c in self.table[table_name].column]]
+
+            unknown_headers = self.stats_extractors[table_name].unknown_headers
+            if len(unknown_headers) > 0:
+                print(table_name, "unknown columns", sorted(unknown_headers))
+
+            if self.output_flag:
+                self.save_lake(df, table_name, game_date=snapshot_date)
+            else:
+                print(df)
+            if self.upload_flag:
+                self.loader.append(df, table_name)
 
         return None
 
+    def retry_dead_letters(self):
+        """前回までに取得できなかったページを取り直す
 
-    def get_player_score():
-        pb_params = ["p", "b"]
-        df_all = pd.DataFrame() 
-        for team in ss.team_list:
-            for pb in pb_params:
-                target_url = ss.base_url + "/teams/" + str(ss.team_dict[team].id) + "/memberlist?kind=" + pb
-                html = ss.get_html(target_url)
-                soup = bs4.BeautifulSoup(html, "html.parser")
-                tb = soup.find_all('table')[0] 
-                df = pd.read_html(str(tb),encoding='utf-8', header=0)[0]
-                df = df.drop(len(df)-1) # 最終行を削除
-                df['player_id'] = [ss.make_id(row.select_one("a").get("href").split("/")[-2]) for row in tb.select("tr[class='bb-playerTable__row']")]
-                df[df == "-"] = np.nan
-                df_all = df_all.append(df)
+        取得できたページはキャッシュに入り、未完了の試合や日付として続きの取得で使われる。
+        """
+        urls = [x["url"] for x in self.state.get_dead_letters()]
+        if len(urls) == 0:
+            return None
 
-        return df_all
+        print("retry", len(urls), "dead letters")
+        n_recovered = 0
+        for url, html in self.get_htmls(urls, use_cache=False):
+            if html is not None:
+                self.state.delete_dead_letter(url)
+                n_recovered += 1
+        print(n_recovered, "recovered,", len(urls) - n_recovered, "still failing")
+
+        return None
 
     def exec_score_scraping(self):
         list_date = pd.date_range(start=self.start_date, end=self.end_date)
-        for date in list_date:
+        self.calendar.report_uncovered(list_date)
+        try:
             self.get_games(
-                date=date.strftime("%Y-%m-%d"), 
+                list_date=[date.strftime("%Y-%m-%d") for date in list_date],
                 output_dir=self.output_game_html_path
                 )
+        finally:
+            # 途中で止まっても出力済みの分はbigqueryに書き込む
+            if self.upload_flag:
+                self.loader.flush()
         
         return None
 
+    def exec_live_scraping(self):
+        """当日の試合を試合が終わるまで確認し、新しく増えた速報ページだけを出力する"""
+        LivePoller.from_config(self, self.live_config).run(self.exec_datetime.strftime("%Y-%m-%d"))
+
+        return None
+
+    def exec_datamart(self):
+        """lakeのまだ集計していない試合をdatamartに足し込む"""
+        datamart = Datamart(self.datamart_path, calendar=self.calendar, team_dict=self.team_dict)
+        df_game = self.read_lake("lake_game")
+        if df_game is None:
+            return None
+
+        new_ids = datamart.new_game_ids(df_game)
+        df_score = self.read_lake("lake_score", columns=SCORE_COLUMNS + ["index"], game_ids=new_ids) if len(new_ids) > 0 else None
+        n_games = datamart.update(df_game, df_score)
+        datamart.save()
+        print("datamart", n_games, "new games")
+
+        # 得点期待値とRE24は集計済みの試合を別に持つので、datamartとは別に差分を読む
+        run_expectancy = RunExpectancy(os.path.join(self.datamart_path, "run_expectancy"))
+        new_ids = run_expectancy.new_game_ids(df_game)
+        if len(new_ids) > 0:
+            df_score = self.read_lake("lake_score", columns=RE_SCORE_COLUMNS, game_ids=new_ids)
+            n_games = run_expectancy.update(df_game, df_score) if df_score is not None else 0
+            run_expectancy.save()
+            print("run expectancy", n_games, "new games")
+
+        return None
+
+    def exec_event_store(self):
+        """lakeのまだ追記していない終了した試合の速報ページの行をイベントストアに追記する"""
+        df_game = self.read_lake("lake_game", columns=["game_id", "game_status"])
+        if df_game is None:
+            return None
+
+        event_store = EventStore(self.event_store_path)
+        new_ids = event_store.new_game_ids(df_game)
+        df_score = self.read_lake("lake_score", game_ids=new_ids) if len(new_ids) > 0 else None
+        n_rows = event_store.append(df_score) if df_score is not None else 0
+        print("event store", len(new_ids), "new games", n_rows, "rows", len(event_store), "total rows")
+
+        return None
+
+    def exec_query_sync(self):
+        """lakeの新しい試合と選手をローカルの検索用のSQLiteに入れる"""
+        counts = LakeQuery(self.query_db_path, self.table).sync(self.read_lake)
+        print("query db", counts)
+
+        return None
+
+    def exec_player_score_scraping(self):
+        self.get_player_score()
+        if self.upload_flag:
+            self.loader.flush()
+
+        return None
+
     def exec_player_scraping(self):
         self.get_players()
+        if self.upload_flag:
+            self.loader.flush()
         
         return None
 
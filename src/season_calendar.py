@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+
+def to_days(dates):
+    """日付（文字列、datetime、Series）を日単位のdatetime64の配列にする"""
+    return pd.to_datetime(pd.Series(np.atleast_1d(dates)).reset_index(drop=True)).values.astype("datetime64[D]")
+
+
+def to_ranges(days):
+    """日付の配列を連続した区間にまとめる
+
+    Args:
+        days (ndarray): 昇順で重複のない日単位のdatetime64の配列
+
+    Returns:
+        list: (開始日, 終了日)の文字列のリスト
+    """
+    if len(days) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(days) != np.timedelta64(1, "D"))
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(days) - 1]])
+
+    return [(str(days[s]), str(days[e])) for s, e in zip(starts, ends)]
+
+
+class SeasonCalendar():
+    """config_schedule.yamlの全シーズンの期間を、重ならない区間の昇順の配列にまとめる
+
+    日付から試合の種類をsearchsortedで引く。期間が重なる日は、同じシーズン内で
+    先に書かれている種類（pre_season_match, pennant_race, climax_series, nihon_seriesの順）にする。
+
+    Args:
+        schedule (DictConfig): config_schedule.yamlのschedule
+    """
+    def __init__(self, schedule):
+        intervals = []
+        for year_key in schedule:
+            for series, period in schedule[year_key].items():
+                start = np.datetime64(str(period.start_date), "D")
+                end = np.datetime64(str(period.end_date), "D")
+                for piece in self.subtract(start, end, intervals):
+                    intervals.append(piece + (series,))
+        intervals.sort()
+
+        self.starts = np.array([x[0] for x in intervals], dtype="datetime64[D]")
+        self.ends = np.array([x[1] for x in intervals], dtype="datetime64[D]")
+        self.series = np.array([x[2] for x in intervals] + [None], dtype=object)
+        self.years = sorted({int(str(x[0])[:4]) for x in intervals})
+
+    @staticmethod
+    def subtract(start, end, intervals):
+        """[start, end]のうち、登録済みの区間と重ならない部分を返す"""
+        pieces = [(start, end)]
+        for other_start, other_end, _ in intervals:
+            rest = []
+            for a, b in pieces:
+                if other_end < a or other_start > b:
+                    rest.append((a, b))
+                    continue
+                if a < other_start:
+                    rest.append((a, other_start - np.timedelta64(1, "D")))
+                if b > other_end:
+                    rest.append((other_end + np.timedelta64(1, "D"), b))
+            pieces = rest
+
+        return pieces
+
+    def lookup(self, days):
+        """日付ごとに区間の位置を求める。どの区間にも入らなければ区間の数"""
+        i = np.searchsorted(self.starts, days, side="right") - 1
+        covered = (i >= 0) & (days <= self.ends[np.maximum(i, 0)]) if len(self.starts) > 0 else np.zeros(len(days), dtype=bool)
+
+        return np.where(covered, i, len(self.starts))
+
+    def get_series(self, date):
+        """日付から試合の種類を判定する
+
+        Args:
+            date (str): 日付（YYYY-MM-DD）
+
+        Returns:
+            str: pre_season_match, pennant_race, climax_series, nihon_seriesのいずれか。期間外ならNone
+        """
+        return self.series[self.lookup(to_days(date))[0]]
+
+    def classify(self, dates):
+        """日付の列をまとめて試合の種類にする
+
+        Args:
+            dates (Series): 日付の列
+
+        Returns:
+            ndarray: 試合の種類。期間外はNone
+        """
+        return self.series[self.lookup(to_days(dates))]
+
+    def uncovered(self, dates):
+        """どの期間にも入らない日付を求める
+
+        Args:
+            dates (list): 日付のリスト
+
+        Returns:
+            list: 期間外の日付の連続した区間の(開始日, 終了日)のリスト
+        """
+        days = np.unique(to_days(dates))
+
+        return to_ranges(days[self.lookup(days) == len(self.starts)])
+
+    def missing_years(self, dates):
+        """config_schedule.yamlにない年を求める
+
+        Args:
+            dates (list): 日付のリスト
+
+        Returns:
+            list: 年の昇順のリスト
+        """
+        years = sorted({int(str(x)[:4]) for x in np.unique(to_days(dates))})
+
+        return [y for y in years if y not in self.years]
+
+    def report_uncovered(self, dates):
+        """期間外の日付とconfig_schedule.yamlにない年を表示する
+
+        Args:
+            dates (list): 日付のリスト
+
+        Returns:
+            list: uncoveredと同じ
+        """
+        ranges = self.uncovered(dates)
+        if len(ranges) == 0:
+            return ranges
+
+        missing_years = self.missing_years(dates)
+        if len(missing_years) > 0:
+            print("years not in config_schedule.yaml:", missing_years)
+        print("dates not in the season calendar (game_series is null):", ", ".join(s if s == e else f"{s}..{e}" for s, e in ranges))
+
+        return ranges
@@ -0,0 +1,275 @@
+import datetime
+import os
+import sqlite3
+import threading
+
+
+class ScrapingState():
+    """スクレイピングの進捗をSQLiteに記録する
+
+    試合ごとにステータスと速報ページの取得位置を、日付ごとに取得済みかを持つ。
+    finish/cancelで出力まで終わった試合はcompletedになり、次回以降はスキップする。
+    パースなどで失敗し続けた試合はmax_failures回でfailedにし、次回以降はスキップして開始日にも含めない。
+    取り直しても取得できなかったURLはdead_letterに残し、次回の実行で取り直す。
+
+    Args:
+        db_path (str): SQLiteのファイルのpath
+        max_failures (int): 試合をfailedにするまでの失敗の回数
+    """
+    def __init__(self, db_path, max_failures=3):
+        self.max_failures = max_failures
+        if os.path.dirname(db_path) != "":
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS game (
+                    game_id TEXT PRIMARY KEY,
+                    game_date TEXT,
+                    game_status TEXT,
+                    last_index TEXT,
+                    next_index TEXT,
+                    score_completed INTEGER NOT NULL DEFAULT 0,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    updated_at TEXT
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS date (
+                    game_date TEXT PRIMARY KEY,
+                    game_num INTEGER,
+                    updated_at TEXT
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS player (
+                    player_id TEXT PRIMARY KEY,
+                    team_id TEXT,
+                    checked_at TEXT
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letter (
+                    url TEXT PRIMARY KEY,
+                    reason TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 1,
+                    updated_at TEXT
+                )
+            """)
+
+    def now(self):
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def get_game(self, game_id):
+        """試合の進捗を取得する
+
+        Args:
+            game_id (str): ゲームID
+
+        Returns:
+            dict: 試合の進捗。記録がなければNone
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM game WHERE game_id = ?", (game_id,)).fetchone()
+
+        return dict(row) if row is not None else None
+
+    def is_completed(self, game_id):
+        game = self.get_game(game_id)
+
+        return game is not None and game["completed"] == 1
+
+    def is_failed(self, game_id):
+        game = self.get_game(game_id)
+
+        return game is not None and game["game_status"] == "failed"
+
+    def save_game(self, game_id, game_date, game_status, completed):
+        """試合のステータスを記録する
+
+        Args:
+            game_id (str): ゲームID
+            game_date (str): 試合日
+            game_status (str): finish, cancel, before, unkownのいずれか
+            completed (bool): 出力まで終わったか
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO game (game_id, game_date, game_status, completed, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(game_id) DO UPDATE SET
+                    game_date = excluded.game_date,
+                    game_status = excluded.game_status,
+                    completed = excluded.completed,
+                    updated_at = excluded.updated_at
+            """, (game_id, game_date, game_status, int(completed), self.now()))
+
+        return None
+
+    def save_game_failure(self, game_id, error):
+        """試合の処理に失敗したことを記録する。max_failures回目でfailedにする
+
+        Args:
+            game_id (str): ゲームID
+            error (str): 失敗の理由
+
+        Returns:
+            bool: failedにしたか
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO game (game_id, failures, last_error, updated_at) VALUES (?, 1, ?, ?)
+                ON CONFLICT(game_id) DO UPDATE SET
+                    failures = game.failures + 1,
+                    last_error = excluded.last_error,
+                    updated_at = excluded.updated_at
+            """, (game_id, error, self.now()))
+            failed = self.conn.execute("""
+                UPDATE game SET game_status = 'failed' WHERE game_id = ? AND failures >= ? AND completed = 0
+            """, (game_id, self.max_failures)).rowcount > 0
+
+        return failed
+
+    def save_score_progress(self, game_id, last_index, next_index, completed):
+        """速報ページをどこまで出力したかを記録する
+
+        Args:
+            game_id (str): ゲームID
+            last_index (str): 出力した最後のページのindex
+            next_index (str): 次に取得するページのindex
+            completed (bool): 最後まで出力したか
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO game (game_id, last_index, next_index, score_completed, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(game_id) DO UPDATE SET
+                    last_index = COALESCE(excluded.last_index, game.last_index),
+                    next_index = excluded.next_index,
+                    score_completed = excluded.score_completed,
+                    updated_at = excluded.updated_at
+            """, (game_id, last_index, next_index, int(completed), self.now()))
+
+        return None
+
+    def save_date(self, game_date, game_num):
+        """日付を取得済みとして記録する
+
+        Args:
+            game_date (str): 日付
+            game_num (int): その日の試合数
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO date (game_date, game_num, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(game_date) DO UPDATE SET
+                    game_num = excluded.game_num,
+                    updated_at = excluded.updated_at
+            """, (game_date, game_num, self.now()))
+
+        return None
+
+    def get_dates(self):
+        """取得済みの日付とその日の試合数
+
+        Returns:
+            dict: 日付から試合数への辞書
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT game_date, game_num FROM date ORDER BY game_date").fetchall()
+
+        return {row["game_date"]: row["game_num"] for row in rows}
+
+    def get_player_checked(self):
+        """選手ごとに最後に選手ページを確認した日時を取得する
+
+        Returns:
+            dict: 選手IDから確認日時（YYYY-mm-dd HH:MM:SS）への辞書
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT player_id, checked_at FROM player").fetchall()
+
+        return {row["player_id"]: row["checked_at"] for row in rows}
+
+    def save_player(self, player_id, team_id):
+        """選手ページを確認したことを記録する
+
+        Args:
+            player_id (str): 選手ID
+            team_id (str): 確認したときの所属チームのID
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO player (player_id, team_id, checked_at) VALUES (?, ?, ?)
+                ON CONFLICT(player_id) DO UPDATE SET
+                    team_id = excluded.team_id,
+                    checked_at = excluded.checked_at
+            """, (player_id, team_id, self.now()))
+
+        return None
+
+    def save_dead_letter(self, url, reason):
+        """取得できなかったURLを記録する
+
+        Args:
+            url (str): URL
+            reason (str): 最後に失敗した理由（ステータスコードや例外名）
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO dead_letter (url, reason, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    reason = excluded.reason,
+                    attempts = dead_letter.attempts + 1,
+                    updated_at = excluded.updated_at
+            """, (url, reason, self.now()))
+
+        return None
+
+    def get_dead_letters(self):
+        """取得できなかったURLの一覧
+
+        Returns:
+            list: url, reason, attempts, updated_atの辞書のリスト
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM dead_letter ORDER BY updated_at").fetchall()
+
+        return [dict(row) for row in rows]
+
+    def delete_dead_letter(self, url):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM dead_letter WHERE url = ?", (url,))
+
+        return None
+
+    def get_resume_date(self):
+        """前回の続きから取得するときの開始日を求める
+
+        未完了（before/unkownや途中で止まった試合。failedは除く）がある最も古い日、
+        ゲーム一覧ページを取得できなかった最も古い日、取得済みの最後の日の翌日のうち最も早い日。
+
+        Returns:
+            str: 開始日。記録がなければNone
+        """
+        with self.lock:
+            pending = self.conn.execute("""
+                SELECT MIN(game_date) FROM game WHERE completed = 0 AND game_status IS NOT 'failed' AND game_date IS NOT NULL
+            """).fetchone()[0]
+            last = self.conn.execute("SELECT MAX(game_date) FROM date").fetchone()[0]
+            failed = self.conn.execute("""
+                SELECT MIN(substr(url, instr(url, 'date=') + 5, 10)) FROM dead_letter WHERE url LIKE '%/schedule/?date=%'
+            """).fetchone()[0]
+
+        candidates = []
+        for date in [pending, failed]:
+            if date is not None:
+                candidates.append(date)
+        if last is not None:
+            next_date = datetime.datetime.strptime(last, "%Y-%m-%d") + datetime.timedelta(days=1)
+            candidates.append(next_date.strftime("%Y-%m-%d"))
+
+        return min(candidates) if len(candidates) > 0 else None
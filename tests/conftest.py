@@ -0,0 +1,15 @@
+import pytest
+
+from src.scraping import ScrapingSponavi
+
+from .utils import load_config
+
+
+@pytest.fixture
+def scraper(tmp_path):
+    """出力もアップロードもせず、状態DBを一時ディレクトリに置くスクレイパー"""
+    config = load_config()
+    config.path_state_db = str(tmp_path / "state.sqlite")
+    ss = ScrapingSponavi(config=config, start_date=None, end_date=None)
+    yield ss
+    ss.fetch_engine.close()
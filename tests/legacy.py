@@ -0,0 +1,119 @@
+"""lxml版の抽出と比べるための、BeautifulSoup版の試合トップページの抽出
+
+tests/test_extractor.pyの一致の確認とbenchmark/bench_extractor.pyの比較で使う。
+"""
+import datetime
+
+import bs4
+import numpy as np
+
+
+def legacy_get_game_info(ss, html, url):
+    """BeautifulSoup(html.parser)で実装していた頃のScrapingSponavi.get_game_info"""
+    soup = bs4.BeautifulSoup(html, "html.parser")
+
+    # 結果を格納する辞書
+    result = {}
+
+    # ゲームID
+    result["game_id"] = "npb" + url.split("/")[-2]
+
+    # 日付
+    game_date = soup.select_one("title").get_text().split(" ")[0]
+    result["game_date"] = datetime.datetime.strptime(game_date, "%Y年%m月%d日").strftime("%Y-%m-%d")
+
+    # ステータス
+    state_original = soup.select_one('span.bb-gameCard__state').get_text(strip=True)
+    if state_original=="試合終了":
+        result["game_status"] = "finish"
+    elif state_original == "試合中止":
+        result["game_status"] = "cancel"
+        return result
+    elif state_original == "試合前":
+        result["game_status"] = "before"
+        return result
+    else:
+        result["game_status"] = "unkown"
+        return result
+
+    # ゲームのタイプを判定（オープン戦、ペナント、CS、日シリ）
+    result["game_series"] = ss.get_game_series(result["game_date"])
+
+    # 球場
+    description = soup.select_one("p[class='bb-gameDescription']")
+    result["team_top_name"] = description.get_text().split("\n")[3].replace(" ","")
+
+    # 試合開始時間
+    description = soup.select_one("p[class='bb-gameDescription']")
+    result["game_start_time"] = description.get_text().split("\n")[2].replace(" ","")
+
+    # チーム名
+    teams = [x.get_text(strip=True) for x in soup.select("a.bb-gameScoreTable__team")]
+    result["team_top_name"] = teams[0]
+    result["team_bottom_name"] = teams[1]
+    result["team_top_id"] = ss.team_dict[teams[0]].team_id
+    result["team_bottom_id"] = ss.team_dict[teams[1]].team_id
+
+    # 合計点
+    scores = [x.get_text(strip=True) for x in soup.select("td[class='bb-gameScoreTable__total']")]
+    result["score_top"] = scores[0]
+    result["score_bottom"] = scores[1]
+
+    # 勝敗
+    if result["score_top"] > result["score_bottom"]:
+        result["game_result"] = "top_win"
+    elif result["score_top"] < result["score_bottom"]:
+        result["game_result"] = "bottom_win"
+    elif result["score_top"] == result["score_bottom"]:
+        result["game_result"] = "drow"
+
+    # 安打数
+    hits = [x.get_text(strip=True) for x in soup.select("td[class='bb-gameScoreTable__total bb-gameScoreTable__data--hits']")]
+    result["hit_top"] = hits[0]
+    result["hit_bottom"] = hits[1]
+
+    # 失策数
+    hits = [x.get_text(strip=True) for x in soup.select("td[class='bb-gameScoreTable__total bb-gameScoreTable__data--loss']")]
+    result["error_top"] = hits[0]
+    result["error_bottom"] = hits[1]
+
+    # 責任投手
+    try:
+        soup_pick = soup.select_one("section[id='pit_rec']")
+        pitchers = [x for x in soup_pick.select("td.bb-gameTable__data")]
+        list_pitcher_ids = []
+        for pitcher in pitchers:
+            if pitcher.get_text(strip=True) != "":
+                pitcher_url = pitcher.select_one("a[class='bb-gameTable__player']")
+                list_pitcher_ids.append(ss.make_id(pitcher_url.get("href").split("/")[-2]))
+            else:
+                list_pitcher_ids.append(np.nan)
+        result["picher_win_id"] = list_pitcher_ids[0]
+        result["picher_lose_id"] = list_pitcher_ids[1]
+        result["picher_save_id"] = list_pitcher_ids[2]
+    except:
+        pass # 引き分け
+
+    # 先発ピッチャー
+    soup_pick = soup.select_one("section[id='strt_mem']")
+    soup_target_tables = [x for x in soup_pick.select("table.bb-splitsTable")]
+    soup_pitcher_top = soup_target_tables[0].select_one("a")
+    soup_pitcher_bottom = soup_target_tables[2].select_one("a")
+    result["starting_picher_top_id"] = ss.make_id(soup_pitcher_top.get("href").split("/")[-2])
+    result["starting_picher_bottom_id"] = ss.make_id(soup_pitcher_bottom.get("href").split("/")[-2])
+
+    # 審判
+    soup_pick = soup.select("section[class='bb-modCommon01']")[-2]
+    data = [x.get_text(strip=True) for x in soup_pick.select("td.bb-tableLeft__data")]
+    result["umpire_plate"] = data[0]
+    result["umpire_first"] = data[1]
+    result["umpire_second"] = data[2]
+    result["umpire_third"] = data[3]
+
+    # 観客数/試合時間
+    soup_pick = soup.select("section[class='bb-modCommon01']")[-1]
+    data = [x.get_text(strip=True) for x in soup_pick.select("td.bb-tableLeft__data")]
+    result["audience_num"] = data[0]
+    result["game_time"] = data[1]
+
+    return result
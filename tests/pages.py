@@ -0,0 +1,153 @@
+"""テスト、ベンチマークとシミュレーション用の合成ページ
+
+試合トップページ、速報ページ、ゲーム一覧ページを、パーサーが読む要素だけで組み立てる。
+"""
+
+# 試合終了のページのindex
+END_INDEX = "9999999"
+
+GAME_STATES = {
+    "before": "試合前",
+    "live": "1回表",
+    "finish": "試合終了",
+    "cancel": "試合中止",
+}
+
+
+def score_indexes(n_innings=9, n_batters=4):
+    """半イニングごとにn_batters打席の速報ページのindex。最後は試合終了のページ"""
+    indexes = [
+        f"{inning:02d}{top_bottom}{batter:02d}00"
+        for inning in range(1, n_innings + 1)
+        for top_bottom in [1, 2]
+        for batter in range(1, n_batters + 1)
+    ]
+
+    return indexes + [END_INDEX]
+
+
+def score_page(indexes, index, revealed=None):
+    """速報ページ
+
+    Args:
+        indexes (list): score_indexesの結果
+        index (str): ページのindex
+        revealed (int): 公開済みのページ数。最後の公開済みのページにはbtn_nextを付けない。Noneなら全ページ公開
+
+    Returns:
+        str: html。公開前のページならNone
+    """
+    i = indexes.index(index)
+    revealed = len(indexes) if revealed is None else revealed
+    if i >= revealed:
+        return None
+    if index == END_INDEX:
+        return '<html><div id="sbo"><em>試合終了</em></div></html>'
+
+    inning = int(index[:2])
+    top_bottom = "表" if index[2] == "1" else "裏"
+    batter_id = 1000000 + i
+    pitcher_id = 2000000 + int(index[2])
+    next_link = f'<a id="btn_next" index="{indexes[i + 1]}">次へ</a>' if i + 1 < revealed else ""
+    # スコアテーブルの各回のリンク。公開済みの半イニングの先頭だけ
+    inning_links = "".join(
+        f'<a class="bb-gameScoreTable__score" index="{x}">0</a>' for x in indexes[:revealed] if x != END_INDEX and x[3:5] == "01"
+        )
+
+    return f'''<html><body>
+<div id="sbo"><em>{inning}回{top_bottom}</em></div>
+<table id="batt"><tr><td><a href="/npb/player/{batter_id}/top">打者</a></td><td class="dominantHand">右</td></tr></table>
+<div id="pitcherL"><a href="/npb/player/{pitcher_id}/top">投手</a><table><tr><td class="dominantHand">左</td></tr></table></div>
+<div id="result"><span>レフト前ヒット</span><em>1アウト</em></div>
+<div id="base1" href="/npb/player/{batter_id - 1}/top"></div>
+<table class="bb-gameScoreTable"><tr><td>{inning_links}</td></tr></table>
+{next_link}
+</body></html>'''
+
+
+def game_page(game_date, state, team_top="巨人", team_bottom="阪神", score=(3, 2)):
+    """試合トップページ
+
+    Args:
+        game_date (str): 試合日（YYYY-MM-DD）
+        state (str): GAME_STATESのキー
+        team_top (str): 先攻のチーム名（config_team.yamlのキー）
+        team_bottom (str): 後攻のチーム名
+        score (tuple): (先攻の得点, 後攻の得点)
+
+    Returns:
+        str: html
+    """
+    year, month, day = [int(x) for x in game_date.split("-")]
+    splits = "".join(
+        f'<table class="bb-splitsTable"><tr><td><a href="/npb/player/{3000000 + i}/top">先発</a></td></tr></table>'
+        for i in range(4)
+        )
+
+    return f'''<html><head><title>{year}年{month}月{day}日 {team_top} vs. {team_bottom}</title></head><body>
+<span class="bb-gameCard__state">{GAME_STATES[state]}</span>
+<p class="bb-gameDescription">東京ドーム
+{month}月{day}日
+18:00
+</p>
+<table>
+<tr><td><a class="bb-gameScoreTable__team">{team_top}</a></td><td class="bb-gameScoreTable__total">{score[0]}</td>
+<td class="bb-gameScoreTable__total bb-gameScoreTable__data--hits">8</td><td class="bb-gameScoreTable__total bb-gameScoreTable__data--loss">0</td></tr>
+<tr><td><a class="bb-gameScoreTable__team">{team_bottom}</a></td><td class="bb-gameScoreTable__total">{score[1]}</td>
+<td class="bb-gameScoreTable__total bb-gameScoreTable__data--hits">6</td><td class="bb-gameScoreTable__total bb-gameScoreTable__data--loss">1</td></tr>
+</table>
+<section id="pit_rec"><table><tr>
+<td class="bb-gameTable__data"><a class="bb-gameTable__player" href="/npb/player/3000000/top">勝</a></td>
+<td class="bb-gameTable__data"><a class="bb-gameTable__player" href="/npb/player/3000002/top">敗</a></td>
+<td class="bb-gameTable__data"></td>
+</tr></table></section>
+<section id="strt_mem">{splits}</section>
+<section class="bb-modCommon01"><table><tr>
+<td class="bb-tableLeft__data">球審</td><td class="bb-tableLeft__data">一塁</td>
+<td class="bb-tableLeft__data">二塁</td><td class="bb-tableLeft__data">三塁</td>
+</tr></table></section>
+<section class="bb-modCommon01"><table><tr>
+<td class="bb-tableLeft__data">40000人</td><td class="bb-tableLeft__data">3時間10分</td>
+</tr></table></section>
+</body></html>'''
+
+
+def schedule_page(game_id_nums):
+    """ゲーム一覧ページ"""
+    links = "".join(f'<a class="bb-score__content" href="/npb/game/{x}/index">試合</a>' for x in game_id_nums)
+
+    return f"<html><body>{links}</body></html>"
+
+
+def roster_page(player_nums):
+    """チームの選手一覧ページ"""
+    rows = "".join(
+        f'<tr><td class="bb-playerTable__data bb-playerTable__data--player"><a href="/npb/player/{x}/top">選手</a></td></tr>'
+        for x in player_nums
+        )
+
+    return f"<html><body><table>{rows}</table></body></html>"
+
+
+def player_page(player_num):
+    """選手ページ"""
+    profile = {
+        "生年月日（満年齢）": "1994年5月31日（26歳）",
+        "出身地": "広島",
+        "身長": "186cm",
+        "体重": "82kg",
+        "血液型": "AB",
+        "投打": "右投げ左打ち",
+        "ドラフト年（順位）": "2016年（2位）",
+        "プロ通算年": "5年",
+        "経歴": "近大福山高－近畿大－巨人",
+    }
+    items = "".join(f'<dt class="bb-profile__title">{k}</dt><dd class="bb-profile__text">{v}</dd>' for k, v in profile.items())
+
+    return f'''<html><body>
+<ruby class="bb-profile__name"><h1>選手 {player_num}</h1><rt>（センシュ）</rt></ruby>
+<p class="bb-profile__number">{int(player_num) % 100}</p>
+<dl>{items}</dl>
+<p class="bb-profile__summary">プロフィール</p>
+<div class="bb-profile__photo"><img src="https://example.com/{player_num}.jpg"></div>
+</body></html>'''
@@ -0,0 +1,93 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src.backfill import Backfill, make_shards
+from src.lake import LakeWriter
+from src.scraping import ScrapingSponavi
+
+from .utils import load_config
+
+
+@pytest.fixture
+def backfill(tmp_path):
+    """一時ディレクトリのParquetのlakeにまとめるBackfill"""
+    config = load_config()
+    config.exec_output = True
+    config.exec_lake_format = "parquet"
+    config.path_state_db = str(tmp_path / "state.sqlite")
+    config.path_output_lake_parquet = str(tmp_path / "lake_parquet")
+    config.path_backfill = str(tmp_path / "backfill")
+    ss = ScrapingSponavi(config=config, start_date=None, end_date=None)
+    yield Backfill.from_config(ss, config)
+    ss.fetch_engine.close()
+
+
+def test_make_shards_splits_dates_into_ranges():
+    dates = [f"2021-04-{d:02d}" for d in range(1, 11)]
+    shards = make_shards(dates, ["npb", "npb_farm"], 3)
+
+    assert [(x["sports"], x["start_date"], x["end_date"]) for x in shards] == [
+        ("npb", "2021-04-01", "2021-04-03"),
+        ("npb", "2021-04-04", "2021-04-06"),
+        ("npb", "2021-04-07", "2021-04-10"),
+        ("npb_farm", "2021-04-01", "2021-04-03"),
+        ("npb_farm", "2021-04-04", "2021-04-06"),
+        ("npb_farm", "2021-04-07", "2021-04-10"),
+    ]
+    assert len(make_shards(dates[:2], ["npb"], 8)) == 2
+
+
+def test_plan_skips_off_season_days(backfill):
+    backfill.shards_per_sports = 1
+    shards = backfill.plan("2021-10-20", "2021-11-01")
+
+    # 10-22〜10-29は試合期間の外
+    assert [(x["start_date"], x["end_date"]) for x in shards] == [("2021-10-20", "2021-11-01")]
+    assert backfill.plan("2021-10-22", "2021-10-29") == []
+
+
+def test_plan_rejects_years_not_in_schedule(backfill):
+    with pytest.raises(ValueError, match="2020"):
+        backfill.plan("2020-03-01", "2021-11-30")
+
+
+def write_shard(backfill, name, games, scores):
+    writer = LakeWriter(os.path.join(backfill.backfill_dir, name, "lake"), backfill.scraper.table)
+    writer.write(pd.DataFrame(games, columns=["game_id", "game_date", "game_status", "exec_datetime"]), "lake_game")
+    for game_date, rows in scores.items():
+        writer.write(pd.DataFrame(rows, columns=["game_id", "index", "result_main", "exec_datetime"]), "lake_score", game_date=game_date)
+
+    return {"name": name}
+
+
+def test_merge_dedups_shards_and_existing_games(backfill):
+    # まとめ先に1試合ある
+    backfill.scraper.save_lake(pd.DataFrame({
+        "game_id": ["npb2021040101"], "game_date": ["2021-04-01"], "game_status": ["finish"], "exec_datetime": ["2021-04-02 00:00:00"],
+    }), "lake_game")
+    shards = [
+        write_shard(backfill, "npb_a", [
+            ["npb2021040101", "2021-04-01", "finish", "2021-10-01 00:00:00"],
+            ["npb2021040201", "2021-04-02", "cancel", "2021-10-01 00:00:00"],
+        ], {"2021-04-02": [["npb2021040201", "0110100", "old", "2021-10-01 00:00:00"]]}),
+        write_shard(backfill, "npb_b", [
+            ["npb2021040201", "2021-04-02", "finish", "2021-10-02 00:00:00"],
+        ], {"2021-04-02": [
+            ["npb2021040201", "0110100", "new", "2021-10-02 00:00:00"],
+            ["npb2021040201", "0110200", "new", "2021-10-02 00:00:00"],
+        ]}),
+    ]
+
+    assert backfill.merge(shards) == {"lake_game": 1, "lake_score": 2}
+    df_game = backfill.scraper.read_lake("lake_game")
+    assert sorted(df_game["game_id"]) == ["npb2021040101", "npb2021040201"]
+    assert df_game.set_index("game_id").loc["npb2021040201", "game_status"] == "finish"
+    df_score = backfill.scraper.read_lake("lake_score")
+    assert list(df_score.sort_values("index")["result_main"]) == ["new", "new"]
+    assert backfill.scraper.state.is_completed("npb2021040201")
+
+    # まとめ直しても増えない
+    assert backfill.merge(shards) == {}
+    assert len(backfill.scraper.read_lake("lake_score")) == 2
@@ -0,0 +1,75 @@
+import pandas as pd
+
+from src.datamart import Datamart
+
+GAMES = pd.DataFrame({
+    "game_id": ["npb2021040101", "npb2021040102", "npb2021040201"],
+    "game_date": ["2021-04-01", "2021-04-01", "2021-04-02"],
+    "game_status": ["finish", "finish", "cancel"],
+    "game_series": ["pennant_race"] * 3,
+    "team_top_id": ["npb1", "npb2", "npb1"],
+    "team_bottom_id": ["npb2", "npb1", "npb2"],
+    "score_top": [3, 1, None],
+    "score_bottom": [2, 1, None],
+})
+
+
+def score_rows(game_id, rows):
+    """(index, result_main, base_1)のリストから速報ページの行を作る"""
+    return pd.DataFrame({
+        "game_id": game_id,
+        "index": [x[0] for x in rows],
+        "result_main": [x[1] for x in rows],
+        "batter_id": "npb1000001",
+        "batter_side": "右",
+        "pitcher_id": "npb2000001",
+        "pitcher_side": "左",
+        "base_1": [x[2] for x in rows],
+        "base_2": None,
+        "base_3": None,
+    })
+
+
+def test_standings_and_head_to_head():
+    datamart = Datamart()
+    assert datamart.update(GAMES) == 2
+
+    df = datamart.standings(season=2021).set_index("team_id")
+    assert df.loc["npb1", ["games", "wins", "losses", "draws", "runs_scored", "runs_allowed"]].tolist() == [2, 1, 0, 1, 4, 3]
+    assert df.loc["npb2", ["wins", "losses", "draws"]].tolist() == [0, 1, 1]
+    assert df.loc["npb2", "games_behind"] == 1.0
+    assert datamart.head_to_head(season=2021).set_index(["team_id", "opponent_id"]).loc[("npb1", "npb2"), "games"] == 2
+
+
+def test_plate_appearances_are_counted_once():
+    # 同じ打席の2ページ（盗塁と打席結果）、同じindexの重複、打席結果のないページ
+    df_score = score_rows("npb2021040101", [
+        ("0110100", "", None),
+        ("0110101", "ライト前ヒット", None),
+        ("0110101", "ライト前ヒット", None),
+        ("0110200", "盗塁成功", "x"),
+        ("0110201", "空振り三振", "x"),
+    ])
+    datamart = Datamart()
+    datamart.update(GAMES, df_score)
+
+    df = datamart.splits("batter", season=2021)
+    assert df["events"].sum() == 4
+    assert df["plate_appearances"].sum() == 2
+    assert df["hits"].sum() == 1
+    assert df["strikeouts"].sum() == 1
+    assert df["avg"].dropna().tolist() == [1.0, 0.0]
+
+
+def test_late_score_pages_are_added_to_splits(tmp_path):
+    datamart = Datamart(str(tmp_path))
+    datamart.update(GAMES, score_rows("npb2021040101", [("0110100", "四球", None)]))
+    datamart.save()
+
+    # 速報ページが後から出力された試合は、順位表を重ねずに成績だけ足し込む
+    datamart = Datamart(str(tmp_path))
+    assert datamart.new_game_ids(GAMES) == ["npb2021040102"]
+    assert datamart.update(GAMES, score_rows("npb2021040102", [("0110100", "四球", None)])) == 1
+    assert datamart.standings(season=2021)["games"].sum() == 4
+    assert datamart.splits("batter")["walks"].sum() == 2
+    assert datamart.new_game_ids(GAMES) == []
@@ -0,0 +1,164 @@
+import pandas as pd
+import pytest
+from omegaconf import OmegaConf
+
+from src.db_connection import BigQueryLoader, BigQueryTransport, LocalTransport
+
+
+@pytest.fixture
+def table():
+    return OmegaConf.load("config/config_table.yaml").table
+
+
+def game_rows(game_ids, status="finish"):
+    return pd.DataFrame({"game_id": game_ids, "game_status": status})
+
+
+def read_game(transport):
+    return transport.get_table("ba_lake", "game").sort_values("game_id", ignore_index=True)
+
+
+class FlakyTransport(LocalTransport):
+    """最初のfailures回のmergeで失敗するLocalTransport"""
+    def __init__(self, failures=1, output_dir=None):
+        super().__init__(output_dir)
+        self.failures = failures
+
+    def merge(self, df, db_name, table_name, keys, columns):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("merge failed")
+        return super().merge(df, db_name, table_name, keys, columns)
+
+
+def test_merge_is_idempotent(tmp_path, table):
+    transport = LocalTransport(str(tmp_path))
+    loader = BigQueryLoader(transport, table)
+    for _ in range(2):
+        loader.append(game_rows(["npb2021040101", "npb2021040102"]), "lake_game")
+        loader.flush()
+
+    assert list(read_game(transport)["game_id"]) == ["npb2021040101", "npb2021040102"]
+
+    # 保存したParquetから読み直しても重複しない
+    transport = LocalTransport(str(tmp_path))
+    loader = BigQueryLoader(transport, table)
+    loader.append(game_rows(["npb2021040102"], status="cancel"), "lake_game")
+    loader.append(game_rows(["npb2021040103"]), "lake_game")
+    loader.flush()
+    df = read_game(transport)
+
+    assert list(df["game_id"]) == ["npb2021040101", "npb2021040102", "npb2021040103"]
+    assert list(df["game_status"]) == ["finish", "cancel", "finish"]
+
+
+def test_flush_keeps_last_row_per_key(table):
+    transport = LocalTransport()
+    loader = BigQueryLoader(transport, table)
+    loader.append(game_rows(["npb2021040101"], status="before"), "lake_game")
+    loader.append(game_rows(["npb2021040101"], status="finish"), "lake_game")
+    loader.flush()
+
+    assert list(read_game(transport)["game_status"]) == ["finish"]
+    assert transport.load_jobs == 1
+
+
+def test_append_flushes_at_max_rows(table):
+    transport = LocalTransport()
+    loader = BigQueryLoader(transport, table, max_rows=3)
+    loader.append(game_rows(["npb2021040101", "npb2021040102"]), "lake_game")
+
+    assert transport.load_jobs == 0
+
+    loader.append(game_rows(["npb2021040103"]), "lake_game")
+
+    assert transport.load_jobs == 1
+    assert loader.buffered_rows("lake_game") == 0
+
+
+def test_failed_flush_keeps_rows(table):
+    transport = FlakyTransport(failures=1)
+    loader = BigQueryLoader(transport, table)
+    loader.append(game_rows(["npb2021040101", "npb2021040102"]), "lake_game")
+
+    with pytest.raises(ConnectionError):
+        loader.flush()
+    assert loader.buffered_rows("lake_game") == 2
+
+    loader.flush()
+
+    assert list(read_game(transport)["game_id"]) == ["npb2021040101", "npb2021040102"]
+    assert loader.buffered_rows("lake_game") == 0
+
+
+def test_failed_flush_in_append_keeps_buffering(table):
+    transport = FlakyTransport(failures=1)
+    loader = BigQueryLoader(transport, table, max_rows=1)
+    loader.append(game_rows(["npb2021040101"]), "lake_game")
+    loader.append(game_rows(["npb2021040102"]), "lake_game")
+
+    assert list(read_game(transport)["game_id"]) == ["npb2021040101", "npb2021040102"]
+
+
+class FakeJob():
+    def result(self):
+        return None
+
+
+class FakeClient():
+    """BigQueryのクライアントの代わりに、ステージングのテーブル名とクエリを記録する"""
+    def __init__(self, fail_query=False):
+        self.fail_query = fail_query
+        self.loaded = []
+        self.deleted = []
+        self.queries = []
+
+    def create_table(self, table, exists_ok=False):
+        return table
+
+    def load_table_from_file(self, buffer, table_id, job_config=None):
+        self.loaded.append(table_id)
+        return FakeJob()
+
+    def query(self, sql):
+        self.queries.append(sql)
+        if self.fail_query:
+            raise RuntimeError("query failed")
+        return FakeJob()
+
+    def delete_table(self, table_id, not_found_ok=False):
+        self.deleted.append(table_id)
+
+
+def make_transport(client):
+    from google.cloud import bigquery
+
+    transport = BigQueryTransport.__new__(BigQueryTransport)
+    transport.bigquery = bigquery
+    transport.client = client
+    transport.project_id = "project"
+
+    return transport
+
+
+def test_bigquery_merge_uses_unique_staging_table(table):
+    client = FakeClient()
+    transport = make_transport(client)
+    config = table.lake_game
+    for _ in range(2):
+        transport.merge(game_rows(["npb2021040101"]), config.db_name, config.table_name, list(config.key), config.column)
+
+    assert len(set(client.loaded)) == 2
+    assert all(x.startswith("project.ba_lake.game__staging_") for x in client.loaded)
+    assert client.deleted == client.loaded
+    assert all(f"USING `{x}`" in sql for x, sql in zip(client.loaded, client.queries))
+
+
+def test_bigquery_merge_drops_staging_table_on_error(table):
+    client = FakeClient(fail_query=True)
+    transport = make_transport(client)
+    config = table.lake_game
+
+    with pytest.raises(RuntimeError):
+        transport.merge(game_rows(["npb2021040101"]), config.db_name, config.table_name, list(config.key), config.column)
+    assert client.deleted == client.loaded
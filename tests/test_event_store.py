@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from src.event_store import EventStore
+
+
+def score_rows(game_id, n=3):
+    return pd.DataFrame({
+        "game_id": [game_id] * n,
+        "index": [f"01101{i:02d}" for i in range(n)],
+        "batter_id": [f"npb100000{i}" for i in range(n)],
+        "pitcher_id": ["npb2000001"] * n,
+        "result_main": ["ヒット"] * n,
+        "base_1": [None] + [1.0] * (n - 1),
+        "base_2": [None] * n,
+        "base_3": [None] * n,
+    })
+
+
+def finished_games(*game_ids):
+    return pd.DataFrame({"game_id": list(game_ids), "game_status": ["finish"] * len(game_ids)})
+
+
+def test_append_and_reopen(tmp_path):
+    store = EventStore(str(tmp_path))
+    assert store.append(score_rows("npb2021040101")) == 3
+    assert store.append(score_rows("npb2021040101")) == 0
+
+    store = EventStore(str(tmp_path))
+    assert len(store) == 3
+    assert store.new_game_ids(finished_games("npb2021040101", "npb2021040102")) == ["npb2021040102"]
+    assert list(store.to_frame(store.game("npb2021040101"))["batter_id"]) == ["npb1000000", "npb1000001", "npb1000002"]
+
+
+def test_interrupted_append_is_retried(tmp_path, monkeypatch):
+    store = EventStore(str(tmp_path))
+    store.append(score_rows("npb2021040101"))
+
+    def crash(self, n_rows):
+        raise OSError("crash")
+
+    # 辞書を保存した後、行数を書く前に止まる
+    monkeypatch.setattr(EventStore, "write_meta", crash)
+    with pytest.raises(OSError):
+        EventStore(str(tmp_path)).append(score_rows("npb2021040102"))
+    monkeypatch.undo()
+
+    store = EventStore(str(tmp_path))
+    assert len(store) == 3
+    assert len(store.dictionaries["game"]) == 1
+    assert store.new_game_ids(finished_games("npb2021040101", "npb2021040102")) == ["npb2021040102"]
+    assert store.append(score_rows("npb2021040102")) == 3
+    assert len(store.to_frame(store.game("npb2021040102"))) == 3
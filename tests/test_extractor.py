@@ -0,0 +1,91 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from .legacy import legacy_get_game_info
+from .utils import FIXTURE_DIR, make_url, read_fixture, same
+
+GAME_PAGES = sorted(glob.glob(os.path.join(FIXTURE_DIR, "html", "games", "*.html")))
+
+
+def test_fixtures_exist():
+    assert len(GAME_PAGES) > 0
+
+
+@pytest.mark.parametrize("file_path", GAME_PAGES, ids=os.path.basename)
+def test_game_info_matches_legacy(scraper, file_path):
+    """lxml版の抽出結果がBeautifulSoup版と項目ごとに一致する"""
+    html = read_fixture("html", "games", os.path.basename(file_path))
+    url = make_url(scraper, file_path)
+    expected = legacy_get_game_info(scraper, html, url)
+    actual = scraper.get_game_info(html, url)
+
+    assert sorted(actual) == sorted(expected)
+    for key in expected:
+        assert same(actual[key], expected[key]), (key, actual[key], expected[key])
+
+
+@pytest.mark.parametrize("file_path", GAME_PAGES, ids=os.path.basename)
+def test_game_status_matches_file_name(scraper, file_path):
+    html = read_fixture("html", "games", os.path.basename(file_path))
+
+    assert scraper.check_game_status(html) == os.path.basename(file_path).split("_")[2]
+
+
+def test_draw_keeps_partial_pitcher_record(scraper):
+    """責任投手の欄が勝ちと負けだけの引き分けは、その2つだけを持つ"""
+    file_name = "20210720_g2021072004_finish_20211001000000.html"
+    info = scraper.get_game_info(read_fixture("html", "games", file_name), make_url(scraper, file_name))
+
+    assert info["game_result"] == "drow"
+    assert np.isnan(info["picher_win_id"]) and np.isnan(info["picher_lose_id"])
+    assert "picher_save_id" not in info
+
+
+def test_score_page(scraper):
+    result, next_index = scraper.extract_score_page(read_fixture("html", "score", "score_0110100.html"), "npb2021040101", "0110100")
+
+    assert next_index == "0110200"
+    assert result["game_id"] == "npb2021040101"
+    assert result["index"] == "0110100"
+    assert (result["inning"], result["top_buttom"]) == ("1", "top")
+    assert (result["batter_id"], result["batter_side"]) == ("npb1000000", "右")
+    assert (result["pitcher_id"], result["pitcher_side"]) == ("npb2000001", "左")
+    assert (result["result_main"], result["result_sub"]) == ("レフト前ヒット", "1アウト")
+    assert result["base_1"] == "/npb/player/999999/top"
+    assert np.isnan(result["base_2"]) and np.isnan(result["base_3"])
+
+
+def test_score_page_bottom_half(scraper):
+    result, next_index = scraper.extract_score_page(read_fixture("html", "score", "score_0120200.html"), "npb2021040101", "0120200")
+
+    assert next_index == "9999999"
+    assert result["top_buttom"] == "bottom"
+    assert result["pitcher_id"] == "npb2000002"
+
+
+def test_score_page_end(scraper):
+    assert scraper.extract_score_page(read_fixture("html", "score", "score_9999999.html"), "npb2021040101", "9999999") == (None, None)
+
+
+def test_stats_table(scraper):
+    extractor = scraper.stats_extractors["lake_player_batting"]
+    df = extractor.extract(read_fixture("html", "memberlist", "memberlist_b.html"), "npb1")
+
+    # リンクのない合計の行は除く
+    assert list(df["player_id"]) == ["npb1000001", "npb1000002"]
+    assert list(df["team_id"]) == ["npb1", "npb1"]
+    # 見出しで列を突き合わせるので、表の列の順に依らない
+    assert list(df["number"]) == ["1", "00"]
+    assert list(df["batting_side"]) == ["右", "左"]
+    assert df.loc[0, ["games", "plate_appearances", "home_runs", "hits"]].tolist() == [143, 601, 25, 168]
+    assert df.loc[0, "avg"] == 0.312
+    # "-"は記録なし、整数の列の小数は欠損にする
+    assert df.loc[1, ["games", "plate_appearances", "home_runs", "hits"]].isna().all()
+    assert np.isnan(df.loc[1, "avg"])
+    assert str(df["games"].dtype) == "Int64" and str(df["avg"].dtype) == "float64"
+    # 見出しのない列は欠損、列定義にない見出しは記録する
+    assert df["at_bats"].isna().all()
+    assert "出塁率変動" in extractor.unknown_headers
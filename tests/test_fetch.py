@@ -0,0 +1,204 @@
+import email.utils
+import time
+
+import pytest
+import requests
+
+from src.fetch import CircuitBreaker, FetchEngine, TokenBucket, parse_retry_after
+
+URL = "https://baseball.yahoo.co.jp/npb/game/2021040101/score?index=0110200"
+
+
+class FakeClock():
+    """sleepで進む時計"""
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse():
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(str(self.status_code))
+
+
+class FakeSession():
+    """順に応答を返すセッション。応答が例外ならそれを送出する"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requested = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requested.append(url)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+
+def make_engine(responses, **kwargs):
+    failures = []
+    kwargs.setdefault("rate_per_host", 0)
+    kwargs.setdefault("backoff_base", 0)
+    engine = FetchEngine(on_failure=lambda url, reason: failures.append((url, reason)), **kwargs)
+    engine.session = FakeSession(responses)
+
+    return engine, failures
+
+
+def test_speculative_failure_is_not_recorded():
+    engine, failures = make_engine([FakeResponse(503), requests.exceptions.ReadTimeout()], breaker_threshold=1)
+
+    assert engine.fetch(URL, speculative=True) is None
+    assert engine.submit(URL, speculative=True).result() is None
+    assert failures == []
+    assert engine.get_breaker(URL).is_closed()
+    # 取り直さない
+    assert len(engine.session.requested) == 2
+    engine.close()
+
+
+def test_failure_is_recorded_after_retries():
+    engine, failures = make_engine([FakeResponse(503), FakeResponse(503)], max_retries=1)
+
+    assert engine.fetch(URL) is None
+    assert failures == [(URL, "503")]
+    assert len(engine.session.requested) == 2
+    engine.close()
+
+
+def test_token_bucket_refills_at_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+
+    # 容量の分は待たずに取れ、その後は1/rate秒ごとに1つ
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    # 空いた時間の分だけ補充され、容量を超えてはたまらない
+    clock.now += 10
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.now == pytest.approx(111.5)
+
+
+def test_token_bucket_without_rate_never_waits():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0, clock=clock, sleep=clock.sleep)
+
+    assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+    assert clock.sleeps == []
+
+
+def test_engine_spaces_requests_per_host():
+    clock = FakeClock()
+    engine, _ = make_engine([FakeResponse(200, "a"), FakeResponse(200, "b"), FakeResponse(200, "c")], rate_per_host=1, clock=clock, sleep=clock.sleep)
+
+    assert [engine.fetch(URL) for _ in range(3)] == ["a", "b", "c"]
+    assert clock.sleeps == [pytest.approx(1.0), pytest.approx(1.0)]
+    engine.close()
+
+
+@pytest.mark.parametrize("retry_after, backoff_max, expected", [
+    ("7", 60, 7.0),
+    ("120", 60, 60.0),
+])
+def test_engine_honours_retry_after(retry_after, backoff_max, expected):
+    clock = FakeClock()
+    engine, failures = make_engine(
+        [FakeResponse(429, headers={"Retry-After": retry_after}), FakeResponse(200, "ok")],
+        backoff_base=1, backoff_max=backoff_max, clock=clock, sleep=clock.sleep,
+        )
+
+    assert engine.fetch(URL) == "ok"
+    assert clock.sleeps == [expected]
+    assert failures == []
+    engine.close()
+
+
+def test_engine_backs_off_exponentially_without_retry_after():
+    clock = FakeClock()
+    engine, failures = make_engine([FakeResponse(503)] * 4, backoff_base=1, max_retries=3, breaker_threshold=0, clock=clock, sleep=clock.sleep)
+
+    assert engine.fetch(URL) is None
+    assert len(engine.session.requested) == 4
+    assert [0 <= wait <= 2 ** i for i, wait in enumerate(clock.sleeps)] == [True] * 3
+    assert failures == [(URL, "503")]
+    engine.close()
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after("soon") is None
+    http_date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= parse_retry_after(http_date) <= 30
+
+
+def test_circuit_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    # 開いている間は送らない
+    assert not breaker.allow()
+    clock.now += 9.9
+    assert not breaker.allow()
+
+    # reset_seconds後に1件だけ試す。試している間はほかを止める
+    clock.now += 0.1
+    assert breaker.allow()
+    assert not breaker.allow()
+    # 試しに失敗したらまたreset_seconds開く
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+    # 試しに成功したら閉じる
+    breaker.record_success()
+    assert breaker.is_closed()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_circuit_breaker_without_threshold_never_opens():
+    breaker = CircuitBreaker(failure_threshold=0, clock=FakeClock())
+    for _ in range(10):
+        breaker.record_failure()
+
+    assert breaker.allow()
+
+
+def test_engine_stops_sending_to_open_host():
+    clock = FakeClock()
+    engine, failures = make_engine([FakeResponse(503), FakeResponse(503), FakeResponse(200, "ok")],
+                                   max_retries=0, breaker_threshold=2, breaker_reset_seconds=30, clock=clock, sleep=clock.sleep)
+
+    assert engine.fetch(URL) is None
+    assert engine.fetch(URL) is None
+    assert engine.fetch(URL) is None
+    assert len(engine.session.requested) == 2
+    assert [reason for _, reason in failures] == ["503", "503", "circuit_open"]
+
+    clock.now += 30
+    assert engine.fetch(URL) == "ok"
+    assert engine.get_breaker(URL).is_closed()
+    engine.close()
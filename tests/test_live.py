@@ -0,0 +1,100 @@
+from src.live import LivePoller
+
+
+class FakeClock():
+    """sleepで進む時計"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeState():
+    def __init__(self, completed):
+        self.completed = set(completed)
+
+    def is_completed(self, game_id):
+        return game_id in self.completed
+
+    def get_game(self, game_id):
+        return None
+
+
+class FakeScraper():
+    """試合ごとに確認のたびの状態と新しい投球の数を順に返すスクレイパー
+
+    Args:
+        games (dict): 試合番号 -> [(状態, 新しい投球の数), ...]。最後の要素はその後も返し続ける
+        completed (list): 出力まで終わっている試合のID
+    """
+    base_url = "https://baseball.yahoo.co.jp/npb"
+    upload_flag = False
+    output_game_html_path = None
+
+    def __init__(self, games, completed=()):
+        self.games = {k: list(v) for k, v in games.items()}
+        self.state = FakeState(completed)
+        self.polls = []
+        self.written = []
+
+    def make_id(self, game_id_num):
+        return "npb" + game_id_num
+
+    def get_html(self, url, use_cache=True):
+        if "/schedule/" in url:
+            return "".join(f'<a class="bb-score__content" href="/npb/game/{x}/index">試合</a>' for x in self.games)
+        game_id_num = url.split("/")[-2]
+        self.polls.append(game_id_num)
+        steps = self.games[game_id_num]
+        self.current = steps.pop(0) if len(steps) > 1 else steps[0]
+        return self.current[0]
+
+    def check_game_status(self, html):
+        return html
+
+    def get_score_info(self, game_id, after_index=None, checkpoint=None, live=False):
+        return [None] * self.current[1]
+
+    def save_score_checkpoint(self, df_score, game_date=None):
+        pass
+
+    def get_game_info(self, html, url):
+        return {}
+
+    def write_games(self, games, output_dir=None):
+        self.written += [x[1] for x in games]
+
+
+def make_poller(scraper):
+    clock = FakeClock()
+    return LivePoller(scraper, min_interval=5, max_interval=120, backoff=2.0, clock=clock, sleep=clock.sleep), clock
+
+
+def test_stops_when_all_games_are_final():
+    scraper = FakeScraper({
+        "2021040101": [("before", 0), ("live", 3), ("live", 0), ("finish", 2)],
+        "2021040102": [("live", 1), ("cancel", 0)],
+        "2021040103": [("finish", 0)],
+    }, completed=["npb2021040103"])
+    poller, clock = make_poller(scraper)
+
+    assert poller.run("2021-04-01") == 6
+    # 出力済みの試合は確認せず、終わった試合はそれ以上確認しない
+    assert scraper.polls == ["2021040101", "2021040102", "2021040102", "2021040101", "2021040101", "2021040101"]
+    assert sorted(scraper.written) == ["2021040101", "2021040102"]
+    assert all(game.done for game in poller.games.values())
+    # 試合前はmax_interval、投球があればmin_interval、なければbackoff倍で待つ
+    assert clock.now == 120 + 5 + 10
+
+
+def test_stops_after_max_seconds():
+    scraper = FakeScraper({"2021040101": [("live", 0)]})
+    poller, clock = make_poller(scraper)
+
+    assert poller.run("2021-04-01", max_seconds=300) == 0
+    assert not poller.games["2021040101"].done
+    assert 300 <= clock.now < 300 + 120
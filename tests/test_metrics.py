@@ -0,0 +1,82 @@
+import json
+
+from src.metrics import Histogram, Metrics, page_type
+
+
+def make_metrics():
+    metrics = Metrics()
+    metrics.inc("requests", page="score", status=200)
+    metrics.inc("requests", 2, page="score", status=200)
+    metrics.inc("requests", page="game", status="error")
+    metrics.inc("bytes_downloaded", 1024, page="score")
+    metrics.observe("fetch_seconds", 0.003, page="score")
+    metrics.observe("fetch_seconds", 0.2, page="score")
+    metrics.observe("fetch_seconds", 60.0, page="score")
+
+    return metrics
+
+
+def test_histogram_buckets_and_quantile():
+    histogram = Histogram([0.1, 1.0])
+    assert histogram.quantile(0.5) is None
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+
+    # 区切りちょうどの値はその区切りに入る
+    assert histogram.to_dict() == {"count": 4, "sum": 2.65, "buckets": {"0.1": 2, "1.0": 1, "+Inf": 1}}
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(0.95) == float("inf")
+
+
+def test_page_type():
+    assert page_type("https://baseball.yahoo.co.jp/npb/game/2021040101/score?index=0110100") == "score"
+    assert page_type("https://baseball.yahoo.co.jp/npb/game/2021040101/top") == "game"
+    assert page_type("https://baseball.yahoo.co.jp/npb/schedule/?date=2021-04-01") == "schedule"
+    assert page_type("https://baseball.yahoo.co.jp/npb/teams/1/memberlist?kind=b") == "roster"
+    assert page_type("https://example.com/") == "other"
+
+
+def test_prometheus_text():
+    lines = make_metrics().to_prometheus().splitlines()
+
+    assert lines[:6] == [
+        "# TYPE sokuho_bytes_downloaded_total counter",
+        'sokuho_bytes_downloaded_total{page="score"} 1024',
+        "# TYPE sokuho_requests_total counter",
+        'sokuho_requests_total{page="game",status="error"} 1',
+        'sokuho_requests_total{page="score",status="200"} 3',
+        "# TYPE sokuho_fetch_seconds histogram",
+    ]
+    # バケットは累積で、最後の+Infは件数と同じ
+    assert 'sokuho_fetch_seconds_bucket{page="score",le="0.005"} 1' in lines
+    assert 'sokuho_fetch_seconds_bucket{page="score",le="0.25"} 2' in lines
+    assert 'sokuho_fetch_seconds_bucket{page="score",le="30.0"} 2' in lines
+    assert 'sokuho_fetch_seconds_bucket{page="score",le="+Inf"} 3' in lines
+    assert 'sokuho_fetch_seconds_count{page="score"} 3' in lines
+    assert lines[-2] == 'sokuho_fetch_seconds_sum{page="score"} 60.203'
+
+
+def test_counter_already_ending_in_total():
+    metrics = Metrics()
+    metrics.inc("errors_total")
+
+    assert metrics.to_prometheus() == "# TYPE sokuho_errors_total counter\nsokuho_errors_total 1\n"
+
+
+def test_write_json_and_prom(tmp_path):
+    metrics = make_metrics()
+    json_path = metrics.write(str(tmp_path / "metrics"), "run_20210401")
+
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["elapsed_seconds"] >= 0
+    assert data["counters"][1:] == [
+        {"name": "requests", "labels": {"page": "game", "status": "error"}, "value": 1},
+        {"name": "requests", "labels": {"page": "score", "status": "200"}, "value": 3},
+    ]
+    [histogram] = data["histograms"]
+    assert histogram["name"] == "fetch_seconds" and histogram["labels"] == {"page": "score"}
+    assert histogram["count"] == 3
+    assert histogram["buckets"]["0.005"] == 1 and histogram["buckets"]["+Inf"] == 1
+    assert (tmp_path / "metrics" / "run_20210401.prom").read_text(encoding="utf-8") == metrics.to_prometheus()
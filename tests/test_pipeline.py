@@ -0,0 +1,46 @@
+from src.pipeline import SINK_NAME, BatchSink, Pipeline, Stage
+
+
+def test_failed_batch_records_every_item():
+    """書き込みに失敗したバッチは、その全要素がエラーとして残る"""
+    written = []
+
+    def flush(items):
+        if 13 in items:
+            raise ValueError("broken batch")
+        written.extend(items)
+
+    pipeline = Pipeline(
+        [Stage("pass", lambda x: [x], workers=2)],
+        sink=BatchSink(flush, batch_size=5),
+        queue_size=4,
+        )
+    errors = pipeline.run(range(20))
+
+    failed = sorted(item for _, item, _ in errors)
+    assert all(stage_name == SINK_NAME for stage_name, _, _ in errors)
+    assert 13 in failed and len(failed) == 5
+    assert sorted(written + failed) == list(range(20))
+
+
+def test_failed_final_flush_records_every_item():
+    def flush(items):
+        raise ValueError("sink down")
+
+    errors = Pipeline([Stage("pass", lambda x: [x])], sink=BatchSink(flush, batch_size=100)).run(range(3))
+
+    assert sorted(item for _, item, _ in errors) == [0, 1, 2]
+
+
+def test_stage_error_skips_only_that_item():
+    written = []
+
+    def parse(x):
+        if x == 2:
+            raise KeyError(x)
+        yield x
+
+    errors = Pipeline([Stage("parse", parse)], sink=BatchSink(written.extend, batch_size=2)).run(range(5))
+
+    assert [(stage_name, item) for stage_name, item, _ in errors] == [("parse", 2)]
+    assert sorted(written) == [0, 1, 3, 4]
@@ -0,0 +1,37 @@
+import datetime
+
+import pandas as pd
+
+from src.player_dim import CLOSED_HASH, PlayerDimension, to_scd
+
+TODAY = datetime.date(2021, 10, 1)
+
+
+def lake_player(rows):
+    return pd.DataFrame(rows, columns=["player_id", "team_id", "valid_from", "profile_hash", "exec_datetime"])
+
+
+def test_close_unseen_players():
+    df_player = lake_player([
+        ["npb1000001", "npb1", "2021-04-01", "a", "2021-04-01 00:00:00"],
+        ["npb1000002", "npb1", "2021-04-01", "b", "2021-04-01 00:00:00"],
+    ])
+    dim = PlayerDimension.from_lake(df_player)
+    dim.plan("npb1000001", "npb1", TODAY)
+
+    closed = dim.close_unseen(TODAY)
+    assert [r["player_id"] for r in closed] == ["npb1000002"]
+    assert closed[0]["team_id"] is None and closed[0]["profile_hash"] == CLOSED_HASH
+
+    # 閉じた選手は現在の版がなくなり、名簿に戻れば新しい選手として取得する
+    df_closed = lake_player([[r["player_id"], r["team_id"], r["valid_from"], r["profile_hash"], "2021-10-01 00:00:00"] for r in closed])
+    df_scd = to_scd(pd.concat([df_player, df_closed], ignore_index=True))
+    assert df_scd.set_index(["player_id", "valid_from"])["is_current"].to_dict() == {
+        ("npb1000001", "2021-04-01"): True,
+        ("npb1000002", "2021-04-01"): False,
+        ("npb1000002", "2021-10-01"): False,
+    }
+    dim = PlayerDimension.from_lake(pd.concat([df_player, df_closed], ignore_index=True))
+    assert dim.plan("npb1000002", "npb2", TODAY) == "new"
+    dim.plan("npb1000001", "npb1", TODAY)
+    assert dim.close_unseen(TODAY) == []
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from src.query import LakeQuery
+
+from .utils import load_config
+
+LAKE = {
+    "lake_game": pd.DataFrame({"game_id": ["npb2021040101", "npb2021040102"], "game_date": ["2021-04-01", "2021-04-01"]}),
+    "lake_score": pd.DataFrame({"game_id": ["npb2021040101", "npb2021040102"], "index": ["0110100", "0110100"]}),
+}
+
+
+def read_lake(table_name, columns=None, game_ids=None):
+    df = LAKE.get(table_name)
+    if df is None:
+        return None
+
+    return df[df["game_id"].isin(game_ids)] if game_ids is not None else df
+
+
+@pytest.fixture
+def query():
+    lake_query = LakeQuery(":memory:", load_config().table)
+    yield lake_query
+    lake_query.conn.close()
+
+
+def test_sync_adds_new_games_once(query):
+    assert query.sync(read_lake) == {"lake_game": 2, "lake_score": 2}
+    assert query.sync(read_lake) == {"lake_game": 0}
+    assert len(query.query("game_events", game_id="npb2021040101")) == 1
+
+
+def test_failed_score_load_rolls_back_games(query, monkeypatch):
+    execute_insert = LakeQuery.execute_insert
+
+    def fail_score(self, df, table_name):
+        if table_name == "lake_score":
+            raise RuntimeError("score load failed")
+        return execute_insert(self, df, table_name)
+
+    monkeypatch.setattr(LakeQuery, "execute_insert", fail_score)
+    with pytest.raises(RuntimeError):
+        query.sync(read_lake)
+    assert query.loaded_game_ids("lake_game") == set()
+
+    # 次のsyncで試合と速報ページを両方入れる
+    monkeypatch.setattr(LakeQuery, "execute_insert", execute_insert)
+    assert query.sync(read_lake) == {"lake_game": 2, "lake_score": 2}
+    assert query.loaded_game_ids("lake_score") == {"npb2021040101", "npb2021040102"}
@@ -0,0 +1,108 @@
+import os
+import shutil
+
+import pytest
+
+from src.cache import HtmlCache
+from src.replay import ArchiveReplay
+from src.scraping import ScrapingSponavi
+
+from .utils import FIXTURE_DIR, load_config, read_fixture
+
+GAMES = {
+    "2021040101": "20210401_g2021040101_finish_20211001000000.html",
+    "2021061502": "20210615_g2021061502_finish_20211001000000.html",
+}
+SCORE_INDEXES = ["0110100", "0120200"]
+
+
+@pytest.fixture(params=["parquet", "tsv"])
+def replay_env(tmp_path, request):
+    """一時ディレクトリにアーカイブ、キャッシュ、lakeを置くスクレイパー"""
+    config = load_config()
+    config.exec_output = True
+    config.exec_lake_format = request.param
+    config.path_state_db = str(tmp_path / "state.sqlite")
+    config.path_output_lake_parquet = str(tmp_path / "lake_parquet")
+    config.path_output_lake_tsv = str(tmp_path / "lake")
+    os.makedirs(config.path_output_lake_tsv)
+    ss = ScrapingSponavi(config=config, start_date=None, end_date=None)
+
+    archive_dir = tmp_path / "games"
+    archive_dir.mkdir()
+    for game_id_num, file_name in GAMES.items():
+        game_date = file_name[:4] + "-" + file_name[4:6] + "-" + file_name[6:8]
+        shutil.copy(os.path.join(FIXTURE_DIR, "html", "games", file_name), archive_dir / f"{game_date}_g{game_id_num}_finish_20211001000000.html")
+
+    cache = HtmlCache(str(tmp_path / "cache"))
+    for index in SCORE_INDEXES:
+        cache.put(score_url(ss, index), read_fixture("html", "score", f"score_{index}.html"))
+
+    yield ss, config, archive_dir, cache
+    ss.fetch_engine.close()
+
+
+def score_url(ss, index):
+    return ss.base_url + "/game/2021040101/score?index=" + index
+
+
+def staging_dir(ss, config):
+    return ArchiveReplay(ss, config).lake_dir() + ".replay_staging"
+
+
+def replay(ss, config, archive_dir, cache, overwrite):
+    return ArchiveReplay(ss, config, workers=1, overwrite=overwrite).run(str(archive_dir), cache_dir=cache.cache_dir)
+
+
+def test_overwrite_defaults_to_true(replay_env):
+    ss, config, _, _ = replay_env
+    assert ArchiveReplay.from_config(ss, config).overwrite is True
+
+
+@pytest.mark.parametrize("overwrite", [True, False])
+def test_replay_twice_keeps_one_row_per_key(replay_env, overwrite):
+    ss, config, archive_dir, cache = replay_env
+    replay(ss, config, archive_dir, cache, overwrite=overwrite)
+    stats = replay(ss, config, archive_dir, cache, overwrite=overwrite)
+
+    assert sorted(ss.read_lake("lake_game")["game_id"]) == ["npb2021040101", "npb2021061502"]
+    assert sorted(ss.read_lake("lake_score")["index"].astype(str)) == SCORE_INDEXES
+    if not overwrite:
+        assert stats["lake_game"]["rows"] == 0
+        assert stats["lake_score"]["rows"] == 0
+
+
+def test_rebuild_keeps_rows_without_source(replay_env):
+    ss, config, archive_dir, cache = replay_env
+    replay(ss, config, archive_dir, cache, overwrite=False)
+    assert sorted(ss.read_lake("lake_game")["game_id"]) == ["npb2021040101", "npb2021061502"]
+    assert len(ss.read_lake("lake_score")) == 2
+
+    # アーカイブが消えた試合とキャッシュから消えた速報ページの行は残す
+    os.remove(next(archive_dir.glob("*_g2021061502_*")))
+    os.remove(cache.make_path(score_url(ss, SCORE_INDEXES[1])))
+    stats = replay(ss, config, archive_dir, cache, overwrite=True)
+
+    df_game = ss.read_lake("lake_game")
+    assert sorted(df_game["game_id"]) == ["npb2021040101", "npb2021061502"]
+    df_score = ss.read_lake("lake_score")
+    assert sorted(df_score["index"].astype(str)) == SCORE_INDEXES
+    assert stats["lake_game"]["kept"] == 1
+    assert stats["lake_score"]["kept"] == 1
+    assert not os.path.exists(staging_dir(ss, config))
+
+
+def test_failed_check_leaves_lake(replay_env, monkeypatch):
+    ss, config, archive_dir, cache = replay_env
+    replay(ss, config, archive_dir, cache, overwrite=False)
+
+    def fail(self, staging_dir, n_rows, old_keys):
+        raise RuntimeError("check failed")
+
+    monkeypatch.setattr(ArchiveReplay, "verify", fail)
+    with pytest.raises(RuntimeError):
+        replay(ss, config, archive_dir, cache, overwrite=True)
+
+    assert len(ss.read_lake("lake_game")) == 2
+    assert len(ss.read_lake("lake_score")) == 2
+    assert not os.path.exists(staging_dir(ss, config))
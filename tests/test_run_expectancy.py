@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from src.run_expectancy import RunExpectancy, base_out_events
+
+GAMES = pd.DataFrame({
+    "game_id": ["npb2021040101", "npb2021040102"],
+    "game_date": ["2021-04-01", "2021-04-01"],
+    "game_status": ["finish", "finish"],
+})
+
+# (index, result_main, result_sub, 打席前の走者)。走者は1塁, 2塁, 3塁の順
+PLAYS = [
+    # 1回表: ヒット、併殺、本塁打、三振で3アウト
+    ("0110100", "レフト前ヒット", "", (0, 0, 0)),
+    ("0110200", "ショートゴロ併殺", "", (1, 0, 0)),
+    ("0110300", "ライトへホームラン", "", (0, 0, 0)),
+    ("0110400", "空振り三振", "", (0, 0, 0)),
+    # 1回裏: 3アウトまで続かない。最後の打席の得点は「N点」から
+    ("0120100", "見逃し三振", "1アウト", (0, 0, 0)),
+    ("0120200", "四球", "", (0, 0, 0)),
+    ("0120300", "レフト二塁打", "1点", (1, 0, 0)),
+]
+
+
+def score_rows(game_id="npb2021040101", plays=PLAYS):
+    return pd.DataFrame({
+        "game_id": game_id,
+        "index": [x[0] for x in plays],
+        "result_main": [x[1] for x in plays],
+        "result_sub": [x[2] for x in plays],
+        "batter_id": [f"npb10000{i:02d}" for i in range(len(plays))],
+        "pitcher_id": "npb2000001",
+        "base_1": ["x" if x[3][0] else None for x in plays],
+        "base_2": ["x" if x[3][1] else None for x in plays],
+        "base_3": ["x" if x[3][2] else None for x in plays],
+    })
+
+
+def test_base_out_events():
+    df = base_out_events(score_rows())
+
+    assert df["outs_before"].tolist() == [0, 0, 2, 2, 0, 1, 1]
+    assert df["outs_after"].tolist() == [0, 2, 2, 3, 1, 1, 1]
+    assert df["runs"].tolist() == [0, 0, 1, 0, 0, 0, 1]
+    assert df["state_before"].tolist() == [0, 1, 16, 16, 0, 8, 9]
+    assert df["state_after"].tolist() == [1, 16, 16, 24, 8, 9, 8]
+    assert df["runs_to_end"].tolist() == [1, 1, 1, 0, 1, 1, 1]
+    assert df["complete"].tolist() == [True] * 4 + [False] * 3
+
+
+def test_matrix_uses_complete_innings():
+    run_expectancy = RunExpectancy()
+    assert run_expectancy.update(GAMES, score_rows()) == 1
+
+    matrix = run_expectancy.matrix(2021)
+    assert matrix.loc["___", 0] == 1.0
+    assert matrix.loc["1__", 0] == 1.0
+    assert matrix.loc["___", 2] == 0.5
+    assert matrix.isna().to_numpy().sum() == 21
+
+    # 1回裏の打席もRE24には数える
+    df = run_expectancy.re24("batter", 2021).set_index("player_id")
+    assert df.loc["npb1000006", "runs"] == 1
+    assert np.isclose(df["events"].sum(), 7)
+
+
+def test_games_without_score_rows_wait():
+    run_expectancy = RunExpectancy()
+    assert run_expectancy.update(GAMES, score_rows()) == 1
+    assert run_expectancy.new_game_ids(GAMES) == ["npb2021040102"]
+
+    assert run_expectancy.update(GAMES, score_rows("npb2021040102", PLAYS[:4])) == 1
+    assert run_expectancy.new_game_ids(GAMES) == []
+    assert run_expectancy.matrix(2021).loc["___", 2] == 0.5
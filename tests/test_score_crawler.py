@@ -0,0 +1,98 @@
+import pytest
+
+from src.fetch import FetchError
+from src.score_crawler import ScoreCrawler
+
+from .pages import score_indexes, score_page
+
+INDEXES = score_indexes(n_innings=2, n_batters=3)
+
+
+def serve_pages(monkeypatch, scraper, pages):
+    """scraperの取得をpagesのURLからhtmlへの辞書に置き換える。ないURLはNone"""
+    requested = []
+
+    def fetch(url, use_cache=True, speculative=False):
+        requested.append(url)
+        return pages.get(url)
+
+    monkeypatch.setattr(scraper.fetch_engine, "fetch", fetch)
+
+    return requested
+
+
+def game_pages(scraper, game_id, drop_links=()):
+    """1試合の速報ページ。drop_linksの半イニングの先頭へのスコアテーブルのリンクを消す"""
+    pages = {}
+    for index in INDEXES:
+        html = score_page(INDEXES, index)
+        for dropped in drop_links:
+            html = html.replace(f'<a class="bb-gameScoreTable__score" index="{dropped}">0</a>', "")
+        pages[scraper.get_score_url(game_id, index)] = html
+
+    return pages
+
+
+@pytest.fixture
+def crawler(scraper):
+    crawler = ScoreCrawler(scraper, workers=2, prefetch_depth=1)
+    yield crawler
+    crawler.game_executor.shutdown()
+    crawler.inning_executor.shutdown()
+
+
+def test_crawl_follows_all_half_innings(monkeypatch, scraper, crawler):
+    serve_pages(monkeypatch, scraper, game_pages(scraper, "npb2021040101"))
+    df = crawler.crawl("npb2021040101")
+
+    assert list(df["index"]) == INDEXES[:-1]
+
+
+def test_crawl_falls_back_to_btn_next_when_links_are_missing(monkeypatch, scraper, crawler):
+    """スコアテーブルに1回裏と2回表の先頭へのリンクがなくても、btn_nextに従って全ページを取得する"""
+    serve_pages(monkeypatch, scraper, game_pages(scraper, "npb2021040101", drop_links=["0120100", "0210100"]))
+    df = crawler.crawl("npb2021040101")
+
+    assert list(df["index"]) == INDEXES[:-1]
+
+
+def test_crawl_many_keeps_games_that_succeeded(monkeypatch, scraper, crawler):
+    """1試合の途中のページが取れなくても、他の試合の結果は返す"""
+    pages = {**game_pages(scraper, "npb2021040101"), **game_pages(scraper, "npb2021040102")}
+    del pages[scraper.get_score_url("npb2021040102", "0120200")]
+    serve_pages(monkeypatch, scraper, pages)
+    dict_score_info, dict_error = crawler.crawl_many(["npb2021040101", "npb2021040102"])
+
+    assert list(dict_score_info) == ["npb2021040101"]
+    assert list(dict_score_info["npb2021040101"]["index"]) == INDEXES[:-1]
+    assert list(dict_error) == ["npb2021040102"]
+    assert isinstance(dict_error["npb2021040102"], FetchError)
+
+
+def test_get_score_infos_checkpoints_succeeded_games_before_raising(monkeypatch, scraper, crawler):
+    pages = {**game_pages(scraper, "npb2021040101"), **game_pages(scraper, "npb2021040102")}
+    del pages[scraper.get_score_url("npb2021040102", "0210200")]
+    serve_pages(monkeypatch, scraper, pages)
+    monkeypatch.setattr(scraper, "score_crawler", crawler)
+    saved = []
+
+    with pytest.raises(FetchError):
+        scraper.get_score_infos(["npb2021040101", "npb2021040102"], checkpoint=lambda game_id, df, *args: saved.append(game_id))
+
+    assert saved == ["npb2021040101"]
+
+
+def test_failed_prefetch_is_fetched_again(monkeypatch, scraper, crawler):
+    """先読みで取れなかったページは通常の取得で取り直す"""
+    pages = game_pages(scraper, "npb2021040101")
+    requested = []
+
+    def fetch(url, use_cache=True, speculative=False):
+        requested.append((url, speculative))
+        return None if speculative else pages.get(url)
+
+    monkeypatch.setattr(scraper.fetch_engine, "fetch", fetch)
+    df = crawler.crawl("npb2021040101")
+
+    assert list(df["index"]) == INDEXES[:-1]
+    assert any(speculative for _, speculative in requested)
@@ -0,0 +1,42 @@
+from omegaconf import OmegaConf
+
+from src.season_calendar import SeasonCalendar
+
+SCHEDULE = OmegaConf.create({
+    "year_2021": {
+        "pre_season_match": {"start_date": "2021-03-02", "end_date": "2021-03-25"},
+        "pennant_race": {"start_date": "2021-03-26", "end_date": "2021-10-21"},
+        "climax_series": {"start_date": "2021-10-30", "end_date": "2021-11-10"},
+        "nihon_series": {"start_date": "2021-11-10", "end_date": "2021-12-10"},
+    },
+})
+
+
+def test_classify_boundaries():
+    calendar = SeasonCalendar(SCHEDULE)
+    dates = ["2021-03-01", "2021-03-02", "2021-03-25", "2021-03-26", "2021-10-21", "2021-10-22", "2021-10-29",
+             "2021-10-30", "2021-11-10", "2021-11-11", "2021-12-10", "2021-12-11"]
+
+    assert list(calendar.classify(dates)) == [
+        None, "pre_season_match", "pre_season_match", "pennant_race", "pennant_race", None, None,
+        # 重なる日は先に書かれている種類
+        "climax_series", "climax_series", "nihon_series", "nihon_series", None,
+    ]
+    assert calendar.get_series("2021-11-10") == "climax_series"
+    assert calendar.get_series("2020-06-01") is None
+
+
+def test_report_uncovered(capsys):
+    calendar = SeasonCalendar(SCHEDULE)
+
+    assert calendar.report_uncovered(["2021-04-01", "2021-10-21"]) == []
+    assert capsys.readouterr().out == ""
+
+    dates = ["2020-12-31", "2021-01-01", "2021-03-01", "2021-03-02", "2021-10-22", "2021-10-23", "2021-10-29", "2021-10-30"]
+    assert calendar.report_uncovered(dates) == [
+        ("2020-12-31", "2021-01-01"), ("2021-03-01", "2021-03-01"), ("2021-10-22", "2021-10-23"), ("2021-10-29", "2021-10-29"),
+    ]
+    out = capsys.readouterr().out
+    assert "years not in config_schedule.yaml: [2020]" in out
+    assert "2021-10-22..2021-10-23" in out
+    assert calendar.missing_years(dates) == [2020]
@@ -0,0 +1,20 @@
+from src.state import ScrapingState
+
+
+def test_resume_date_moves_past_game_that_keeps_failing(tmp_path):
+    state = ScrapingState(str(tmp_path / "state.sqlite"), max_failures=3)
+    state.save_game("npb2021071901", game_date="2021-07-19", game_status="unkown", completed=False)
+    state.save_game("npb2021072001", game_date="2021-07-20", game_status="finish", completed=True)
+    state.save_date("2021-07-19", 1)
+    state.save_date("2021-07-20", 1)
+
+    assert state.get_resume_date() == "2021-07-19"
+    assert not state.save_game_failure("npb2021071901", "KeyError('オールセ')")
+    assert not state.save_game_failure("npb2021071901", "KeyError('オールセ')")
+    assert state.get_resume_date() == "2021-07-19"
+
+    assert state.save_game_failure("npb2021071901", "KeyError('オールセ')")
+    assert state.is_failed("npb2021071901")
+    assert state.get_game("npb2021071901")["last_error"] == "KeyError('オールセ')"
+    assert state.get_resume_date() == "2021-07-21"
+
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+from omegaconf import OmegaConf
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(*path):
+    with open(os.path.join(FIXTURE_DIR, *path), encoding="utf-8") as f:
+        return f.read()
+
+
+def load_config(conf_dir="config"):
+    config = OmegaConf.merge(*[
+        OmegaConf.load(os.path.join(conf_dir, file_name))
+        for file_name in ["config_exec.yaml", "config_path.yaml", "config_url.yaml", "config_team.yaml", "config_schedule.yaml", "config_table.yaml"]
+    ])
+    # テストやベンチマークでは出力もアップロードもしない
+    config.exec_output = False
+    config.exec_upload = False
+
+    return config
+
+
+def make_url(ss, file_path):
+    """date_gid_status_execdatetime.htmlのファイル名から試合のURLを復元する"""
+    game_id_num = os.path.basename(file_path).split("_")[1].lstrip("g")
+    return ss.base_url + "/game/" + game_id_num + "/top"
+
+
+def same(a, b):
+    return a == b or (isinstance(a, float) and isinstance(b, float) and np.isnan(a) and np.isnan(b))